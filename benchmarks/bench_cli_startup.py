@@ -0,0 +1,119 @@
+"""
+Startup-time benchmark for `python -m src.cli`: wall time of every command in a
+fresh interpreter, and the heavy packages (LLM stack, GitPython, uvicorn) each one
+imports. Long-running commands (serve, worker) are measured through --help, which
+imports the CLI module but returns before the command body runs.
+
+Exits non-zero when a command loads a package it should not, or when its median
+exceeds --max-seconds, so it can guard against import regressions. Run from the
+repository root:
+
+    python -m benchmarks.bench_cli_startup --repeat 5
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HEAVY_PACKAGES = ("langchain", "langchain_core", "langchain_community", "langchain_ollama",
+                  "langchain_openai", "langgraph", "openai", "git", "uvicorn", "fastapi")
+
+# None of these should load a heavy package
+COMMANDS = [
+    ("help", ["--help"]),
+    ("init-db", ["init-db"]),
+    ("register", ["register", "{repo}", "{repo}-docs", "--name", "bench"]),
+    ("list", ["list"]),
+    ("logs", ["logs", "1"]),
+    ("migrate-patches", ["migrate-patches"]),
+    ("serve --help", ["serve", "--help"]),
+    ("worker --help", ["worker", "--help"]),
+    ("follow --help", ["follow", "--help"]),
+    ("import-mappings", ["import-mappings", "--discover", "{repo}", "--docs-root", "{repo}-docs", "--dry-run"]),
+]
+
+
+def _imported_packages(stderr: str) -> set:
+    """
+    Top-level packages listed by -X importtime.
+    """
+    packages = set()
+    for line in stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            name = line.rsplit("|", 1)[1].strip()
+            packages.add(name.split(".", 1)[0])
+    return packages
+
+
+def measure(args: list, env: dict, repeat: int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = subprocess.run([sys.executable, "-m", "src.cli", *args], env=env,
+                                capture_output=True, text=True)
+        timings.append(time.perf_counter() - started)
+        if result.returncode != 0:
+            raise RuntimeError(f"`src.cli {' '.join(args)}` failed:\n{result.stderr}")
+    traced = subprocess.run([sys.executable, "-X", "importtime", "-m", "src.cli", *args], env=env,
+                            capture_output=True, text=True)
+    imported = _imported_packages(traced.stderr)
+    return {
+        "min_s": min(timings),
+        "median_s": statistics.median(timings),
+        "max_s": max(timings),
+        "heavy_imports": sorted(p for p in HEAVY_PACKAGES if p in imported),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="runs per command")
+    parser.add_argument("--max-seconds", type=float, default=None, help="fail when a median exceeds this")
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    results = {}
+    problems = []
+    with tempfile.TemporaryDirectory(prefix="autodoc-cli-bench-") as root:
+        repo = os.path.join(root, "repo")
+        os.makedirs(repo)
+        env = dict(os.environ, AUTODOC_DATABASE_URL=f"sqlite:///{os.path.join(root, 'cli.db')}")
+        baseline = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], env=env, check=True)
+        interpreter_s = time.perf_counter() - baseline
+
+        for name, command in COMMANDS:
+            result = measure([arg.format(repo=repo) for arg in command], env, args.repeat)
+            results[name] = result
+            if result["heavy_imports"]:
+                problems.append(f"{name} imports {', '.join(result['heavy_imports'])}")
+            if args.max_seconds is not None and result["median_s"] > args.max_seconds:
+                problems.append(f"{name} took {result['median_s']:.2f}s (limit {args.max_seconds:.2f}s)")
+            print(f"{name:<16} median {result['median_s']:.3f}s  min {result['min_s']:.3f}s", file=sys.stderr)
+
+    report = {
+        "benchmark": "cli_startup",
+        "python": sys.version.split()[0],
+        "repeat": args.repeat,
+        "interpreter_s": interpreter_s,
+        "commands": results,
+        "problems": problems,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    for problem in problems:
+        print(f"REGRESSION: {problem}", file=sys.stderr)
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Micro-benchmark: watcher ticks per second, legacy git.Repo per check vs HeadResolver.
+
+A tick resolves HEAD for every synthetic repository once, which is what the watcher
+does for every mapping. Run from the repository root:
+
+    python -m benchmarks.bench_head_resolution --repos 500
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+import git
+
+from src.modules.refs import HeadResolver, RepoPool
+
+
+def make_repos(root: str, count: int) -> list:
+    template = os.path.join(root, "template")
+    os.makedirs(template)
+    env = dict(os.environ, GIT_AUTHOR_NAME="bench", GIT_AUTHOR_EMAIL="bench@example.com",
+               GIT_COMMITTER_NAME="bench", GIT_COMMITTER_EMAIL="bench@example.com")
+    with open(os.path.join(template, "main.py"), "w", encoding="utf-8") as f:
+        f.write("def main():\n    return 0\n")
+    subprocess.run(["git", "init", "-q", template], check=True, env=env)
+    subprocess.run(["git", "-C", template, "add", "."], check=True, env=env)
+    subprocess.run(["git", "-C", template, "commit", "-qm", "init"], check=True, env=env)
+
+    paths = []
+    for i in range(count):
+        path = os.path.join(root, f"repo-{i:04d}")
+        shutil.copytree(template, path, symlinks=True)
+        if i % 2:
+            # Half of the repos keep their branch in packed-refs only
+            subprocess.run(["git", "-C", path, "pack-refs", "--all"], check=True)
+        paths.append(path)
+    return paths
+
+
+def legacy_tick(paths: list) -> list:
+    # Mirrors the previous RepositoryWatcher.check_for_updates
+    heads = []
+    for path in paths:
+        repo = git.Repo(path)
+        heads.append(None if repo.bare else repo.head.commit.hexsha)
+    return heads
+
+
+def run(label: str, tick, paths: list, min_seconds: float) -> float:
+    tick(paths)  # warm-up
+    ticks = 0
+    started = time.perf_counter()
+    while True:
+        tick(paths)
+        ticks += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_seconds:
+            break
+    rate = ticks / elapsed
+    print(f"{label:<14} {ticks:>6} ticks in {elapsed:6.2f}s  {rate:10.2f} ticks/s  "
+          f"{rate * len(paths):12.0f} repos/s")
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repos", type=int, default=500)
+    parser.add_argument("--seconds", type=float, default=5.0, help="minimum measuring time per variant")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="autodoc-bench-") as root:
+        paths = make_repos(root, args.repos)
+        resolver = HeadResolver(pool=RepoPool(max_size=args.repos))
+        assert legacy_tick(paths) == [resolver.resolve(p) for p in paths]
+
+        print(f"{args.repos} repositories")
+        legacy = run("git.Repo", legacy_tick, paths, args.seconds)
+        fast = run("HeadResolver", lambda ps: [resolver.resolve(p) for p in ps], paths, args.seconds)
+        print(f"speedup: {fast / legacy:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
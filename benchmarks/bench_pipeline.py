@@ -0,0 +1,295 @@
+"""
+End-to-end pipeline benchmark: synthetic repositories, a deterministic fake chat
+model, the real scheduler/orchestrator/writer and a throwaway database.
+
+Each repository gets a history of --commits commits on top of an initial one with
+--files files. The benchmark replays that history: at every step it moves each
+repository's branch one commit forward, queues every mapping and waits until the
+workers are idle. Reports per-stage latency (from the pipeline's spans),
+throughput, peak RSS and database growth as JSON. Run from the repository root:
+
+    python -m benchmarks.bench_pipeline --repos 20 --commits 10 --output bench.json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import re
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+_GIT_ENV = dict(os.environ, GIT_AUTHOR_NAME="bench", GIT_AUTHOR_EMAIL="bench@example.com",
+                GIT_COMMITTER_NAME="bench", GIT_COMMITTER_EMAIL="bench@example.com")
+
+_DIFF_HEADER_RE = re.compile(r"^diff --git a/(\S+) b/", re.MULTILINE)
+
+
+def _git(repo: str, *args: str) -> str:
+    return subprocess.run(["git", "-C", repo, *args], check=True, env=_GIT_ENV,
+                          capture_output=True, text=True).stdout.strip()
+
+
+def _source(module: int, index: int, revision: int, size: int) -> str:
+    lines = [f"def func_{module}_{index}_{revision}(value):", f"    return value + {revision}", ""]
+    body = "\n".join(lines)
+    filler = [f"CONSTANT_{i} = {revision * 1000 + i}" for i in range(max(0, size - len(body)) // 20)]
+    return body + "\n".join(filler) + "\n"
+
+
+def make_repo(path: str, files: int, commits: int, changes: int, file_bytes: int) -> list:
+    """
+    Creates a repository and returns its commits, oldest first. Files are spread
+    over modules of 10 files; each commit rewrites `changes` files.
+    """
+    os.makedirs(path)
+    _git(path, "init", "-q", "-b", "main")
+    paths = [f"src/mod{i // 10}/file{i}.py" for i in range(files)]
+    for i, rel in enumerate(paths):
+        os.makedirs(os.path.join(path, os.path.dirname(rel)), exist_ok=True)
+        with open(os.path.join(path, rel), "w", encoding="utf-8") as f:
+            f.write(_source(i // 10, i, 0, file_bytes))
+    _git(path, "add", "-A")
+    _git(path, "commit", "-qm", "initial")
+    history = [_git(path, "rev-parse", "HEAD")]
+    for revision in range(1, commits + 1):
+        for j in range(changes):
+            i = (revision * changes + j) % files
+            with open(os.path.join(path, paths[i]), "w", encoding="utf-8") as f:
+                f.write(_source(i // 10, i, revision, file_bytes))
+        _git(path, "commit", "-qam", f"change {revision}")
+        history.append(_git(path, "rev-parse", "HEAD"))
+    return history
+
+
+def make_fake_model(latency: float):
+    from langchain_core.language_models.chat_models import BaseChatModel
+    from langchain_core.messages import AIMessage
+    from langchain_core.outputs import ChatGeneration, ChatResult
+
+    class FakeDocModel(BaseChatModel):
+        """
+        Answers every request with one doc per changed module, listing the changed
+        files. Output depends only on the prompt, so runs are reproducible.
+        """
+        latency: float = 0.0
+
+        @property
+        def _llm_type(self) -> str:
+            return "bench-fake"
+
+        def bind_tools(self, tools, **kwargs):
+            return self
+
+        def _answer(self, messages) -> ChatResult:
+            text = "\n".join(str(m.content) for m in messages)
+            docs = {}
+            for path in _DIFF_HEADER_RE.findall(text):
+                module = os.path.dirname(path).replace("/", "_") or "root"
+                docs.setdefault(f"{module}.md", []).append(path)
+            if not docs:
+                # Merge requests: return the first version
+                content = text.split("--- VERSION 1 ---", 1)[-1].split("--- VERSION 2 ---", 1)[0].strip()
+                return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+            patches = {doc: f"# {doc[:-3]}\n\n" + "\n".join(f"- `{p}` updated" for p in sorted(paths)) + "\n"
+                       for doc, paths in docs.items()}
+            return ChatResult(generations=[ChatGeneration(message=AIMessage(content=json.dumps(patches)))])
+
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+            if self.latency:
+                time.sleep(self.latency)
+            return self._answer(messages)
+
+        async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            return self._answer(messages)
+
+    return FakeDocModel(latency=latency)
+
+
+class SpanCollector:
+    """
+    Metrics hook that keeps every span duration, for percentiles.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.durations = {}
+
+    def emit(self, record):
+        name = getattr(record, "span", None)
+        if name:
+            with self.lock:
+                self.durations.setdefault(name, []).append(record.duration_seconds)
+
+    def summary(self) -> dict:
+        result = {}
+        with self.lock:
+            for name, values in sorted(self.durations.items()):
+                ordered = sorted(values)
+                result[name] = {
+                    "count": len(ordered),
+                    "mean_ms": statistics.fmean(ordered) * 1000,
+                    "p50_ms": ordered[len(ordered) // 2] * 1000,
+                    "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+                    "max_ms": ordered[-1] * 1000,
+                    "total_s": sum(ordered),
+                }
+        return result
+
+
+def _db_bytes(db_path: str) -> int:
+    return sum(os.path.getsize(p) for p in (db_path, db_path + "-wal") if os.path.exists(p))
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _wait_idle(scheduler, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if all(not s["queued"] and not s["running"] for s in scheduler.stats()):
+            return
+        time.sleep(0.01)
+    raise TimeoutError("scheduler did not become idle")
+
+
+def run(args, root: str) -> dict:
+    db_path = os.path.join(root, "bench.db")
+    # Must be set before src.database is imported
+    os.environ["AUTODOC_DATABASE_URL"] = f"sqlite:///{db_path}"
+
+    from sqlmodel import Session, func, select
+
+    from src import config
+    from src.core.llm import LLMFactory
+    from src.core.logger import set_metrics_hook
+    from src.core import metrics  # noqa: F401 -- installs the default hook, replaced below
+    from src.database import create_db_and_tables, db_writer, engine
+    from src.db_models import RepoMapping
+    from src.modules.scheduler import PipelineScheduler
+
+    config.LLM_CACHE_ENABLED = args.cache
+    LLMFactory.register("bench", "fake", make_fake_model(args.llm_latency))
+    collector = SpanCollector()
+    set_metrics_hook(collector)
+
+    setup_started = time.perf_counter()
+    histories = []
+    for i in range(args.repos):
+        path = os.path.join(root, f"repo-{i:04d}")
+        histories.append((path, make_repo(path, args.files, args.commits, args.changes, args.file_bytes)))
+    setup_seconds = time.perf_counter() - setup_started
+
+    create_db_and_tables()
+    with Session(engine) as session:
+        for path, history in histories:
+            # Start from the initial commit, already documented
+            _git(path, "update-ref", "HEAD", history[0])
+            session.add(RepoMapping(source_path=path, docs_path=path + "-docs", name=os.path.basename(path),
+                                    last_processed_commit=history[0], ai_provider="bench", ai_model="fake"))
+        session.commit()
+        mapping_ids = session.exec(select(RepoMapping.id).order_by(RepoMapping.id)).all()
+    db_before = _db_bytes(db_path)
+    rss_before = _peak_rss_mb()
+
+    scheduler = PipelineScheduler(max_workers=args.workers)
+    started = time.perf_counter()
+    for step in range(1, args.commits + 1):
+        for path, history in histories:
+            _git(path, "update-ref", "HEAD", history[step])
+        for mapping_id in mapping_ids:
+            scheduler.submit(mapping_id)
+        _wait_idle(scheduler, args.timeout)
+    elapsed = time.perf_counter() - started
+    scheduler.shutdown(wait=True)
+    db_writer.stop()
+
+    stats = scheduler.stats()
+    runs = sum(s["runs"] for s in stats)
+    failures = sum(s["failures"] for s in stats)
+    tables = {}
+    with Session(engine) as session:
+        import src.db_models as models
+        for name in ("ProcessingLog", "PipelineJob", "PatchBlob", "ProcessingLogPatch", "DocDependency", "TraceSpan"):
+            model = getattr(models, name)
+            tables[name] = session.exec(select(func.count()).select_from(model)).one()
+    jobs = tables["PipelineJob"]
+
+    return {
+        "setup_seconds": setup_seconds,
+        "elapsed_seconds": elapsed,
+        "runs": runs,
+        "jobs": jobs,
+        "failures": failures,
+        "mappings_per_minute": jobs / elapsed * 60 if elapsed else 0.0,
+        "stages": collector.summary(),
+        "peak_rss_mb": {"before_pipeline": rss_before, "after": _peak_rss_mb()},
+        "db": {
+            "bytes_before": db_before,
+            "bytes_after": _db_bytes(db_path),
+            "bytes_per_job": (_db_bytes(db_path) - db_before) / jobs if jobs else 0,
+            "rows": tables,
+        },
+    }
+
+
+def _revision() -> str:
+    try:
+        return _git(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "rev-parse", "HEAD")
+    except (subprocess.CalledProcessError, OSError):
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repos", type=int, default=10)
+    parser.add_argument("--files", type=int, default=50, help="files per repository")
+    parser.add_argument("--commits", type=int, default=5, help="commits replayed per repository")
+    parser.add_argument("--changes", type=int, default=5, help="files changed per commit")
+    parser.add_argument("--file-bytes", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="seconds the fake model waits per call")
+    parser.add_argument("--cache", action="store_true", help="keep the generation cache enabled")
+    parser.add_argument("--timeout", type=float, default=600.0, help="max seconds per replay step")
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="autodoc-bench-") as root:
+        # Pipeline progress output goes to stderr so stdout stays valid JSON
+        with contextlib.redirect_stdout(sys.stderr):
+            results = run(args, root)
+
+    report = {
+        "benchmark": "pipeline",
+        "timestamp": datetime.utcnow().isoformat(),
+        "revision": _revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": vars(args),
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        print(f"{results['jobs']} jobs in {results['elapsed_seconds']:.2f}s "
+              f"({results['mappings_per_minute']:.0f} mappings/min), results in {args.output}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,54 +1,115 @@
-from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks
+from fastapi import FastAPI, Depends, HTTPException, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from sqlalchemy.exc import IntegrityError
 from sqlmodel import Session, select
 from contextlib import asynccontextmanager
 import asyncio
-from typing import List
+import json
+from typing import Any, Dict, List, Optional
 
-from src.database import get_session, create_db_and_tables, engine
-from src.db_models import RepoMapping, ProcessingLog
-from src.modules.pipeline import PipelineOrchestrator
+from src import config
+from src.database import get_session, create_db_and_tables, delete_mapping as delete_mapping_rows, engine, db_writer
+from src.db_models import RepoMapping, ProcessingLog, PipelineJob, TraceSpan
+from src.core.event_bus import event_bus
+from src.core.metrics import registry as metrics_registry
+from src.core.progress import generation_registry
+from src.modules.cache import generation_cache
+from src.modules.jobs import JobQueue, PENDING
+from src.modules.leases import active_leases
+from src.modules.mapping_import import build_rows, import_mappings as insert_rows, normalize_mapping
+from src.modules.patch_store import PatchStore, log_summaries
+from src.modules.refs import head_resolver
+from src.modules.worker import WorkerNode, node_role
 
 # Global flag to control the generic watcher loop
 watcher_running = True
+# Pipeline side of this process; None when running with the "api" role
+node: WorkerNode = None
 
 async def watcher_loop():
     """
-    Background task that runs the pipeline periodically.
+    Background task that feeds mappings to the scheduler (see WorkerNode.tick).
+    The pipeline itself runs on the scheduler's worker pool, off the event loop.
     """
     print("Starting watcher loop...")
+    await asyncio.to_thread(node.start)
     while watcher_running:
-        with Session(engine) as session:
-            orchestrator = PipelineOrchestrator(session)
-            # Run synchronously inside the loop, or make orchestrator async.
-            # For simplicity, we run the synchronous run() method.
-            # In a heavy app, run_in_executor would be better.
-            try:
-                orchestrator.run()
-            except Exception as e:
-                print(f"Error in watcher loop: {e}")
-        
-        await asyncio.sleep(60) # check every 60 seconds
+        try:
+            await asyncio.to_thread(node.tick)
+        except Exception as e:
+            print(f"Error in watcher loop: {e}")
+
+        await asyncio.sleep(node.interval)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    global node, watcher_running
     create_db_and_tables()
-    # Start the watcher loop in the background
-    task = asyncio.create_task(watcher_loop())
+    task = None
+    if node_role() == "all":
+        node = WorkerNode()
+        # Start the watcher loop in the background
+        task = asyncio.create_task(watcher_loop())
     yield
     # Cleanup
-    global watcher_running
     watcher_running = False
-    task.cancel()
+    if task is not None:
+        task.cancel()
+    if node is not None:
+        node.stop()
+    db_writer.stop()
+
+def _enqueue_head(session: Session, mapping: RepoMapping, retry: bool = False) -> bool:
+    """
+    Queues a job for the mapping's current HEAD (API-only nodes do not run the
+    pipeline, workers pick it up). With retry, a HEAD whose job ended FAILED is
+    queued again. Returns False if nothing new was queued.
+    """
+    head = head_resolver.resolve(mapping.source_path)
+    if head is None or head == mapping.last_processed_commit:
+        return False
+    queued = JobQueue(session).enqueue(mapping, head, retry=retry) is not None
+    session.refresh(mapping)
+    return queued
 
 app = FastAPI(lifespan=lifespan)
 
 @app.post("/mappings/", response_model=RepoMapping)
 def create_mapping(mapping: RepoMapping, session: Session = Depends(get_session)):
+    try:
+        normalize_mapping(mapping)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
     session.add(mapping)
-    session.commit()
+    try:
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+        raise HTTPException(status_code=409, detail="A mapping with this source_path and docs_path already exists")
     session.refresh(mapping)
+    if not mapping.is_active:
+        return mapping
+    if node is None:
+        _enqueue_head(session, mapping)
+        return mapping
+    if node.monitor is not None:
+        node.monitor.watch(mapping.id, mapping.source_path)
+    node.scheduler.submit(mapping.id)
     return mapping
 
+@app.post("/mappings/bulk")
+def import_mappings(entries: List[Dict[str, Any]], session: Session = Depends(get_session)):
+    """
+    Registers many mappings in batched inserts (manifest entries, see `import-mappings`).
+    Pairs already registered are skipped; workers pick new mappings up on their next tick.
+    """
+    try:
+        rows = build_rows(entries)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    inserted, skipped = insert_rows(session, rows)
+    return {"inserted": inserted, "skipped": skipped}
+
 @app.get("/mappings/", response_model=List[RepoMapping])
 def read_mappings(session: Session = Depends(get_session)):
     mappings = session.exec(select(RepoMapping)).all()
@@ -59,27 +120,170 @@ def delete_mapping(mapping_id: int, session: Session = Depends(get_session)):
     mapping = session.get(RepoMapping, mapping_id)
     if not mapping:
         raise HTTPException(status_code=404, detail="Mapping not found")
-    session.delete(mapping)
+    delete_mapping_rows(session, mapping_id)
     session.commit()
+    if node is not None and node.monitor is not None:
+        node.monitor.unwatch(mapping_id)
+    # Generations on other nodes stop once their worker's resync drops the mapping
+    generation_registry.cancel(mapping_id)
     return {"ok": True}
 
 @app.post("/trigger/{mapping_id}")
-def trigger_mapping(mapping_id: int, background_tasks: BackgroundTasks, session: Session = Depends(get_session)):
+def trigger_mapping(mapping_id: int, session: Session = Depends(get_session)):
     mapping = session.get(RepoMapping, mapping_id)
     if not mapping:
         raise HTTPException(status_code=404, detail="Mapping not found")
-    
-    def process_now():
-        with Session(engine) as s:
-            # Re-fetch to be safe or pass detached object if orchestrator handles it
-            m = s.get(RepoMapping, mapping_id)
-            if m:
-                PipelineOrchestrator(s).process_mapping(m)
-    
-    background_tasks.add_task(process_now)
-    return {"message": "Processing triggered"}
-
-@app.get("/mappings/{mapping_id}/logs", response_model=List[ProcessingLog])
-def get_mapping_logs(mapping_id: int, session: Session = Depends(get_session)):
-    logs = session.exec(select(ProcessingLog).where(ProcessingLog.mapping_id == mapping_id).order_by(ProcessingLog.timestamp.desc())).all()
-    return logs
+
+    # A manual trigger is also the way to retry a commit whose job exhausted its attempts
+    if node is None:
+        if _enqueue_head(session, mapping, retry=True):
+            return {"message": "Job queued for workers"}
+        return {"message": "No new commits to queue"}
+    _enqueue_head(session, mapping, retry=True)
+    node.scheduler.update_policy(mapping)
+    if node.scheduler.submit(mapping_id):
+        return {"message": "Processing triggered"}
+    # Repeated triggers coalesce into the run that is already waiting
+    position = next((e["position"] for e in node.scheduler.queue() if e["mapping_id"] == mapping_id), None)
+    return {"message": "Processing already queued", "position": position}
+
+@app.post("/mappings/{mapping_id}/cancel")
+def cancel_mapping(mapping_id: int):
+    if not generation_registry.cancel(mapping_id):
+        raise HTTPException(status_code=404, detail="No running generation for this mapping")
+    return {"message": "Cancellation requested"}
+
+@app.get("/progress")
+def get_progress():
+    return [p.to_dict() for p in generation_registry.all()]
+
+@app.get("/mappings/{mapping_id}/progress")
+def get_mapping_progress(mapping_id: int):
+    progress = generation_registry.get(mapping_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="No generation recorded for this mapping")
+    return progress.to_dict()
+
+@app.get("/events")
+async def stream_events(request: Request, mapping_id: Optional[int] = None):
+    """
+    Server-sent events of job progress (detected, diffing, generating, writing,
+    done) for jobs run by this server process, not by separate `worker`
+    processes. Send Last-Event-ID to resume after a reconnect.
+    """
+    last_id = request.headers.get("last-event-id", "")
+    subscription = event_bus.subscribe(mapping_id, after=int(last_id) if last_id.isdigit() else None)
+
+    async def stream():
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                item = await subscription.get(config.EVENT_STREAM_HEARTBEAT_SECONDS)
+                if item is None:
+                    yield ": keepalive\n\n"
+                    continue
+                event_id, event = item
+                yield f"id: {event_id}\ndata: {event.model_dump_json()}\n\n"
+        finally:
+            subscription.close()
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/mappings/{mapping_id}/events")
+async def stream_mapping_events(request: Request, mapping_id: int):
+    return await stream_events(request, mapping_id)
+
+@app.get("/scheduler/stats")
+def get_scheduler_stats(session: Session = Depends(get_session)):
+    stats = {"role": node_role(), "leases": active_leases(session), "db_writer": db_writer.stats(),
+             "events": event_bus.stats()}
+    if node is not None:
+        stats.update({
+            "owner": node.leases.owner,
+            "workers": node.scheduler.max_workers,
+            "queue_depth": node.scheduler.queue_depth(),
+            "mappings": node.scheduler.stats(),
+        })
+    return stats
+
+@app.get("/scheduler/queue")
+def get_scheduler_queue(session: Session = Depends(get_session)):
+    """
+    Runs waiting for a worker on this node, in dispatch order, and the jobs
+    waiting in the shared database for any worker.
+    """
+    jobs = session.exec(
+        select(PipelineJob)
+        .join(RepoMapping, RepoMapping.id == PipelineJob.mapping_id)
+        .where(PipelineJob.status == PENDING)
+        .order_by(PipelineJob.next_attempt_at)
+    ).all()
+    queue = {
+        "role": node_role(),
+        "pending_jobs": [
+            job.model_dump(include={"id", "mapping_id", "base_commit", "head_commit", "attempts", "next_attempt_at"})
+            for job in jobs
+        ],
+    }
+    if node is not None:
+        queue["queue"] = node.scheduler.queue()
+        queue["rate_limits"] = node.scheduler.limiter.stats()
+    return queue
+
+@app.get("/mappings/{mapping_id}/logs")
+def get_mapping_logs(mapping_id: int, limit: int = config.LOG_PAGE_SIZE, cursor: Optional[int] = None,
+                     session: Session = Depends(get_session)):
+    """
+    Log summaries, newest first, with each run's generation cache hits and misses.
+    Pass next_cursor back as cursor for the next page.
+    Patch contents are served by /logs/{log_id}/patches.
+    """
+    items, next_cursor = log_summaries(session, mapping_id, limit, cursor)
+    return {"items": items, "next_cursor": next_cursor}
+
+@app.get("/logs/{log_id}/patches")
+def get_log_patches(log_id: int, session: Session = Depends(get_session)):
+    log = session.get(ProcessingLog, log_id)
+    if not log:
+        raise HTTPException(status_code=404, detail="Log not found")
+    return PatchStore().load(session, log)
+
+@app.get("/cache/stats")
+def get_cache_stats():
+    from src.modules.processor import shared_diffs
+    from src.modules.snapshot import blob_cache, prefetch_stats, tree_cache
+    return {**generation_cache.stats(), **generation_cache.storage(), "shared_diffs": shared_diffs.stats(),
+            "snapshot": {"blobs": blob_cache.stats(), "trees": tree_cache.stats(), "prefetch": prefetch_stats.stats()}}
+
+@app.get("/jobs/{job_id}/trace")
+def get_job_trace(job_id: int, session: Session = Depends(get_session)):
+    spans = session.exec(select(TraceSpan).where(TraceSpan.job_id == job_id).order_by(TraceSpan.id)).all()
+    if not spans:
+        raise HTTPException(status_code=404, detail="No trace recorded for this job")
+    return [
+        {**span.model_dump(exclude={"attributes"}), "attributes": json.loads(span.attributes or "{}")}
+        for span in spans
+    ]
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """
+    Prometheus text exposition: stage durations and counters from this process's
+    pipeline runs, plus point-in-time gauges.
+    """
+    for name, value in generation_cache.stats().items():
+        if isinstance(value, (int, float)):
+            metrics_registry.set(f"autodoc_generation_cache_{name}", value)
+    for name, value in db_writer.stats().items():
+        metrics_registry.set(f"autodoc_db_writer_{name}", value)
+    from src.modules.snapshot import prefetch_stats
+    for name, value in prefetch_stats.stats().items():
+        metrics_registry.set(f"autodoc_prefetch_{name}", value)
+    running = sum(1 for p in generation_registry.all() if p.state == "running")
+    metrics_registry.set("autodoc_generations_running", running, help="Generations in progress on this node")
+    if node is not None:
+        metrics_registry.set("autodoc_scheduler_queue_depth", node.scheduler.queue_depth(),
+                             help="Mapping runs waiting for a worker")
+        metrics_registry.set("autodoc_leases_held", len(node.leases.held()))
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
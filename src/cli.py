@@ -1,8 +1,8 @@
 import typer
-import uvicorn
 from sqlmodel import Session, select
 from src.database import create_db_and_tables, engine
 from src.db_models import RepoMapping, ProcessingLog
+from src.modules.patch_store import PatchStore, log_summaries
 import os
 
 app = typer.Typer()
@@ -13,20 +13,99 @@ def init_db():
     print("Database initialized.")
 
 @app.command()
-def register(source: str, docs: str, name: str = None):
+def register(source: str, docs: str, name: str = None, priority: int = None, weight: float = None,
+             min_interval: int = None, path_filter: str = None):
     """
     Register a new repository to watch.
+    --path-filter limits the mapping to part of the repository, e.g. "src/api, !**/tests/**".
     """
+    mapping = RepoMapping(source_path=source, docs_path=docs, path_filter=path_filter or None)
+    _apply_schedule(mapping, priority, weight, min_interval)
+    source, docs = mapping.source_path, mapping.docs_path
+    mapping.name = name or os.path.basename(source)
     if not os.path.exists(source):
         print(f"Error: Source path {source} does not exist.")
         return
     
     with Session(engine) as session:
-        mapping = RepoMapping(source_path=source, docs_path=docs, name=name or os.path.basename(source))
+        existing = session.exec(
+            select(RepoMapping).where(RepoMapping.source_path == source, RepoMapping.docs_path == docs)
+        ).first()
+        if existing is not None:
+            print(f"Error: {source} -> {docs} is already registered (ID: {existing.id})")
+            return
         session.add(mapping)
         session.commit()
         print(f"Registered {mapping.name} (ID: {mapping.id})")
 
+@app.command()
+def import_mappings(manifest: str = typer.Argument(None), discover: str = None, docs_root: str = None,
+                    depth: int = None, provider: str = None, model: str = None, dry_run: bool = False):
+    """
+    Register many repositories at once, from a manifest and/or by discovery.
+    The manifest is a JSON list (or JSON lines) of objects with source_path, docs_path
+    and optionally name, ai_provider, ai_model, priority, weight, min_interval_seconds,
+    path_filter, is_active. --discover ROOT registers every git repository under ROOT,
+    with docs under the same relative path in --docs-root. Already registered
+    (source_path, docs_path) pairs are skipped.
+    """
+    from src.modules.mapping_import import build_rows, discovered_entries, import_mappings as insert_rows, load_manifest
+
+    if manifest is None and discover is None:
+        raise typer.BadParameter("pass a manifest file, --discover ROOT, or both")
+    if discover is not None and docs_root is None:
+        raise typer.BadParameter("--discover needs --docs-root")
+    entries = load_manifest(manifest) if manifest is not None else []
+    if discover is not None:
+        entries += discovered_entries(discover, docs_root, depth)
+    defaults = {key: value for key, value in (("ai_provider", provider), ("ai_model", model)) if value}
+    try:
+        rows = build_rows(entries, defaults)
+    except ValueError as e:
+        print(f"Error: {e}")
+        raise typer.Exit(1)
+    if dry_run:
+        for row in rows:
+            print(f"{row['name']}: {row['source_path']} -> {row['docs_path']}")
+        print(f"{len(rows)} mappings would be imported")
+        return
+    create_db_and_tables()
+    with Session(engine) as session:
+        inserted, skipped = insert_rows(session, rows)
+    print(f"Imported {inserted} mappings, skipped {skipped} already registered")
+
+def _apply_schedule(mapping: RepoMapping, priority: int = None, weight: float = None, min_interval: int = None):
+    # Validated (and the paths made absolute) by the same rules as imports and the API
+    from src.modules.mapping_import import normalize_mapping
+
+    if priority is not None:
+        mapping.priority = priority
+    if weight is not None:
+        mapping.weight = weight
+    if min_interval is not None:
+        mapping.min_interval_seconds = min_interval
+    try:
+        normalize_mapping(mapping)
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+
+@app.command()
+def schedule(mapping_id: int, priority: int = None, weight: float = None, min_interval: int = None):
+    """
+    Change a mapping's priority, weight or minimum seconds between runs.
+    Running workers pick the change up on the mapping's next run.
+    """
+    with Session(engine) as session:
+        mapping = session.get(RepoMapping, mapping_id)
+        if mapping is None:
+            print(f"Mapping {mapping_id} not found")
+            return
+        _apply_schedule(mapping, priority, weight, min_interval)
+        session.add(mapping)
+        session.commit()
+        print(f"[{mapping.id}] {mapping.name}: priority {mapping.priority}, weight {mapping.weight}, "
+              f"min interval {mapping.min_interval_seconds}s")
+
 @app.command()
 def list():
     """
@@ -38,27 +117,101 @@ def list():
             print(f"[{m.id}] {m.name}: {m.source_path} -> {m.docs_path} (Last: {m.last_processed_commit[:7]})")
 
 @app.command()
-def serve(host: str = "127.0.0.1", port: int = 8000):
+def serve(host: str = "127.0.0.1", port: int = 8000, role: str = None, reload: bool = False):
     """
     Start the API server and the Watcher daemon.
+    With --role api the server only enqueues jobs for `worker` processes.
+    --reload is for development only: it restarts the process, pipeline included, on code changes.
     """
-    uvicorn.run("src.api:app", host=host, port=port, reload=True)
+    if role:
+        os.environ["AUTODOC_ROLE"] = role
+    import uvicorn
+    uvicorn.run("src.api:app", host=host, port=port, reload=reload)
 
 @app.command()
-def logs(mapping_id: int, limit: int = 5):
+def worker(workers: int = None):
+    """
+    Run the pipeline without the API. Start any number of these against one database.
+    """
+    from src.modules.worker import WorkerNode
+    create_db_and_tables()
+    node = WorkerNode(max_workers=workers)
+    try:
+        node.run_forever()
+    except KeyboardInterrupt:
+        print("Stopping worker...")
+    finally:
+        node.stop()
+
+@app.command()
+def logs(mapping_id: int, limit: int = 5, cursor: int = None, patches: bool = False):
     """
     Show recent processing logs for a mapping.
+    Use the printed cursor with --cursor to page further back.
     """
     with Session(engine) as session:
-        logs = session.exec(select(ProcessingLog).where(ProcessingLog.mapping_id == mapping_id).order_by(ProcessingLog.timestamp.desc()).limit(limit)).all()
-        if not logs:
+        items, next_cursor = log_summaries(session, mapping_id, limit, cursor)
+        if not items:
             print(f"No logs found for mapping {mapping_id}")
             return
-        
-        for log in logs:
-            print(f"[{log.timestamp}] Status: {log.status} | Commit: {log.commit_hash[:7]} | Summary: {log.summary}")
-            if log.patches:
-                print(f"  Patches: {log.patches[:100]}...") # Truncate for display
+
+        store = PatchStore()
+        for item in items:
+            print(f"[{item['timestamp']}] #{item['id']} Status: {item['status']} | Commit: {item['commit_hash'][:7]} | Summary: {item['summary']}")
+            if item["files"]:
+                print(f"  Files: {', '.join(f['path'] for f in item['files'])}")
+            if patches:
+                for path, content in store.load(session, session.get(ProcessingLog, item["id"])).items():
+                    print(f"  --- {path} ---\n{content[:500]}")
+        if next_cursor is not None:
+            print(f"More: --cursor {next_cursor}")
+
+@app.command()
+def follow(mapping_id: int = typer.Argument(None), url: str = "http://127.0.0.1:8000", until_done: bool = False):
+    """
+    Print live job progress from a running server, for one mapping or all of them.
+    --until-done exits once a job finishes.
+    """
+    import json
+    import urllib.request
+
+    path = f"/mappings/{mapping_id}/events" if mapping_id is not None else "/events"
+    try:
+        with urllib.request.urlopen(url.rstrip("/") + path) as response:
+            for raw in response:
+                line = raw.decode("utf-8").rstrip("\n")
+                if not line.startswith("data: "):
+                    continue
+                event = json.loads(line[len("data: "):])
+                print(_format_event(event))
+                if until_done and event["stage"] == "done":
+                    return
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        print(f"Error: cannot follow events at {url}: {e}")
+
+def _format_event(event: dict) -> str:
+    detail = dict(event.get("detail") or {})
+    summary = detail.pop("summary", None)
+    text = f"[{event['timestamp']}] #{event['repo_id']} {event['commit_hash'][:7]} {event['stage']}"
+    if event.get("status"):
+        text += f" {event['status']}"
+    if detail:
+        text += " " + " ".join(f"{key}={value}" for key, value in detail.items())
+    if summary:
+        text += f" | {summary}"
+    return text
+
+@app.command()
+def migrate_patches():
+    """
+    Move patches stored inline in old processing logs into the blob store.
+    """
+    create_db_and_tables()
+    with Session(engine) as session:
+        count = PatchStore().migrate_legacy(session)
+    print(f"Migrated {count} logs. Run VACUUM on the database to reclaim the space.")
 
 if __name__ == "__main__":
     app()
@@ -0,0 +1,107 @@
+"""
+In-process event bus for live job progress.
+
+Pipeline threads publish events (see core.events); subscribers, typically SSE
+responses on the API event loop, receive them through a bounded asyncio queue.
+Publishing never blocks: a subscriber that falls behind loses its oldest events.
+Recent events are kept with increasing ids so a reconnecting client can resume.
+"""
+
+import asyncio
+import threading
+from collections import deque
+from typing import List, Optional, Tuple
+
+from src import config
+from src.core.events import BaseEvent
+from src.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class Subscription:
+    def __init__(self, bus: "EventBus", mapping_id: Optional[int], max_queue: int):
+        self.bus = bus
+        self.mapping_id = mapping_id
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue(max_queue)
+        self.dropped = 0
+
+    def wants(self, event: BaseEvent) -> bool:
+        return self.mapping_id is None or getattr(event, "repo_id", None) == self.mapping_id
+
+    def _deliver(self, item: Tuple[int, BaseEvent]):
+        # Runs on the subscriber's loop
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(item)
+
+    async def get(self, timeout: float) -> Optional[Tuple[int, BaseEvent]]:
+        """
+        Next (event id, event), or None if nothing arrived within timeout seconds.
+        """
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+
+class EventBus:
+    def __init__(self, history: Optional[int] = None, max_queue: Optional[int] = None):
+        self.max_queue = max_queue or config.EVENT_SUBSCRIBER_QUEUE_SIZE
+        self.published = 0
+        self._lock = threading.Lock()
+        self._history: deque = deque(maxlen=history or config.EVENT_BUS_HISTORY)
+        self._subscribers: List[Subscription] = []
+
+    def publish(self, event: BaseEvent) -> int:
+        """
+        Hands the event to every matching subscriber. Safe to call from any thread.
+        """
+        with self._lock:
+            self.published += 1
+            item = (self.published, event)
+            self._history.append(item)
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            if not subscription.wants(event):
+                continue
+            try:
+                subscription.loop.call_soon_threadsafe(subscription._deliver, item)
+            except RuntimeError:
+                # The subscriber's loop is closed
+                self.unsubscribe(subscription)
+        return item[0]
+
+    def subscribe(self, mapping_id: Optional[int] = None, after: Optional[int] = None) -> Subscription:
+        """
+        Subscribes the running event loop to events of one mapping (all if None).
+        Events newer than `after` that are still in the history are queued first.
+        """
+        subscription = Subscription(self, mapping_id, self.max_queue)
+        with self._lock:
+            backlog = [item for item in self._history
+                       if after is not None and item[0] > after and subscription.wants(item[1])]
+            self._subscribers.append(subscription)
+        for item in backlog:
+            subscription._deliver(item)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            if subscription in self._subscribers:
+                self._subscribers.remove(subscription)
+        if subscription.dropped:
+            logger.warning("Event subscriber for mapping %s fell behind, %d events dropped",
+                           subscription.mapping_id, subscription.dropped)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"published": self.published, "subscribers": len(self._subscribers)}
+
+
+event_bus = EventBus()
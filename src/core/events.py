@@ -1,11 +1,27 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Literal, Optional
 
 class BaseEvent(BaseModel):
-    timestamp: datetime = datetime.now()
+    timestamp: datetime = Field(default_factory=datetime.now)
     event_type: str
 
+class DocOperation(BaseModel):
+    """
+    One edit to an existing doc. Sections are anchored by heading text
+    ("Usage", or "Usage > Install" when a title repeats).
+    """
+    op: Literal["replace_section", "insert_section", "delete_section", "diff"]
+    # replace_section / delete_section: the section to change, subsections included
+    section: Optional[str] = None
+    # insert_section: insert after or before this section; at the end if neither is set
+    after: Optional[str] = None
+    before: Optional[str] = None
+    # New markdown; for replace_section without a heading line only the body is replaced
+    content: str = ""
+    # diff: unified-diff hunks ("@@ -12,3 +12,4 @@" ...) against the current doc
+    diff: str = ""
+
 class DocumentationGeneratedEvent(BaseEvent):
     event_type: str = "documentation_generated"
     repo_id: int
@@ -13,9 +29,29 @@ class DocumentationGeneratedEvent(BaseEvent):
     # Use a dictionary to map file paths to new content (patches)
     # e.g. {"docs/intro.md": "# Introduction\n..."}
     patches: Dict[str, str] 
+    # Edits to existing docs, applied in order by the writer against the current docs tree
+    operations: Dict[str, List[DocOperation]] = {}
+    # Source files each patched doc was generated from, e.g. {"docs/intro.md": ["src/app.py"]}
+    sources: Dict[str, List[str]] = {}
+    # Functions/classes touched in each source file
+    symbols: Dict[str, List[str]] = {}
     
 class SourceChangedEvent(BaseEvent):
     event_type: str = "source_changed"
     repo_id: int
     commit_hash: str
     previous_hash: str
+
+class JobProgressEvent(BaseEvent):
+    """
+    One step of a pipeline job, published on the event bus for live followers.
+    """
+    event_type: str = "job_progress"
+    repo_id: int
+    commit_hash: str
+    job_id: Optional[int] = None
+    stage: Literal["detected", "diffing", "generating", "writing", "done"]
+    # Final log status (SUCCESS, SKIPPED, FAILED, CANCELLED) on the "done" event
+    status: Optional[str] = None
+    # Stage details: changed files, tokens and tool calls so far, docs written, summary
+    detail: Dict[str, Any] = {}
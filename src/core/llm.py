@@ -1,15 +1,48 @@
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Tuple
+
 from langchain_ollama import ChatOllama
 from langchain_core.language_models.chat_models import BaseChatModel
 from langchain_openai import ChatOpenAI
 from os import getenv
 from dotenv import load_dotenv
 
+from src import config
+
+_dotenv_lock = threading.Lock()
+_dotenv_loaded = False
+
+
+def _load_env():
+    global _dotenv_loaded
+    with _dotenv_lock:
+        if not _dotenv_loaded:
+            load_dotenv()
+            _dotenv_loaded = True
+
+
 class LLMFactory:
+    """
+    Builds chat clients and keeps one per (provider, model) for the whole process,
+    so their HTTP connection pools stay warm between pipeline runs. Compiled
+    agents built on top of a shared client are cached here as well.
+    """
+
+    _lock = threading.Lock()
+    _clients: Dict[Tuple[str, str], BaseChatModel] = {}
+    _agents: "OrderedDict[Tuple, Any]" = OrderedDict()
+
     @staticmethod
     def create_llm(provider: str = "ollama", model: str = "gpt-oss:20b") -> BaseChatModel:
-        load_dotenv()
+        """
+        Builds a new, unshared client. Prefer get_llm.
+        """
+        _load_env()
         if provider == "ollama":
-            return ChatOllama(model=model)
+            # keep_alive keeps the model loaded on the Ollama server between runs
+            return ChatOllama(model=model, keep_alive=config.OLLAMA_KEEP_ALIVE)
         if provider == "openrouter":
             return ChatOpenAI(
                 api_key=getenv("OR_API_KEY"),
@@ -18,3 +51,90 @@ class LLMFactory:
             )
         # Future extension for other providers
         raise ValueError(f"Unsupported provider: {provider}")
+
+    @classmethod
+    def get_llm(cls, provider: str, model: str) -> BaseChatModel:
+        """
+        Returns the shared client for (provider, model), creating it on first use.
+        """
+        key = (provider, model)
+        with cls._lock:
+            llm = cls._clients.get(key)
+            if llm is None:
+                llm = cls.create_llm(provider, model)
+                cls._clients[key] = llm
+            return llm
+
+    @classmethod
+    def register(cls, provider: str, model: str, llm: BaseChatModel):
+        """
+        Installs a client for (provider, model), e.g. a fake model in benchmarks.
+        Agents compiled on the previous client are dropped.
+        """
+        with cls._lock:
+            cls._clients[(provider, model)] = llm
+            for key in [k for k in cls._agents if k[:2] == (provider, model)]:
+                del cls._agents[key]
+
+    @classmethod
+    def get_agent(cls, provider: str, model: str, tools_key: Hashable,
+                  build: Callable[[BaseChatModel], Any]) -> Any:
+        """
+        Returns the agent compiled by build(llm) for the shared client and the tool
+        set identified by tools_key, compiling it on first use. At most
+        LLM_AGENT_CACHE_SIZE agents are kept, least recently used first out.
+        """
+        key = (provider, model, tools_key)
+        with cls._lock:
+            agent = cls._agents.get(key)
+            if agent is not None:
+                cls._agents.move_to_end(key)
+                return agent
+        llm = cls.get_llm(provider, model)
+        agent = build(llm)
+        with cls._lock:
+            # Another thread may have compiled the same agent meanwhile; keep the first.
+            agent = cls._agents.setdefault(key, agent)
+            cls._agents.move_to_end(key)
+            while len(cls._agents) > config.LLM_AGENT_CACHE_SIZE:
+                cls._agents.popitem(last=False)
+        return agent
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._clients.clear()
+            cls._agents.clear()
+
+
+class LLMEventLoop:
+    """
+    One long-lived event loop, on its own thread, that runs every generation.
+
+    Async HTTP clients bind their pooled connections to the loop they were first
+    used on, so the shared clients above can only be reused across runs if all
+    runs share a loop (a fresh asyncio.run per run would strand the pool).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop = None
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None or self._loop.is_closed():
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name="autodoc-llm-loop", daemon=True)
+                thread.start()
+                self._loop = loop
+            return self._loop
+
+    def run(self, coro):
+        """
+        Runs the coroutine on the shared loop and blocks until it finishes.
+        Must not be called from the loop's own thread.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop()).result()
+
+
+llm_loop = LLMEventLoop()
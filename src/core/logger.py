@@ -44,6 +44,22 @@ def _attach_metrics(record: logging.LogRecord) -> None:
             pass
 
 
+# Attributes every LogRecord has; anything else on a record came from `extra`.
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "metrics_recorded"}
+
+
+def record_metrics(logger: logging.Logger, level: int, msg: str, args: tuple, extra: dict) -> None:
+    """
+    Hands a structured record to the metrics hook even when `level` is below the
+    logger's threshold, and logs it normally if the level is enabled.
+    """
+    record = logger.makeRecord(logger.name, level, "(metrics)", 0, msg, args, None, extra=extra)
+    _attach_metrics(record)
+    if logger.isEnabledFor(level):
+        record.metrics_recorded = True
+        logger.handle(record)
+
+
 class JsonFormatter(logging.Formatter):
     def format(self, record: logging.LogRecord) -> str:
         payload = {
@@ -51,9 +67,15 @@ class JsonFormatter(logging.Formatter):
             "level": record.levelname,
             "logger": record.name,
             "message": record.getMessage(),
-        }  # no extra fields printed
+        }
+        # Structured fields passed through `extra`
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                payload.setdefault(key, value)
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
 
-        return json.dumps(payload, ensure_ascii=False)
+        return json.dumps(payload, ensure_ascii=False, default=str)
 
 
 def get_logger(name: str) -> logging.Logger:
@@ -82,7 +104,8 @@ def get_logger(name: str) -> logging.Logger:
 
     class MetricsFilter(logging.Filter):
         def filter(self, record: logging.LogRecord) -> bool:
-            _attach_metrics(record)
+            if not getattr(record, "metrics_recorded", False):
+                _attach_metrics(record)
             return True
 
     logger.addFilter(MetricsFilter())
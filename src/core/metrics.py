@@ -0,0 +1,202 @@
+"""
+Pipeline metrics and traces.
+
+span() times a pipeline stage. Every finished span becomes a log record carrying
+structured fields (span, duration_seconds, sizes, counts); the installed metrics
+hook aggregates those records into Prometheus series, and the spans of the
+current job are collected into a Trace that the pipeline stores in the database.
+"""
+
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from src.core.logger import BaseMetricsHook, get_logger, record_metrics, set_metrics_hook
+
+logger = get_logger(__name__)
+
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Optional[Dict[str, str]]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in (labels or {}).items()))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def metric_name(*parts: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_]", "_", "_".join(p for p in parts if p))
+
+
+class MetricsRegistry:
+    """
+    Thread-safe counters, gauges and histograms rendered in the Prometheus text format.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._gauges: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, list]] = {}
+        self._help: Dict[str, str] = {}
+
+    def inc(self, name: str, amount: float = 1, labels: Optional[Dict[str, str]] = None, help: str = ""):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+            self._help.setdefault(name, help)
+
+    def set(self, name: str, value: float, labels: Optional[Dict[str, str]] = None, help: str = ""):
+        with self._lock:
+            self._gauges.setdefault(name, {})[_label_key(labels)] = value
+            self._help.setdefault(name, help)
+
+    def observe(self, name: str, value: float, labels: Optional[Dict[str, str]] = None, help: str = ""):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            # bucket counts, then sum and count
+            state = series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+            self._help.setdefault(name, help)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            for kind, metrics in (("counter", self._counters), ("gauge", self._gauges)):
+                for name in sorted(metrics):
+                    if self._help.get(name):
+                        lines.append(f"# HELP {name} {self._help[name]}")
+                    lines.append(f"# TYPE {name} {kind}")
+                    for key, value in sorted(metrics[name].items()):
+                        lines.append(f"{name}{_format_labels(key)} {value}")
+            for name in sorted(self._histograms):
+                if self._help.get(name):
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, state in sorted(self._histograms[name].items()):
+                    for bound, count in zip(self.buckets, state):
+                        lines.append(f"{name}_bucket{_format_labels(key, ('le', str(bound)))} {count}")
+                    lines.append(f"{name}_bucket{_format_labels(key, ('le', '+Inf'))} {state[-1]}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {state[-2]}")
+                    lines.append(f"{name}_count{_format_labels(key)} {state[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+class PrometheusMetricsHook(BaseMetricsHook):
+    """
+    Turns span records into series: a duration histogram per span, and a counter
+    per numeric field (autodoc_<span>_<field>_total).
+    """
+
+    def __init__(self, registry: MetricsRegistry):
+        self.registry = registry
+
+    def emit(self, record: logging.LogRecord) -> None:
+        name = getattr(record, "span", None)
+        if not name:
+            return
+        labels = getattr(record, "metric_labels", None) or {}
+        labels = {**labels, "span": name}
+        self.registry.observe("autodoc_span_seconds", record.duration_seconds, labels,
+                              help="Duration of pipeline stages")
+        for field, value in getattr(record, "span_attributes", {}).items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            self.registry.inc(metric_name("autodoc", name, field, "total"), value, labels.copy())
+
+
+class Trace:
+    """
+    Spans recorded while processing one job.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.spans: List[dict] = []
+
+    def add(self, name: str, started_at: datetime, duration: float, attributes: dict):
+        with self._lock:
+            self.spans.append({
+                "name": name,
+                "started_at": started_at,
+                "duration_ms": duration * 1000,
+                "attributes": attributes,
+            })
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("autodoc_trace", default=None)
+
+
+@contextmanager
+def trace():
+    """
+    Collects the spans finished inside the block (on this thread) into a Trace.
+    """
+    current = Trace()
+    token = _current_trace.set(current)
+    try:
+        yield current
+    finally:
+        _current_trace.reset(token)
+
+
+class Span:
+    def __init__(self, name: str, labels: Optional[Dict[str, str]], attributes: dict):
+        self.name = name
+        self.labels = dict(labels or {})
+        self.attributes = dict(attributes)
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+@contextmanager
+def span(name: str, labels: Optional[Dict[str, str]] = None, **attributes):
+    """
+    Times the block. Attributes set on the yielded Span (sizes, counts) are
+    recorded with the duration; labels become Prometheus labels, so keep them
+    low-cardinality.
+    """
+    current = Span(name, labels, attributes)
+    started_at = datetime.utcnow()
+    start = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        current.set(error=type(e).__name__)
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        active = _current_trace.get()
+        if active is not None:
+            active.add(name, started_at, duration, current.attributes)
+        record_metrics(logger, logging.DEBUG, "span %s took %.3fs", (name, duration), {
+            "span": name,
+            "duration_seconds": duration,
+            "metric_labels": current.labels,
+            "span_attributes": current.attributes,
+        })
+
+
+registry = MetricsRegistry()
+set_metrics_hook(PrometheusMetricsHook(registry))
@@ -0,0 +1,149 @@
+"""
+Live progress and cancellation handles for running generations.
+
+Generations run as tasks on the shared LLM event loop (see core.llm); the
+registry keeps each one's task and loop so the API thread can cancel it, and a
+progress record the API can report (time to first token, tokens per second).
+"""
+
+import asyncio
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from src import config
+from src.core.event_bus import event_bus
+from src.core.events import JobProgressEvent
+
+
+@dataclass
+class GenerationProgress:
+    mapping_id: int
+    commit_hash: str
+    state: str = "running"  # running, done, failed, timeout, cancelled
+    tokens: int = 0
+    tool_calls: int = 0
+    llm_calls: int = 0
+    # Wall time spent inside model calls and tool calls; overlapping chunks add up
+    llm_seconds: float = 0.0
+    tool_seconds: float = 0.0
+    # Files loaded ahead of the repo tools, and tool reads they did or did not serve
+    prefetched_files: int = 0
+    prefetch_hits: int = 0
+    prefetch_misses: int = 0
+    # Chunks answered by the generation cache, and chunks sent to the model after a cache lookup
+    cache_hits: int = 0
+    cache_misses: int = 0
+    started_at: float = field(default_factory=time.time)
+    first_token_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    _reported_at: float = field(default=0.0, repr=False)
+
+    def report(self):
+        """
+        Publishes the counters as a "generating" event, at most every
+        EVENT_PROGRESS_INTERVAL_SECONDS.
+        """
+        now = time.monotonic()
+        if now - self._reported_at < config.EVENT_PROGRESS_INTERVAL_SECONDS:
+            return
+        self._reported_at = now
+        event_bus.publish(JobProgressEvent(
+            repo_id=self.mapping_id, commit_hash=self.commit_hash, stage="generating",
+            detail={"tokens": self.tokens, "tool_calls": self.tool_calls, "llm_calls": self.llm_calls,
+                    "tokens_per_second": round(self.tokens_per_second, 1)},
+        ))
+
+    def on_token(self, count: int = 1):
+        if self.first_token_at is None:
+            self.first_token_at = time.time()
+        self.tokens += count
+
+    @property
+    def ttft_seconds(self) -> Optional[float]:
+        if self.first_token_at is None:
+            return None
+        return self.first_token_at - self.started_at
+
+    @property
+    def tokens_per_second(self) -> float:
+        if self.first_token_at is None:
+            return 0.0
+        elapsed = (self.finished_at or time.time()) - self.first_token_at
+        return self.tokens / elapsed if elapsed > 0 else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "mapping_id": self.mapping_id,
+            "commit_hash": self.commit_hash,
+            "state": self.state,
+            "tokens": self.tokens,
+            "tool_calls": self.tool_calls,
+            "llm_calls": self.llm_calls,
+            "llm_seconds": self.llm_seconds,
+            "tool_seconds": self.tool_seconds,
+            "prefetched_files": self.prefetched_files,
+            "prefetch_hits": self.prefetch_hits,
+            "prefetch_misses": self.prefetch_misses,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "elapsed_seconds": (self.finished_at or time.time()) - self.started_at,
+            "ttft_seconds": self.ttft_seconds,
+            "tokens_per_second": self.tokens_per_second,
+        }
+
+
+class GenerationRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._progress: Dict[int, GenerationProgress] = {}
+        self._tasks: Dict[int, tuple] = {}
+
+    def start(self, mapping_id: int, commit_hash: str) -> GenerationProgress:
+        """
+        Registers the calling task as the running generation of the mapping.
+        Must be called from inside that task.
+        """
+        progress = GenerationProgress(mapping_id, commit_hash)
+        with self._lock:
+            self._progress[mapping_id] = progress
+            self._tasks[mapping_id] = (asyncio.get_running_loop(), asyncio.current_task())
+        return progress
+
+    def finish(self, progress: GenerationProgress, state: str):
+        progress.state = state
+        progress.finished_at = time.time()
+        with self._lock:
+            if self._progress.get(progress.mapping_id) is progress:
+                self._tasks.pop(progress.mapping_id, None)
+
+    def cancel(self, mapping_id: int) -> bool:
+        """
+        Cancels the mapping's running generation from any thread.
+        """
+        with self._lock:
+            handle = self._tasks.pop(mapping_id, None)
+        if handle is None:
+            return False
+        loop, task = handle
+        loop.call_soon_threadsafe(task.cancel)
+        return True
+
+    def cancel_all(self) -> int:
+        with self._lock:
+            mapping_ids = list(self._tasks)
+        return sum(1 for mapping_id in mapping_ids if self.cancel(mapping_id))
+
+    def get(self, mapping_id: int) -> Optional[GenerationProgress]:
+        with self._lock:
+            return self._progress.get(mapping_id)
+
+    def all(self) -> List[GenerationProgress]:
+        with self._lock:
+            return sorted(self._progress.values(), key=lambda p: p.mapping_id)
+
+
+generation_registry = GenerationRegistry()
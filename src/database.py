@@ -1,14 +1,235 @@
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, List, Tuple
+
+from sqlalchemy import event, inspect, literal, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.pool import StaticPool
 from sqlmodel import SQLModel, create_engine, Session
 
-sqlite_file_name = "autodoc.db"
-sqlite_url = f"sqlite:///{sqlite_file_name}"
+from src import config
+
+# AUTODOC_DATABASE_URL overrides the configured URL, e.g. a shared Postgres for several nodes
+database_url = os.getenv("AUTODOC_DATABASE_URL", config.DATABASE_URL)
+
+
+def _build_engine(url: str):
+    if not url.startswith("sqlite"):
+        return create_engine(
+            url,
+            pool_size=config.DB_POOL_SIZE,
+            max_overflow=config.DB_MAX_OVERFLOW,
+            pool_pre_ping=True,
+        )
+
+    connect_args = {"check_same_thread": False, "timeout": config.SQLITE_BUSY_TIMEOUT_MS / 1000}
+    if url in ("sqlite://", "sqlite:///:memory:"):
+        # Every connection to :memory: is a separate database, so share one
+        return create_engine(url, connect_args=connect_args, poolclass=StaticPool)
+
+    sqlite_engine = create_engine(
+        url,
+        connect_args=connect_args,
+        pool_size=config.DB_POOL_SIZE,
+        max_overflow=config.DB_MAX_OVERFLOW,
+    )
+
+    @event.listens_for(sqlite_engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        # WAL lets readers (API, watcher) run while the pipeline writes
+        cursor.execute(f"PRAGMA journal_mode={config.SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA busy_timeout={int(config.SQLITE_BUSY_TIMEOUT_MS)}")
+        cursor.execute(f"PRAGMA synchronous={config.SQLITE_SYNCHRONOUS}")
+        cursor.close()
 
-connect_args = {"check_same_thread": False}
-engine = create_engine(sqlite_url, connect_args=connect_args)
+    return sqlite_engine
+
+
+engine = _build_engine(database_url)
+
+def add_missing_columns(table) -> List[str]:
+    """
+    Adds columns declared on the model but missing from an existing table, with
+    their scalar default for the existing rows. Returns the added column names.
+    """
+    existing = {column["name"] for column in inspect(engine).get_columns(table.name)}
+    preparer = engine.dialect.identifier_preparer
+    added = []
+    with engine.begin() as connection:
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = (f"ALTER TABLE {preparer.format_table(table)} "
+                   f"ADD COLUMN {preparer.format_column(column)} {column.type.compile(dialect=engine.dialect)}")
+            default = column.default
+            if default is not None and default.is_scalar and default.arg is not None:
+                value = literal(default.arg).compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True})
+                ddl += f" DEFAULT {value}"
+                if not column.nullable:
+                    ddl += " NOT NULL"
+            connection.execute(text(ddl))
+            added.append(column.name)
+    return added
 
 def create_db_and_tables():
+    import src.db_models  # noqa: F401 -- registers the tables on SQLModel.metadata
     SQLModel.metadata.create_all(engine)
+    # create_all skips tables that already exist, so columns and indexes added to them later are created here
+    for table in SQLModel.metadata.sorted_tables:
+        add_missing_columns(table)
+        for index in table.indexes:
+            try:
+                index.create(engine, checkfirst=True)
+            except IntegrityError as e:
+                # A unique index added later; existing duplicates must be removed by hand first
+                print(f"Warning: cannot create unique index {index.name}, existing rows violate it: {e.orig}")
 
 def get_session():
     with Session(engine) as session:
         yield session
+
+def insert_ignore(session: Session, model, rows: List[dict]) -> int:
+    """
+    Inserts rows, skipping ones whose primary key or unique constraint already
+    exists (another worker or node may insert the same row concurrently).
+    Returns the number of rows inserted.
+    """
+    if session.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return session.execute(insert(model).values(rows).on_conflict_do_nothing()).rowcount
+
+
+def delete_mapping(session: Session, mapping_id: int):
+    """
+    Deletes a mapping with its jobs, traces, logs, lease, doc index and outline
+    rows, so no foreign key is left pointing at it. The caller commits.
+    Patch blobs are content-addressed and shared, so they stay.
+    """
+    from sqlalchemy import delete, select
+    from src.db_models import (DocDependency, MappingLease, OutlineFile, OutlineState, PipelineJob,
+                               ProcessingLog, ProcessingLogPatch, RepoMapping, TraceSpan)
+
+    logs = select(ProcessingLog.id).where(ProcessingLog.mapping_id == mapping_id)
+    session.execute(delete(ProcessingLogPatch).where(ProcessingLogPatch.log_id.in_(logs)))
+    # Children before parents: traces reference jobs, everything references the mapping
+    for model in (ProcessingLog, TraceSpan, PipelineJob, DocDependency, MappingLease, OutlineFile, OutlineState):
+        session.execute(delete(model).where(model.mapping_id == mapping_id))
+    session.execute(delete(RepoMapping).where(RepoMapping.id == mapping_id))
+
+
+class BatchWriter:
+    """
+    Single writer thread for the pipeline's state writes.
+
+    Callers hand over a function that applies its changes to a session; the
+    writer drains whatever has queued up (up to DB_WRITER_BATCH_SIZE operations)
+    and commits it as one transaction, so concurrent workers never compete for
+    the SQLite write lock and share one fsync. If a batch fails it is rolled back
+    and each operation is retried on its own, so one bad write only fails itself.
+    """
+
+    def __init__(self, batch_size: int = None):
+        self.batch_size = batch_size or config.DB_WRITER_BATCH_SIZE
+        self._queue: "queue.Queue[Tuple[Callable[[Session], Any], Future]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.batches = 0
+        self.operations = 0
+
+    def submit(self, operation: Callable[[Session], Any]) -> Future:
+        """
+        Queues operation(session); the future resolves to its return value once committed.
+        """
+        future = Future()
+        self._ensure_thread()
+        self._queue.put((operation, future))
+        return future
+
+    def run(self, operation: Callable[[Session], Any]) -> Any:
+        """
+        Like submit, but waits for the commit and returns the result (or raises).
+        """
+        if threading.current_thread() is self._thread:
+            # Called from inside a batch: apply directly to avoid waiting on ourselves
+            with Session(engine) as session:
+                result = operation(session)
+                session.commit()
+                return result
+        return self.submit(operation).result()
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="autodoc-db-writer", daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._apply(batch)
+                    return
+                batch.append(item)
+            self._apply(batch)
+
+    def _apply(self, batch: List[Tuple[Callable[[Session], Any], Future]]):
+        batch = [(op, future) for op, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        try:
+            with Session(engine) as session:
+                results = [op(session) for op, _ in batch]
+                session.commit()
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            for op, future in batch:
+                self._retry_alone(op, future)
+            return
+        self.batches += 1
+        self.operations += len(batch)
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+    def _retry_alone(self, op, future: Future):
+        try:
+            with Session(engine) as session:
+                result = op(session)
+                session.commit()
+        except Exception as e:
+            future.set_exception(e)
+            return
+        self.batches += 1
+        self.operations += 1
+        future.set_result(result)
+
+    def stop(self, timeout: float = 10.0):
+        """
+        Flushes queued writes and stops the thread.
+        """
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join(timeout)
+
+    def stats(self) -> dict:
+        return {"batches": self.batches, "operations": self.operations, "queued": self._queue.qsize()}
+
+
+db_writer = BatchWriter()
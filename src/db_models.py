@@ -1,24 +1,130 @@
 from datetime import datetime
 from typing import Optional
+from sqlalchemy import Column, Index, LargeBinary, UniqueConstraint
 from sqlmodel import Field, SQLModel
 
+from src import config
+
 class RepoMapping(SQLModel, table=True):
+    # An index rather than a table constraint, so create_db_and_tables can add it to existing databases
+    __table_args__ = (Index("ix_repomapping_source_docs", "source_path", "docs_path", unique=True),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     source_path: str = Field(index=True)
     docs_path: str
     name: Optional[str] = None
     last_processed_commit: str = Field(default="")
-    is_active: bool = Field(default=True)
-    ai_provider: str = Field(default="ollama")
-    ai_model: str = Field(default="gpt-oss:20b")
+    is_active: bool = Field(default=True, index=True)
+    ai_provider: str = Field(default=config.PROVIDER)
+    ai_model: str = Field(default=config.MODEL)
+    priority: int = Field(default=config.DEFAULT_MAPPING_PRIORITY)
+    weight: float = Field(default=config.DEFAULT_MAPPING_WEIGHT)
+    min_interval_seconds: int = Field(default=config.DEFAULT_MAPPING_MIN_INTERVAL_SECONDS)
+    # Comma-separated paths or globs selecting the part of the diff this mapping documents; "!" excludes
+    path_filter: Optional[str] = None
+    # When the scheduler checks the mapping next without a trigger; None means now
+    next_due_at: Optional[datetime] = Field(default=None, index=True)
     created_at: datetime = Field(default_factory=datetime.utcnow)
-    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    # Indexed so workers can pick up changed mappings without reading the whole table
+    updated_at: datetime = Field(default_factory=datetime.utcnow, index=True)
 
 class ProcessingLog(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    mapping_id: int = Field(foreign_key="repomapping.id")
+    mapping_id: int = Field(foreign_key="repomapping.id", index=True)
     commit_hash: str
     timestamp: datetime = Field(default_factory=datetime.utcnow)
     status: str
     summary: Optional[str] = None
-    patches: Optional[str] = None # JSON string of generated patches
+    patches: Optional[str] = None # Legacy JSON string of generated patches; new rows use ProcessingLogPatch
+    # Generation cache hits and misses of the run; None when it did not get to generation
+    cache_hits: Optional[int] = None
+    cache_misses: Optional[int] = None
+
+
+class PatchBlob(SQLModel, table=True):
+    hash: str = Field(primary_key=True)  # sha256 of the uncompressed content
+    size: int  # uncompressed bytes
+    stored_size: int
+    data: bytes = Field(sa_column=Column(LargeBinary, nullable=False))  # zlib-compressed content
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class ProcessingLogPatch(SQLModel, table=True):
+    __table_args__ = (UniqueConstraint("log_id", "path"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    log_id: int = Field(foreign_key="processinglog.id", index=True)
+    path: str
+    blob_hash: str = Field(foreign_key="patchblob.hash", index=True)
+
+
+class GenerationCacheEntry(SQLModel, table=True):
+    key: str = Field(primary_key=True)  # sha256 of prompt version, provider, model and normalized diff
+    provider: str
+    model: str
+    prompt_version: str
+    patches: str  # JSON string of generated patches
+    size: int = 0
+    hits: int = 0
+    created_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+    last_used_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+
+
+class DocDependency(SQLModel, table=True):
+    __table_args__ = (UniqueConstraint("mapping_id", "source_path", "symbol", "doc_path"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    mapping_id: int = Field(foreign_key="repomapping.id", index=True)
+    source_path: str = Field(index=True)
+    symbol: str = Field(default="")  # empty for the file-level dependency
+    doc_path: str
+    commit_hash: str
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class PipelineJob(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    mapping_id: int = Field(foreign_key="repomapping.id", index=True)
+    base_commit: str = Field(default="")  # empty diffs against the empty tree
+    head_commit: str
+    status: str = Field(default="PENDING", index=True)  # PENDING, RUNNING, SUCCESS, SKIPPED, FAILED
+    attempts: int = Field(default=0)
+    last_error: Optional[str] = None
+    next_attempt_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class MappingLease(SQLModel, table=True):
+    mapping_id: int = Field(primary_key=True, foreign_key="repomapping.id")
+    owner: str  # host:pid:nonce of the worker process holding it
+    acquired_at: datetime = Field(default_factory=datetime.utcnow)
+    heartbeat_at: datetime = Field(default_factory=datetime.utcnow)
+    expires_at: datetime = Field(index=True)
+
+
+class TraceSpan(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    job_id: int = Field(foreign_key="pipelinejob.id", index=True)
+    mapping_id: int = Field(foreign_key="repomapping.id", index=True)
+    attempt: int = Field(default=1)
+    name: str
+    started_at: datetime
+    duration_ms: float
+    attributes: Optional[str] = None  # JSON object of sizes and counts
+
+
+class OutlineFile(SQLModel, table=True):
+    __table_args__ = (UniqueConstraint("mapping_id", "path"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    mapping_id: int = Field(foreign_key="repomapping.id", index=True)
+    path: str
+    blob_sha: str
+    outline: str  # JSON list of symbols: kind, name, qualname, line, end, signature, doc
+
+
+class OutlineState(SQLModel, table=True):
+    mapping_id: int = Field(primary_key=True, foreign_key="repomapping.id")
+    commit_hash: str  # commit the mapping's OutlineFile rows describe
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
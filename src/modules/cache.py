@@ -0,0 +1,142 @@
+import hashlib
+import json
+import threading
+from functools import partial
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from sqlmodel import Session, select, func
+
+from src import config
+from src.core.logger import get_logger
+from src.database import db_writer, engine
+from src.db_models import GenerationCacheEntry
+
+logger = get_logger(__name__)
+
+
+def normalize_diff(diff_text: str) -> str:
+    """
+    Drops the parts of a patch that change without the content changing
+    (blob ids on "index" lines, trailing whitespace) so equal diffs hash equally.
+    """
+    lines = []
+    for line in diff_text.splitlines():
+        if line.startswith("index "):
+            continue
+        lines.append(line.rstrip())
+    return "\n".join(lines).strip()
+
+
+def cache_key(diff_text: str, provider: str, model: str, prompt_version: str) -> str:
+    digest = hashlib.sha256()
+    for part in (prompt_version, provider, model, normalize_diff(diff_text)):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class GenerationCache:
+    """
+    Persistent, content-addressed cache of generation results.
+    Entries expire after ttl_seconds and the least recently used ones are evicted
+    once the stored patches exceed max_bytes.
+    """
+
+    def __init__(self, ttl_seconds: Optional[int] = None, max_bytes: Optional[int] = None):
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else config.LLM_CACHE_TTL_SECONDS
+        self.max_bytes = max_bytes if max_bytes is not None else config.LLM_CACHE_MAX_BYTES
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def get(self, key: str) -> Optional[Dict[str, str]]:
+        with Session(engine) as session:
+            entry = session.get(GenerationCacheEntry, key)
+            if entry is not None and entry.created_at < datetime.utcnow() - timedelta(seconds=self.ttl_seconds):
+                session.delete(entry)
+                session.commit()
+                self._count("evictions")
+                entry = None
+            if entry is None:
+                self._count("misses")
+                logger.info("generation cache miss %s", key[:12], extra=self.stats())
+                return None
+
+            patches = json.loads(entry.patches)
+        # Usage stats only drive eviction order, so they are written in the background.
+        db_writer.submit(partial(self._touch, key, datetime.utcnow()))
+        self._count("hits")
+        logger.info("generation cache hit %s", key[:12], extra=self.stats())
+        return patches
+
+    @staticmethod
+    def _touch(key: str, used_at: datetime, session: Session):
+        entry = session.get(GenerationCacheEntry, key)
+        if entry is not None:
+            entry.hits += 1
+            entry.last_used_at = max(entry.last_used_at, used_at)
+            session.add(entry)
+
+    def put(self, key: str, patches: Dict[str, str], provider: str, model: str, prompt_version: str):
+        payload = json.dumps(patches)
+        with Session(engine) as session:
+            entry = session.get(GenerationCacheEntry, key) or GenerationCacheEntry(key=key)
+            entry.provider = provider
+            entry.model = model
+            entry.prompt_version = prompt_version
+            entry.patches = payload
+            entry.size = len(payload.encode("utf-8"))
+            entry.created_at = entry.last_used_at = datetime.utcnow()
+            session.add(entry)
+            session.commit()
+        self._count("stores")
+        self.evict()
+
+    def evict(self):
+        """
+        Removes expired entries, then least recently used ones until under max_bytes.
+        """
+        cutoff = datetime.utcnow() - timedelta(seconds=self.ttl_seconds)
+        removed = 0
+        with Session(engine) as session:
+            for entry in session.exec(select(GenerationCacheEntry).where(GenerationCacheEntry.created_at < cutoff)):
+                session.delete(entry)
+                removed += 1
+
+            total = session.exec(select(func.coalesce(func.sum(GenerationCacheEntry.size), 0))).one()
+            if total > self.max_bytes:
+                rows = session.exec(
+                    select(GenerationCacheEntry.key, GenerationCacheEntry.size)
+                    .order_by(GenerationCacheEntry.last_used_at)
+                ).all()
+                for key, size in rows:
+                    if total <= self.max_bytes:
+                        break
+                    session.delete(session.get(GenerationCacheEntry, key))
+                    total -= size
+                    removed += 1
+            session.commit()
+        if removed:
+            self._count("evictions", removed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.counters)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def storage(self) -> dict:
+        with Session(engine) as session:
+            entries, size = session.exec(
+                select(func.count(), func.coalesce(func.sum(GenerationCacheEntry.size), 0))
+                .select_from(GenerationCacheEntry)
+            ).one()
+        return {"entries": entries, "bytes": size, "max_bytes": self.max_bytes, "ttl_seconds": self.ttl_seconds}
+
+
+generation_cache = GenerationCache()
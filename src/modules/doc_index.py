@@ -0,0 +1,143 @@
+import os
+import re
+from datetime import datetime
+from typing import Dict, Iterable, List, Set
+
+from sqlalchemy import delete, or_
+from sqlmodel import Session, select
+
+from src.core.events import DocumentationGeneratedEvent
+from src.db_models import DocDependency
+
+# Hunk context ("@@ -1,4 +1,5 @@ def login(") and added/removed definitions
+_HUNK_CONTEXT_RE = re.compile(r"^@@ [^@]* @@\s*(.*)$")
+_DEFINITION_RE = re.compile(
+    r"^\s*(?:export\s+)?(?:async\s+)?(?:pub(?:\([^)]*\))?\s+)?"
+    r"(?:def|class|function|func|fn|interface|struct|enum|trait|type)\s+(?:\([^)]*\)\s*)?([A-Za-z_][\w]*)"
+)
+
+
+def changed_symbols(diff) -> List[str]:
+    """
+    Names of the functions/classes a file diff touches: definitions on added or
+    removed lines plus the enclosing definitions git reports in hunk headers.
+    """
+    symbols = set()
+    for line in str(diff).splitlines():
+        if line.startswith("@@"):
+            match = _HUNK_CONTEXT_RE.match(line)
+            text = match.group(1) if match else ""
+        elif line.startswith(("+", "-")) and not line.startswith(("+++", "---")):
+            text = line[1:]
+        else:
+            continue
+        match = _DEFINITION_RE.match(text)
+        if match:
+            symbols.add(match.group(1))
+    return sorted(symbols)
+
+
+class DocIndex:
+    """
+    Maps source paths (and symbols within them) to the doc files generated from them,
+    so later diffs can be routed straight to the docs they affect.
+    """
+
+    def lookup(self, session: Session, mapping_id: int, changes: Dict[str, List[str]]) -> Dict[str, List[str]]:
+        """
+        Returns {source path: [doc paths]} for the changed sources ({path: changed
+        symbols}) that have known docs; docs recorded for one of the changed symbols
+        come first. A source without docs of its own (a new file, or code moved into
+        it) gets the docs of its changed symbols that are known from a single other source.
+        """
+        if not changes:
+            return {}
+        symbols = {symbol for names in changes.values() for symbol in names}
+        condition = DocDependency.source_path.in_(sorted(changes))
+        if symbols:
+            condition = or_(condition, DocDependency.symbol.in_(sorted(symbols)))
+        rows = session.exec(
+            select(DocDependency.source_path, DocDependency.symbol, DocDependency.doc_path)
+            .where(DocDependency.mapping_id == mapping_id)
+            .where(condition)
+        ).all()
+        file_docs: Dict[str, Set[str]] = {}
+        # symbol -> source path -> docs
+        symbol_docs: Dict[str, Dict[str, Set[str]]] = {}
+        for source_path, symbol, doc_path in rows:
+            if not symbol:
+                file_docs.setdefault(source_path, set()).add(doc_path)
+            elif symbol in symbols:
+                symbol_docs.setdefault(symbol, {}).setdefault(source_path, set()).add(doc_path)
+
+        targets = {}
+        for source_path, names in changes.items():
+            if source_path in file_docs:
+                first = {doc for name in names for doc in symbol_docs.get(name, {}).get(source_path, ())}
+                docs = sorted(first) + sorted(file_docs[source_path] - first)
+            else:
+                # Common names (main, run, ...) are defined in many files and say nothing about where code moved
+                docs = sorted({doc for name in names if len(symbol_docs.get(name, {})) == 1
+                               for doc in next(iter(symbol_docs[name].values()))})
+            if docs:
+                targets[source_path] = docs
+        return targets
+
+    @staticmethod
+    def missing_docs(docs_root: str, doc_paths: Iterable[str]) -> Set[str]:
+        """
+        The doc paths that no longer exist in the docs folder.
+        """
+        return {doc for doc in doc_paths if not os.path.isfile(os.path.join(docs_root, doc))}
+
+    def update(self, session: Session, mapping_id: int, event: DocumentationGeneratedEvent,
+               removed_sources: Iterable[str] = (), missing_docs: Iterable[str] = ()):
+        """
+        Records which sources and symbols each patched doc was generated from, and
+        drops the entries of sources deleted by the diff and of docs that no longer
+        exist. Adds rows to the session; the caller commits.
+        """
+        removed_sources, missing_docs = set(removed_sources), set(missing_docs)
+        if removed_sources:
+            session.execute(delete(DocDependency).where(DocDependency.mapping_id == mapping_id,
+                                                        DocDependency.source_path.in_(sorted(removed_sources))))
+        if missing_docs:
+            session.execute(delete(DocDependency).where(DocDependency.mapping_id == mapping_id,
+                                                        DocDependency.doc_path.in_(sorted(missing_docs))))
+
+        now = datetime.utcnow()
+        wanted = set()
+        for doc_path, source_paths in event.sources.items():
+            if doc_path not in event.patches or doc_path in missing_docs:
+                continue
+            for source_path in source_paths:
+                if source_path in removed_sources:
+                    continue
+                wanted.add((source_path, "", doc_path))
+                for symbol in event.symbols.get(source_path, []):
+                    wanted.add((source_path, symbol, doc_path))
+        if not wanted:
+            return
+
+        existing = session.exec(
+            select(DocDependency)
+            .where(DocDependency.mapping_id == mapping_id)
+            .where(DocDependency.source_path.in_({source for source, _, _ in wanted}))
+        ).all()
+        for row in existing:
+            key = (row.source_path, row.symbol, row.doc_path)
+            if key in wanted:
+                row.commit_hash = event.commit_hash
+                row.updated_at = now
+                session.add(row)
+                wanted.discard(key)
+
+        for source_path, symbol, doc_path in sorted(wanted):
+            session.add(DocDependency(
+                mapping_id=mapping_id,
+                source_path=source_path,
+                symbol=symbol,
+                doc_path=doc_path,
+                commit_hash=event.commit_hash,
+                updated_at=now,
+            ))
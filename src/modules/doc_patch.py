@@ -0,0 +1,207 @@
+"""
+Section-level edits to markdown docs.
+
+Instead of returning a whole doc, the model can return a list of operations
+against its current content: replace, insert or delete a section (anchored by
+its heading) or apply unified-diff hunks. Operations are applied in order and
+each one must still match the current text, otherwise PatchConflict is raised
+and nothing is applied to that doc.
+"""
+
+import re
+from typing import Any, Dict, List, Tuple
+
+from src.core.events import DocOperation
+
+_HEADING_RE = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$")
+_FENCE_RE = re.compile(r"^\s*(```|~~~)")
+_HUNK_RE = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+# Separates parent and child headings in an anchor, e.g. "Usage > Install"
+ANCHOR_SEPARATOR = ">"
+
+
+class PatchConflict(ValueError):
+    pass
+
+
+def _normalize(title: str) -> str:
+    return " ".join(title.strip().lstrip("#").split()).lower()
+
+
+def _sections(lines: List[str]) -> List[Tuple[int, int, int, str]]:
+    """
+    (start, end, level, title) of every heading; end is exclusive and includes subsections.
+    Headings inside fenced code blocks are ignored.
+    """
+    headings = []
+    fenced = False
+    for index, line in enumerate(lines):
+        if _FENCE_RE.match(line):
+            fenced = not fenced
+            continue
+        if fenced:
+            continue
+        match = _HEADING_RE.match(line.rstrip("\n"))
+        if match:
+            headings.append((index, len(match.group(1)), match.group(2)))
+    sections = []
+    for i, (start, level, title) in enumerate(headings):
+        end = next((other for other, other_level, _ in headings[i + 1:] if other_level <= level), len(lines))
+        sections.append((start, end, level, title))
+    return sections
+
+
+def find_section(lines: List[str], anchor: str) -> Tuple[int, int]:
+    """
+    Line range of the section whose heading matches anchor ("Title" or
+    "Parent > Title"). Raises PatchConflict if none or several match.
+    """
+    parts = [_normalize(part) for part in anchor.split(ANCHOR_SEPARATOR)]
+    sections = _sections(lines)
+    matches = []
+    for start, end, level, title in sections:
+        if _normalize(title) != parts[-1]:
+            continue
+        # Walk up the enclosing sections to check the parent titles
+        parents = [_normalize(t) for s, e, l, t in sections if s < start and e >= end and l < level]
+        if parts[:-1] and parents[-len(parts) + 1:] != parts[:-1]:
+            continue
+        matches.append((start, end))
+    if not matches:
+        raise PatchConflict(f"section '{anchor}' not found")
+    if len(matches) > 1:
+        raise PatchConflict(f"section '{anchor}' is ambiguous ({len(matches)} matches), use 'Parent > Title'")
+    return matches[0]
+
+
+def _content_lines(content: str) -> List[str]:
+    if not content:
+        return []
+    return (content if content.endswith("\n") else content + "\n").splitlines(keepends=True)
+
+
+def _separate(replacement: List[str], lines: List[str], end: int) -> List[str]:
+    # Keep a blank line between new content and the text that follows it
+    if replacement and replacement[-1].strip() and end < len(lines):
+        return replacement + ["\n"]
+    return replacement
+
+
+def _ensure_newline(lines: List[str], index: int):
+    # Inserting after a last line without a newline would glue the two together
+    if 0 < index <= len(lines) and not lines[index - 1].endswith("\n"):
+        lines[index - 1] += "\n"
+
+
+def _apply_hunks(lines: List[str], diff: str) -> List[str]:
+    hunks = []
+    for line in diff.splitlines():
+        match = _HUNK_RE.match(line)
+        if match:
+            hunks.append((int(match.group(1)), []))
+        elif hunks and line.startswith((" ", "-", "+")):
+            hunks[-1][1].append(line)
+        elif hunks and line == "":
+            # Blank context lines often lose their leading space
+            hunks[-1][1].append(" ")
+    if not hunks:
+        raise PatchConflict("diff has no hunks")
+
+    result = list(lines)
+    offset = 0
+    for old_start, body in hunks:
+        old = [line[1:] for line in body if line[0] in " -"]
+        new = [line[1:] for line in body if line[0] in " +"]
+        # A hunk without old lines ("-7,0") inserts after old line 7, not before it
+        anchor = old_start - 1 if old else old_start
+        expected = max(anchor + offset, 0)
+        stripped = [line.rstrip("\n") for line in result]
+        position = None
+        # Nearest exact match of the old lines to where the hunk says they are
+        for distance in range(len(result) + 1):
+            for candidate in (expected - distance, expected + distance):
+                if 0 <= candidate <= len(result) - len(old) and stripped[candidate:candidate + len(old)] == old:
+                    position = candidate
+                    break
+            if position is not None:
+                break
+        if position is None:
+            raise PatchConflict(f"hunk at line {old_start} does not match the current content")
+        if not old:
+            _ensure_newline(result, position)
+        result[position:position + len(old)] = [line + "\n" for line in new]
+        offset = position + len(new) - len(old) - anchor
+    return result
+
+
+def apply_operation(content: str, operation: DocOperation) -> str:
+    lines = content.splitlines(keepends=True)
+    if operation.op == "replace_section":
+        start, end = find_section(lines, operation.section or "")
+        replacement = _content_lines(operation.content)
+        if replacement and not _HEADING_RE.match(replacement[0].rstrip("\n")):
+            # Body only: keep the existing heading
+            replacement = [lines[start] if lines[start].endswith("\n") else lines[start] + "\n"] + replacement
+        lines[start:end] = _separate(replacement, lines, end)
+    elif operation.op == "delete_section":
+        start, end = find_section(lines, operation.section or "")
+        del lines[start:end]
+    elif operation.op == "insert_section":
+        if operation.after:
+            _, index = find_section(lines, operation.after)
+        elif operation.before:
+            index, _ = find_section(lines, operation.before)
+        else:
+            index = len(lines)
+        _ensure_newline(lines, index)
+        inserted = _separate(_content_lines(operation.content), lines, index)
+        if inserted and index > 0 and lines[index - 1].strip():
+            inserted = ["\n"] + inserted
+        lines[index:index] = inserted
+    elif operation.op == "diff":
+        lines = _apply_hunks(lines, operation.diff)
+    else:
+        raise PatchConflict(f"unknown operation '{operation.op}'")
+    return "".join(lines)
+
+
+def apply_operations(content: str, operations: List[DocOperation]) -> str:
+    """
+    Applies the operations in order. Raises PatchConflict naming the first one
+    that does not apply.
+    """
+    for number, operation in enumerate(operations, 1):
+        try:
+            content = apply_operation(content, operation)
+        except PatchConflict as e:
+            raise PatchConflict(f"operation {number} ({operation.op}): {e}") from None
+    return content
+
+
+def split_output(output: Dict[str, Any]) -> Tuple[Dict[str, str], Dict[str, List[DocOperation]]]:
+    """
+    Splits the model's JSON answer into full contents (string values) and
+    operation lists (list values). Raises ValueError on anything else.
+    """
+    patches: Dict[str, str] = {}
+    operations: Dict[str, List[DocOperation]] = {}
+    for path, value in output.items():
+        if isinstance(value, str):
+            patches[path] = value
+        elif isinstance(value, list):
+            operations[path] = [DocOperation.model_validate(item) for item in value]
+        else:
+            raise ValueError(f"{path}: expected markdown content or a list of operations")
+    return patches, operations
+
+
+def merge_operations(lists: List[List[DocOperation]]) -> List[DocOperation]:
+    """
+    Concatenates operation lists from several chunks in chunk order, dropping repeats.
+    """
+    merged: List[DocOperation] = []
+    for operations in lists:
+        for operation in operations:
+            if operation not in merged:
+                merged.append(operation)
+    return merged
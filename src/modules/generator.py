@@ -1,24 +1,37 @@
 import json
 import re
-from langchain_core.prompts import PromptTemplate
-from langchain_core.output_parsers import JsonOutputParser
-from langchain_core.callbacks.base import BaseCallbackHandler
+import asyncio
+import threading
+import time
+from contextlib import nullcontext
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from langchain_core.callbacks.base import AsyncCallbackHandler, BaseCallbackHandler
 from langchain.agents import create_agent
 from langchain.tools import tool
-from langchain.messages import HumanMessage, AIMessage
+from langchain.messages import HumanMessage, AIMessage, AIMessageChunk, ToolMessage
 from langchain_community.agent_toolkits import FileManagementToolkit
 
 from src import config
-from src.core.llm import LLMFactory
+from src.core.llm import LLMFactory, llm_loop
 from src.core.logger import get_logger
+from src.core.progress import GenerationProgress, generation_registry
 from src.db_models import RepoMapping
-from src.core.events import DocumentationGeneratedEvent
-from typing import Dict, List, Any
+from src.core.events import DocOperation, DocumentationGeneratedEvent
+from src.modules.cache import cache_key, generation_cache
+from src.modules.doc_index import changed_symbols
+from src.modules.doc_patch import merge_operations, split_output
+from src.modules.outline import RepoOutline
+from src.modules.snapshot import CommitSnapshot, prefetch_pool, prefetch_stats
+from typing import Dict, List, Any, Optional, Tuple
 
 from pathlib import Path
 
 logger = get_logger(__name__)
 
+# Part of the generation cache key: bump whenever the prompts or output format change.
+PROMPT_VERSION = "5"
+
 
 class ToolMixin(BaseCallbackHandler):
     def on_tool_start(
@@ -37,6 +50,70 @@ class ToolMixin(BaseCallbackHandler):
 tool_callback = ToolMixin()
 
 
+class RateLimitCallback(AsyncCallbackHandler):
+    """
+    Waits for the provider's rate-limit token before every model request of a run,
+    so agent turns are limited one by one rather than once per run.
+    """
+
+    def __init__(self, limiter, provider: str, model: str):
+        self.limiter = limiter
+        self.provider = provider
+        self.model = model
+
+    async def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        await self.limiter.throttle(self.provider, self.model)
+
+    async def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        await self.limiter.throttle(self.provider, self.model)
+
+
+class TimingCallback(BaseCallbackHandler):
+    """
+    Adds the time spent in model calls and in tool calls to a generation's progress.
+    """
+
+    def __init__(self, progress: GenerationProgress):
+        self.progress = progress
+        self._lock = threading.Lock()
+        self._started: Dict[Any, float] = {}
+
+    def _start(self, run_id):
+        with self._lock:
+            self._started[run_id] = time.perf_counter()
+
+    def _stop(self, run_id) -> float:
+        with self._lock:
+            started = self._started.pop(run_id, None)
+        return time.perf_counter() - started if started is not None else 0.0
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        elapsed = self._stop(run_id)
+        with self._lock:
+            self.progress.llm_calls += 1
+            self.progress.llm_seconds += elapsed
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self.on_llm_end(None, run_id=run_id)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        elapsed = self._stop(run_id)
+        with self._lock:
+            self.progress.tool_seconds += elapsed
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self.on_tool_end(None, run_id=run_id)
+
+
 # @tool
 # def emit_documentation_patches(patches: Dict[str, str]) -> Dict[str, str]:
 #     """
@@ -47,107 +124,483 @@ tool_callback = ToolMixin()
 #     return patches
 
 
-def parse_json_string(raw_str: str) -> Dict[str, str]:
+def parse_json_string(raw_str: str) -> Dict[str, Any]:
     """Parse JSON, remove ```json/``` and spaces"""
     cleaned = re.sub(r'```\w*', '', raw_str).strip()
     return json.loads(cleaned)
 
 
+@dataclass
+class _Run:
+    """
+    State of one generation, visible to the repo tools through _current_run so
+    that compiled agents (and their tools) can be shared between runs.
+    """
+    mapping: RepoMapping
+    provider: str
+    model: str
+    llm: Any
+    snapshot: CommitSnapshot
+    doc_targets: Dict[str, List[str]]
+    progress: GenerationProgress
+    outline: Optional[RepoOutline] = None
+    # Current content of target docs, loaded by the prefetch
+    docs: Dict[str, str] = field(default_factory=dict)
+
+
+_current_run: ContextVar[_Run] = ContextVar("autodoc_generation_run")
+
+
+@tool
+def lookup_code(query: str) -> str:
+    """Search the repository outline: files, classes and functions with signatures and line numbers.
+    Pass a symbol name or part of one (e.g. 'login', 'AuthService.check'), a file path for that file's
+    outline, or a directory (e.g. 'src/auth/') for the outlines of every file in it. '' lists top-level folders.
+    Then read only the lines you need with read_repo_file."""
+    outline = _current_run.get().outline
+    if outline is None:
+        return "The outline index is unavailable for this run; use list_repo_files and read_repo_file."
+    result = outline.search(query)
+    logger.info("lookup_code called with arg query: %s (%d chars)", query, len(result))
+    if config.LOG_TOOL_CONTENT:
+        logger.debug("lookup_code %s result:\n%s", query, result)
+    return result
+
+
+@tool
+def list_repo_files(dir_path: str) -> List[str]:
+    """List all files and directories in the repository (one level only, non-recursive). I recommend to check './src'"""
+    try:
+        result = _current_run.get().snapshot.list_dir(dir_path)
+    except (OSError, ValueError) as e:
+        logger.warning("list_repo_files(%s): %s", dir_path, e)
+        return []
+    logger.info("list_repo_files called with arg dir_path: %s (%d entries)", dir_path, len(result))
+    if config.LOG_TOOL_CONTENT:
+        logger.debug("list_repo_files %s result: %s", dir_path, result)
+    return result
+
+
+@tool
+def read_repo_file(path: str, start_line: int = 0, end_line: int = 0) -> str:
+    """Read a repository file and return its contents. Relative paths recommended.
+    start_line/end_line (1-based, inclusive) limit the result to those lines, e.g. a function
+    found with lookup_code; 0 means the start or end of the file."""
+    try:
+        result = _current_run.get().snapshot.read_file(path)
+    except Exception as e:
+        return f"ERROR: {e}"
+    if start_line or end_line:
+        lines = result.splitlines(keepends=True)
+        first = max(start_line, 1)
+        last = min(end_line or len(lines), len(lines))
+        result = f"[lines {first}-{last} of {len(lines)}]\n" + "".join(lines[first - 1:last])
+    logger.info("read_repo_file called with arg path: %s (%d chars)", path, len(result))
+    if config.LOG_TOOL_CONTENT:
+        logger.debug("read_repo_file %s result:\n%s", path, result)
+    return result
+
+
+class GenerationError(Exception):
+    pass
+
+
+class GenerationCancelled(GenerationError):
+    pass
+
+
 class DocumentationGenerator:
-    def __init__(self, provider: str = "ollama", model: str = "gpt-oss:20b"):
-        self.llm = LLMFactory.create_llm(provider, model)
-        self.parser = JsonOutputParser()
+    def __init__(self, provider: Optional[str] = None, model: Optional[str] = None):
+        # Override the mapping's ai_provider/ai_model when set
+        self.provider = provider
+        self.model = model
+        self.mode = config.GENERATION_MODE
+        self.workers = config.GENERATION_WORKERS
+        self.chunk_max_bytes = config.CHUNK_MAX_BYTES
+        self.timeout = config.GENERATION_TIMEOUT_SECONDS
+        # Optional ProviderLimiter: its slot() is held around each generation call, throttle() runs per model request.
+        self.limiter = None
+        self.cache = generation_cache if config.LLM_CACHE_ENABLED else None
 
-        # We instruct the model to return a JSON object where keys are filenames and values are markdown content.
+        # We instruct the model to return a JSON object where keys are filenames and values are
+        # either full markdown content (new docs) or a list of section edits (existing docs).
+        # The system prompt is fixed so the compiled agent can be reused; the diff goes in the user message.
         self.prompt = """
             You are an expert technical writer.
-            Analyze the following git diff and generate or update the documentation.
-            
-            Please call tools to navigate, and at the end return ONLY a valid JSON object.
-            The keys should be the file paths of the documentation files (e.g., "modules/auth.md", "README.md").
-            The values should be the full markdown content for those files.
+            Analyze the git diff in the user message and generate or update the documentation.
             
+            Find the code you need with lookup_code (one call searches the whole repository outline)
+            and read just the relevant lines with read_repo_file; avoid reading whole files or
+            listing directories one by one.
+            At the end return ONLY a valid JSON object. Its keys are the file paths of the
+            documentation files (e.g. "modules/auth.md", "README.md").
+
+            For a doc that already exists, the value is a list of edits, so only the changed
+            parts are written out. Sections are named by their heading text ("Usage", or
+            "Usage > Install" if a title repeats):
+              {"op": "replace_section", "section": "Login", "content": "## Login\n..."}
+              {"op": "insert_section", "after": "Login", "content": "## Logout\n..."}
+              {"op": "insert_section", "before": "Login", "content": "..."}
+              {"op": "delete_section", "section": "Legacy API"}
+              {"op": "diff", "diff": "@@ -12,3 +12,4 @@\n context\n-old line\n+new line\n context"}
+            replace_section replaces the heading and everything under it, subsections included;
+            content without a heading line replaces only the body. Use diff for small edits
+            inside a long section. Edits apply in order.
+            For a new doc (or one that must be rewritten completely) the value is its full
+            markdown content as a string.
+
             If the diff implies a new feature, create a new doc file.
             If it modifies existing logic, update the corresponding doc file.
+            Docs listed under KNOWN DOCUMENTATION TARGETS were generated from the changed
+            files before; update those first instead of searching for them.
+            """
+
+        self.request = """
+            KNOWN DOCUMENTATION TARGETS:
+            {context}
             
             GIT DIFF:
             {diff}
             
             """
 
-    def generate(self, diffs: list, mapping: RepoMapping, commit_hash: str) -> DocumentationGeneratedEvent:
+        self.merge_prompt = """
+            You are an expert technical writer.
+            Several partial updates were generated for the documentation file "{path}",
+            each from a different part of the same change. Merge them into a single
+            coherent markdown document that keeps every relevant update.
+            Return ONLY the merged markdown content.
+
+            {versions}
+            """
+
+    def generate(self, diffs: list, mapping: RepoMapping, commit_hash: str,
+                 doc_targets: Optional[Dict[str, List[str]]] = None,
+                 outline: Optional[RepoOutline] = None) -> DocumentationGeneratedEvent:
+        """
+        Blocking wrapper around agenerate for worker threads. Runs on the shared
+        LLM event loop so pooled client connections survive between runs.
+        """
+        return llm_loop.run(self.agenerate(diffs, mapping, commit_hash, doc_targets, outline))
+
+    async def agenerate(self, diffs: list, mapping: RepoMapping, commit_hash: str,
+                        doc_targets: Optional[Dict[str, List[str]]] = None,
+                        outline: Optional[RepoOutline] = None) -> DocumentationGeneratedEvent:
         """
         Generates documentation patches based on the diff.
+
+        Uses the mapping's ai_provider/ai_model (unless overridden on the
+        generator) through the shared client from LLMFactory.
+
+        doc_targets maps source paths to the docs previously generated from them
+        (see DocIndex); those docs are handed to the agent up front so it does not
+        have to search for them. outline (see OutlineIndex) backs the lookup_code tool.
+
+        In "map_reduce" mode a diff larger than CHUNK_MAX_BYTES is split by doc
+        target or module, the chunks are generated concurrently (bounded by
+        GENERATION_WORKERS and the provider limiter) and the per-chunk patches are
+        merged in chunk order.
+
+        Existing docs come back as edit lists (event.operations, applied by the
+        writer) rather than full contents, so output tokens follow the size of
+        the change instead of the size of the doc.
+
+        The whole generation is bounded by GENERATION_TIMEOUT_SECONDS and can be
+        cancelled through generation_registry; progress (tokens, tool calls) is
+        reported there while the agent streams.
+        Raises GenerationError if any part of the generation fails, or
+        GenerationCancelled if it was cancelled.
         """
-        try:
-            print(f"Generating docs for repo {mapping.id}, commit {commit_hash}...")
-            docs_toolkit = FileManagementToolkit(
-                root_dir=str(Path(mapping.docs_path))
-            )
+        print(f"Generating docs for repo {mapping.id}, commit {commit_hash}...")
+        doc_targets = doc_targets or {}
+        if self.mode == "map_reduce":
+            chunks = partition_diffs(diffs, self.chunk_max_bytes, targets=doc_targets)
+        else:
+            chunks = [diffs]
 
-            @tool
-            def list_repo_files(dir_path: str) -> List[str]:
-                """List all files and directories in the repository (one level only, non-recursive). I recommend to check './src'"""
-                root_path = Path(dir_path)
-                if not root_path.is_absolute():
-                    root_path = Path(mapping.source_path)/root_path
-
-                if not root_path.exists():
-                    logger.warning("Path does not exist: %s", dir_path)
-                    return []
-
-                if not root_path.is_dir():
-                    logger.warning("Path is not a directory: %s", dir_path)
-                    return []
-
-                ignore_dirs = getattr(config, 'IGNORE_DIRS', set())
-
-                result = []
-                for item in root_path.iterdir():
-                    # Skip dot-marked and ignored folders
-                    if item.name.startswith('.') and item.name not in {'.gitignore', '.env'}:
-                        continue
-                    if item.name in ignore_dirs:
-                        continue
-
-                    if item.is_file():
-                        result.append(item.name)
-                    elif item.is_dir():
-                        result.append(f"{item.name}/")
-
-                logger.info("list_repo_files called with arg dir_path: %s\nresult: %s", dir_path, str(result))
-                return sorted(result)
-
-            @tool
-            def read_repo_file(path: str) -> str:
-                """Read a repository file and return its contents. Relative paths recommended."""
-                logger.info("read_repo_file called with arg dir_path: %s", path)
-                try:
-                    if not path.is_absolute():
-                        path = Path(mapping.source_path)/path
-                    result = Path(path).read_text()
-                    logger.info("read_repo_file called with arg dir_path: %s\nresult: %s", path, str(result))
-                    return result
-                except Exception as e:
-                    return f"ERROR: {e}"
-
-            tools = docs_toolkit.get_tools()
-            tools.append(list_repo_files)
-            tools.append(read_repo_file)
-            agent = create_agent(model=self.llm, tools=tools, system_prompt=self.prompt.format(diff=str(diffs)))
-            # Invoke the chain
-            result = agent.invoke({"messages": []}, config={"callbacks": [tool_callback]})
-            print(result['messages'][0].content)
-            return DocumentationGeneratedEvent(
-                repo_id=mapping.id,
-                commit_hash=commit_hash,
-                patches=parse_json_string(result['messages'][0].content)
+        progress = generation_registry.start(mapping.id, commit_hash)
+        try:
+            results, (patches, operations) = await asyncio.wait_for(
+                self._generate_all(chunks, mapping, commit_hash, doc_targets, progress, outline),
+                timeout=self.timeout,
             )
+        except asyncio.CancelledError:
+            generation_registry.finish(progress, "cancelled")
+            print(f"Generation cancelled for repo {mapping.id}, commit {commit_hash}")
+            raise GenerationCancelled(f"Generation for commit {commit_hash} was cancelled")
+        except asyncio.TimeoutError:
+            generation_registry.finish(progress, "timeout")
+            print(f"Error generating documentation: timed out after {self.timeout}s")
+            raise GenerationError(f"Generation timed out after {self.timeout}s")
         except Exception as e:
+            generation_registry.finish(progress, "failed")
             print(f"Error generating documentation: {e}")
-            # Return empty event on failure to keep pipeline moving (or re-raise if we want retry logic)
-            return DocumentationGeneratedEvent(
-                repo_id=mapping.id,
-                commit_hash=commit_hash,
-                patches={}
-            )
+            raise GenerationError(str(e)) from e
+        generation_registry.finish(progress, "done")
+
+        sources: Dict[str, set] = {}
+        for chunk, chunk_patches in zip(chunks, results):
+            for doc_path in chunk_patches:
+                sources.setdefault(doc_path, set()).update(getattr(d, "path", "") for d in chunk)
+        symbols = {d.path: changed_symbols(d) for d in diffs if getattr(d, "path", None)}
+
+        return DocumentationGeneratedEvent(
+            repo_id=mapping.id,
+            commit_hash=commit_hash,
+            patches=patches,
+            operations=operations,
+            sources={doc: sorted(p for p in paths if p) for doc, paths in sources.items()},
+            symbols={path: names for path, names in symbols.items() if names},
+        )
+
+    async def _generate_all(self, chunks: List[list], mapping: RepoMapping, commit_hash: str,
+                            doc_targets: Dict[str, List[str]], progress: GenerationProgress,
+                            outline: Optional[RepoOutline] = None):
+        provider = self.provider or mapping.ai_provider
+        model = self.model or mapping.ai_model
+        # Repo tools read from the commit being documented, not the working tree.
+        # Opening it touches git, so keep it off the shared event loop.
+        snapshot = await asyncio.to_thread(CommitSnapshot, mapping.source_path, commit_hash)
+        with snapshot:
+            run = _Run(mapping, provider, model, LLMFactory.get_llm(provider, model), snapshot, doc_targets, progress,
+                       outline)
+            if len(chunks) > 1:
+                print(f"Splitting diff for repo {mapping.id} into {len(chunks)} chunks")
+            semaphore = asyncio.Semaphore(self.workers)
+
+            async def run_chunk(chunk):
+                async with semaphore:
+                    return await self._generate_chunk(chunk, run)
+
+            prefetch = None
+            if config.PREFETCH_ENABLED:
+                # Runs on its own git process while the first model calls are in flight
+                paths = [d.path for chunk in chunks for d in chunk if getattr(d, "path", None)]
+                prefetch = prefetch_pool().submit(self._prefetch, run, paths)
+
+            # Tasks copy the current context, so the tools of every chunk see this run.
+            _current_run.set(run)
+            tasks = [asyncio.ensure_future(run_chunk(chunk)) for chunk in chunks]
+            try:
+                # gather keeps chunk order, not completion order, so the merge is deterministic.
+                results = await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                raise
+            finally:
+                if prefetch is not None:
+                    prefetch.cancel()
+                    self._record_prefetch(run)
+            return results, await self._merge(results, run)
+
+    def _prefetch(self, run: _Run, paths: List[str]):
+        """
+        Loads the docs generated from the changed files, then the repository files around them.
+        """
+        for doc_path in sorted({doc for path in paths for doc in run.doc_targets.get(path, [])}):
+            try:
+                run.docs[doc_path] = (Path(run.mapping.docs_path) / doc_path).read_text(encoding="utf-8")
+            except OSError:
+                continue
+        try:
+            loaded = run.snapshot.prefetch(paths)
+            logger.debug("Prefetched %d files (%d bytes) for repo %s", loaded, run.snapshot.prefetched_bytes,
+                         run.mapping.id)
+        except Exception as e:
+            logger.warning("Prefetch for repo %s failed: %s", run.mapping.id, e)
+
+    @staticmethod
+    def _record_prefetch(run: _Run):
+        snapshot, progress = run.snapshot, run.progress
+        progress.prefetched_files = len(snapshot.prefetched)
+        progress.prefetch_hits = snapshot.prefetch_hits
+        progress.prefetch_misses = snapshot.prefetch_misses
+        prefetch_stats.add(len(snapshot.prefetched), snapshot.prefetched_bytes,
+                           snapshot.prefetch_hits, snapshot.prefetch_misses)
+
+    async def _merge(self, results: List[Dict[str, Any]], run: _Run
+                     ) -> Tuple[Dict[str, str], Dict[str, List[DocOperation]]]:
+        """
+        Full contents of one doc from several chunks are merged by the model; edit
+        lists are concatenated in chunk order, which needs no model call.
+        """
+        variants: Dict[str, List[str]] = {}
+        edits: Dict[str, List[List[DocOperation]]] = {}
+        for output in results:
+            patches, operations = split_output(output)
+            for path, content in patches.items():
+                if content not in variants.setdefault(path, []):
+                    variants[path].append(content)
+            for path, items in operations.items():
+                edits.setdefault(path, []).append(items)
+
+        merged = {}
+        for path in sorted(variants):
+            contents = variants[path]
+            merged[path] = contents[0] if len(contents) == 1 else await self._merge_variants(path, contents, run)
+        return merged, {path: merge_operations(lists) for path, lists in sorted(edits.items())}
+
+    async def _merge_variants(self, path: str, contents: List[str], run: _Run) -> str:
+        """
+        Several chunks rewrote the same doc file; ask the model to combine them.
+        Falls back to the first chunk's version if the merge call fails.
+        """
+        parts = "\n\n".join(f"--- VERSION {i + 1} ---\n{content}" for i, content in enumerate(contents))
+        try:
+            async with self._llm_slot(run):
+                result = await run.llm.ainvoke(self.merge_prompt.format(path=path, versions=parts),
+                                               config={"callbacks": self._callbacks(run)})
+            return re.sub(r'```\w*', '', result.content).strip()
+        except Exception as e:
+            logger.warning("Merging %d versions of %s failed, keeping the first: %s", len(contents), path, e)
+            return contents[0]
+
+    async def _generate_chunk(self, diffs: list, run: _Run) -> Dict[str, Any]:
+        diff_text = "\n".join(map(str, diffs))
+        context = await asyncio.to_thread(self._doc_context, diffs, run.mapping, run.doc_targets, run.docs)
+        key = None
+        if self.cache is not None:
+            # The known docs' current content shapes the output, so it is part of the key.
+            key = cache_key(f"{diff_text}\n{context}", run.provider, run.model, PROMPT_VERSION)
+            try:
+                cached = await asyncio.to_thread(self.cache.get, key)
+            except Exception as e:
+                logger.warning("Generation cache lookup failed: %s", e)
+                cached = None
+            if cached is not None:
+                run.progress.cache_hits += 1
+                return cached
+            run.progress.cache_misses += 1
+
+        patches = await self._run_agent(diff_text, context, run)
+        # Reject malformed edits before they reach the cache
+        split_output(patches)
+        if key is not None:
+            try:
+                await asyncio.to_thread(self.cache.put, key, patches, run.provider, run.model, PROMPT_VERSION)
+            except Exception as e:
+                logger.warning("Generation cache store failed: %s", e)
+        return patches
+
+    def _doc_context(self, diffs: list, mapping: RepoMapping, doc_targets: Dict[str, List[str]],
+                     loaded: Optional[Dict[str, str]] = None) -> str:
+        """
+        Lists the docs known to depend on the changed files, with their current
+        content up to DOC_CONTEXT_MAX_BYTES in total.
+        """
+        docs: Dict[str, List[str]] = {}
+        for diff in diffs:
+            path = getattr(diff, "path", None)
+            for doc_path in doc_targets.get(path, []):
+                docs.setdefault(doc_path, []).append(path)
+        if not docs:
+            return "(none known, explore the repository and docs to find them)"
+
+        lines = [f"- {doc} <- {', '.join(sorted(paths))}" for doc, paths in sorted(docs.items())]
+        budget = config.DOC_CONTEXT_MAX_BYTES
+        for doc_path in sorted(docs):
+            content = (loaded or {}).get(doc_path)
+            if content is None:
+                try:
+                    content = (Path(mapping.docs_path) / doc_path).read_text(encoding="utf-8")
+                except OSError:
+                    continue
+            if len(content) > budget:
+                lines.append(f"\nCURRENT CONTENT OF {doc_path}: (too large, read it with the docs tools)")
+                continue
+            budget -= len(content)
+            lines.append(f"\nCURRENT CONTENT OF {doc_path}:\n{content}")
+        return "\n".join(lines)
+
+    def _build_agent(self, llm, docs_path: str):
+        tools = FileManagementToolkit(root_dir=docs_path).get_tools()
+        tools.append(lookup_code)
+        tools.append(list_repo_files)
+        tools.append(read_repo_file)
+        return create_agent(model=llm, tools=tools, system_prompt=self.prompt)
+
+    async def _run_agent(self, diff_text: str, context: str, run: _Run) -> Dict[str, Any]:
+        # The docs tools are rooted at the mapping's docs folder, so agents are cached per folder.
+        docs_path = str(Path(run.mapping.docs_path))
+        agent = LLMFactory.get_agent(run.provider, run.model, (docs_path, PROMPT_VERSION),
+                                     lambda llm: self._build_agent(llm, docs_path))
+        request = HumanMessage(content=self.request.format(diff=diff_text, context=context))
+        # Stream the run: message chunks feed the progress counters, the last state holds the answer.
+        result = None
+        async with self._llm_slot(run):
+            async for mode, payload in agent.astream({"messages": [request]},
+                                                     config={"callbacks": [tool_callback, *self._callbacks(run)]},
+                                                     stream_mode=["messages", "values"]):
+                if mode == "values":
+                    result = payload
+                    continue
+                message, _ = payload
+                if isinstance(message, ToolMessage):
+                    run.progress.tool_calls += 1
+                elif isinstance(message, AIMessageChunk) and message.content:
+                    # Streaming providers emit roughly one token per chunk
+                    run.progress.on_token()
+                run.progress.report()
+        # The last message is the final answer; earlier ones are tool calls and results.
+        content = result['messages'][-1].content
+        if config.LOG_TOOL_CONTENT:
+            logger.debug("Agent answer for %s:\n%s", run.mapping.name, content)
+        return parse_json_string(content)
+
+    def _callbacks(self, run: _Run) -> list:
+        callbacks = [TimingCallback(run.progress)]
+        if self.limiter is not None:
+            callbacks.append(RateLimitCallback(self.limiter, run.provider, run.model))
+        return callbacks
+
+    def _llm_slot(self, run: _Run):
+        if self.limiter is None:
+            return nullcontext()
+        return self.limiter.slot(run.provider, run.model)
+
+
+def _module_key(path: str, depth: int) -> str:
+    parts = path.split("/")[:-1]
+    return "/".join(parts[:depth])
+
+
+def partition_diffs(diffs: list, max_bytes: int, depth: Optional[int] = None,
+                    targets: Optional[Dict[str, List[str]]] = None) -> List[list]:
+    """
+    Splits file diffs into chunks of at most max_bytes, keeping files that feed the
+    same known doc (see DocIndex), or else the same module (first `depth`
+    directories), together where they fit. The result only depends on the input,
+    so reruns produce the same chunks.
+    """
+    depth = depth if depth is not None else config.CHUNK_GROUP_DEPTH
+    targets = targets or {}
+    groups: Dict[str, list] = {}
+    for diff in diffs:
+        path = getattr(diff, "path", "")
+        docs = targets.get(path)
+        key = f"doc:{docs[0]}" if docs else f"module:{_module_key(path, depth)}"
+        groups.setdefault(key, []).append(diff)
+
+    chunks, current, current_size = [], [], 0
+    for key in sorted(groups):
+        group = groups[key]
+        group_size = sum(len(str(d).encode("utf-8")) for d in group)
+        if current and current_size + group_size > max_bytes:
+            chunks.append(current)
+            current, current_size = [], 0
+        if group_size <= max_bytes:
+            current.extend(group)
+            current_size += group_size
+            continue
+        # Module larger than a chunk on its own: split it file by file
+        for diff in group:
+            size = len(str(diff).encode("utf-8"))
+            if current and current_size + size > max_bytes:
+                chunks.append(current)
+                current, current_size = [], 0
+            current.append(diff)
+            current_size += size
+    if current:
+        chunks.append(current)
+    return chunks
@@ -0,0 +1,181 @@
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlmodel import Session, select
+
+from src import config
+from src.db_models import PipelineJob, RepoMapping
+
+PENDING = "PENDING"
+RUNNING = "RUNNING"
+FAILED = "FAILED"
+
+
+class JobQueue:
+    """
+    Per-mapping queue of commit ranges waiting to be documented.
+
+    A mapping has at most one PENDING job in "merge" mode: commits detected while
+    it waits (or while an earlier job runs) extend its head, so a burst of pushes
+    becomes a single diff. Failed jobs are retried with exponential backoff and the
+    mapping only advances past a range once it has been processed, so a range that
+    exhausts its retries is folded into the next job instead of being dropped.
+    """
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    def enqueue(self, mapping: RepoMapping, head_commit: str, retry: bool = False) -> Optional[PipelineJob]:
+        """
+        Records that the mapping's HEAD moved to head_commit.
+        Returns the job covering it, or None if it is already known.
+        A commit whose job ended FAILED is only queued again with retry=True
+        (manual triggers), so polling does not retry it forever.
+        """
+        latest = self.session.exec(
+            select(PipelineJob).where(PipelineJob.mapping_id == mapping.id).order_by(PipelineJob.id.desc())
+        ).first()
+        if latest is not None and latest.head_commit == head_commit and not (retry and latest.status == FAILED):
+            return None
+
+        now = datetime.utcnow()
+        window = timedelta(seconds=config.JOB_COALESCE_WINDOW_SECONDS)
+        pending = self._pending(mapping.id)
+        if pending is not None and config.JOB_COALESCE_MODE == "merge":
+            pending.head_commit = head_commit
+            pending.updated_at = now
+            if pending.attempts == 0:
+                deadline = pending.created_at + timedelta(seconds=config.JOB_COALESCE_MAX_WAIT_SECONDS)
+                pending.next_attempt_at = min(now + window, deadline)
+            self.session.add(pending)
+            self.session.commit()
+            return pending
+
+        # Start where the last queued or running range ends, else where processing stopped.
+        base = mapping.last_processed_commit
+        if latest is not None and latest.status in (PENDING, RUNNING):
+            base = latest.head_commit
+        job = PipelineJob(
+            mapping_id=mapping.id,
+            base_commit=base,
+            head_commit=head_commit,
+            next_attempt_at=now + window,
+        )
+        self.session.add(job)
+        self.session.commit()
+        return job
+
+    def _pending(self, mapping_id: int) -> Optional[PipelineJob]:
+        return self.session.exec(
+            select(PipelineJob)
+            .where(PipelineJob.mapping_id == mapping_id, PipelineJob.status == PENDING)
+            .order_by(PipelineJob.id.desc())
+        ).first()
+
+    def next_due(self, mapping_id: int) -> Optional[PipelineJob]:
+        """
+        Oldest pending job of the mapping whose coalescing window or backoff has passed.
+        Jobs run in order, so nothing is due while an earlier one is running.
+        """
+        running = self.session.exec(
+            select(PipelineJob.id).where(PipelineJob.mapping_id == mapping_id, PipelineJob.status == RUNNING)
+        ).first()
+        if running is not None:
+            return None
+        job = self.session.exec(
+            select(PipelineJob)
+            .where(PipelineJob.mapping_id == mapping_id, PipelineJob.status == PENDING)
+            .order_by(PipelineJob.id)
+        ).first()
+        if job is None or job.next_attempt_at > datetime.utcnow():
+            return None
+        return job
+
+    def due_mapping_ids(self) -> List[int]:
+        """
+        Mappings with a due pending job; jobs left behind by a deleted mapping are skipped.
+        """
+        return self.session.exec(
+            select(PipelineJob.mapping_id)
+            .join(RepoMapping, RepoMapping.id == PipelineJob.mapping_id)
+            .where(PipelineJob.status == PENDING, PipelineJob.next_attempt_at <= datetime.utcnow())
+            .distinct()
+        ).all()
+
+    def start(self, job: PipelineJob):
+        job.status = RUNNING
+        job.attempts += 1
+        job.updated_at = datetime.utcnow()
+        self.session.add(job)
+        self.session.commit()
+
+    def finish(self, job: PipelineJob, status: str):
+        """
+        Marks the job done. The caller advances the mapping and commits.
+        """
+        job.status = status
+        job.last_error = None
+        job.updated_at = datetime.utcnow()
+        self.session.add(job)
+
+    def fail(self, job: PipelineJob, error: str) -> Optional[float]:
+        """
+        Schedules a retry with exponential backoff, or marks the job FAILED once
+        JOB_MAX_ATTEMPTS is reached and folds its range into the next queued job.
+        Returns the retry delay in seconds, or None.
+        The caller commits.
+        """
+        now = datetime.utcnow()
+        job.last_error = error
+        job.updated_at = now
+        self.session.add(job)
+        if job.attempts >= config.JOB_MAX_ATTEMPTS:
+            job.status = FAILED
+            self._fold_into_next(job)
+            return None
+        delay = min(config.JOB_RETRY_BACKOFF_SECONDS * 2 ** (job.attempts - 1), config.JOB_RETRY_BACKOFF_MAX_SECONDS)
+        job.status = PENDING
+        job.next_attempt_at = now + timedelta(seconds=delay)
+        return delay
+
+    def _fold_into_next(self, failed: PipelineJob):
+        # A job queued behind the failed one starts at its head; move its base back to where
+        # processing stopped so the failed range is covered by it instead of being skipped.
+        following = self.session.exec(
+            select(PipelineJob)
+            .where(PipelineJob.mapping_id == failed.mapping_id, PipelineJob.status == PENDING,
+                   PipelineJob.id > failed.id)
+            .order_by(PipelineJob.id)
+        ).first()
+        mapping = self.session.get(RepoMapping, failed.mapping_id)
+        if following is None or mapping is None or following.base_commit != failed.head_commit:
+            return
+        following.base_commit = mapping.last_processed_commit
+        following.updated_at = datetime.utcnow()
+        self.session.add(following)
+
+    def release(self, job: PipelineJob):
+        """
+        Puts an interrupted job back without counting the attempt. The caller commits.
+        """
+        job.status = PENDING
+        job.attempts = max(job.attempts - 1, 0)
+        job.updated_at = datetime.utcnow()
+        self.session.add(job)
+
+    def requeue_running(self, mapping_id: Optional[int] = None) -> int:
+        """
+        Returns jobs left RUNNING by a dead process to the queue (only the given
+        mapping's if set). Call it while holding the mapping's lease, so no live
+        worker can be running them.
+        """
+        query = select(PipelineJob).where(PipelineJob.status == RUNNING)
+        if mapping_id is not None:
+            query = query.where(PipelineJob.mapping_id == mapping_id)
+        jobs = self.session.exec(query).all()
+        for job in jobs:
+            job.status = PENDING
+            job.updated_at = datetime.utcnow()
+            self.session.add(job)
+        self.session.commit()
+        return len(jobs)
@@ -0,0 +1,153 @@
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional, Set
+
+from sqlalchemy import delete, or_, update
+from sqlmodel import Session, select
+
+from src import config
+from src.core.logger import get_logger
+from src.database import engine, insert_ignore
+from src.db_models import MappingLease
+
+logger = get_logger(__name__)
+
+
+def default_owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+class LeaseManager:
+    """
+    DB-backed ownership of mappings, so several worker processes or nodes can share
+    one database without processing the same mapping at once.
+
+    A lease expires ttl_seconds after its last heartbeat; a worker that dies leaves
+    its mappings to be taken over once their leases expire. The heartbeat thread
+    renews every held lease and reports any that were lost (taken over after the
+    holder stalled for longer than the TTL) through on_lost.
+    """
+
+    def __init__(self, owner: Optional[str] = None, ttl_seconds: Optional[float] = None,
+                 heartbeat_seconds: Optional[float] = None, on_lost: Optional[Callable[[int], None]] = None):
+        self.owner = owner or default_owner()
+        self.ttl = timedelta(seconds=ttl_seconds if ttl_seconds is not None else config.LEASE_TTL_SECONDS)
+        self.heartbeat_seconds = heartbeat_seconds if heartbeat_seconds is not None else config.LEASE_HEARTBEAT_SECONDS
+        self.on_lost = on_lost
+        self._lock = threading.Lock()
+        self._held: Set[int] = set()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def acquire(self, mapping_id: int) -> bool:
+        """
+        Takes the mapping's lease if it is free, expired or already ours.
+        """
+        now = datetime.utcnow()
+        with Session(engine) as session:
+            insert_ignore(session, MappingLease, [{
+                "mapping_id": mapping_id, "owner": self.owner,
+                "acquired_at": now, "heartbeat_at": now, "expires_at": now + self.ttl,
+            }])
+            # Conditional update: only one contender can match an expired lease.
+            result = session.execute(
+                update(MappingLease)
+                .where(MappingLease.mapping_id == mapping_id)
+                .where(or_(MappingLease.owner == self.owner, MappingLease.expires_at < now))
+                .values(owner=self.owner, heartbeat_at=now, expires_at=now + self.ttl)
+            )
+            session.commit()
+        if result.rowcount != 1:
+            return False
+        with self._lock:
+            self._held.add(mapping_id)
+        return True
+
+    def release(self, mapping_id: int):
+        with self._lock:
+            self._held.discard(mapping_id)
+        with Session(engine) as session:
+            session.execute(
+                delete(MappingLease).where(MappingLease.mapping_id == mapping_id, MappingLease.owner == self.owner)
+            )
+            session.commit()
+
+    def release_all(self):
+        with self._lock:
+            held = list(self._held)
+        for mapping_id in held:
+            self.release(mapping_id)
+
+    def held(self) -> List[int]:
+        with self._lock:
+            return sorted(self._held)
+
+    def heartbeat(self) -> List[int]:
+        """
+        Renews every held lease. Returns the mappings whose lease was lost.
+        """
+        with self._lock:
+            held = set(self._held)
+        if not held:
+            return []
+        now = datetime.utcnow()
+        with Session(engine) as session:
+            session.execute(
+                update(MappingLease)
+                .where(MappingLease.owner == self.owner, MappingLease.mapping_id.in_(held))
+                .values(heartbeat_at=now, expires_at=now + self.ttl)
+            )
+            session.commit()
+            still_held = set(session.exec(
+                select(MappingLease.mapping_id)
+                .where(MappingLease.owner == self.owner, MappingLease.mapping_id.in_(held))
+            ).all())
+        lost = sorted(held - still_held)
+        with self._lock:
+            # Leases released while the heartbeat ran are not "lost".
+            lost = [mapping_id for mapping_id in lost if mapping_id in self._held]
+            self._held.difference_update(lost)
+        return lost
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="autodoc-lease-heartbeat", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.release_all()
+
+    def _loop(self):
+        while not self._stop.wait(self.heartbeat_seconds):
+            try:
+                lost = self.heartbeat()
+            except Exception as e:
+                logger.warning("Lease heartbeat failed: %s", e)
+                continue
+            for mapping_id in lost:
+                logger.warning("Lost lease on mapping %s to another worker", mapping_id)
+                if self.on_lost is not None:
+                    self.on_lost(mapping_id)
+
+
+def lease_owner(session: Session, mapping_id: int) -> Optional[str]:
+    lease = session.get(MappingLease, mapping_id)
+    if lease is None or lease.expires_at < datetime.utcnow():
+        return None
+    return lease.owner
+
+
+def active_leases(session: Session) -> List[dict]:
+    rows = session.exec(
+        select(MappingLease).where(MappingLease.expires_at >= datetime.utcnow()).order_by(MappingLease.mapping_id)
+    ).all()
+    return [row.model_dump() for row in rows]
@@ -0,0 +1,125 @@
+"""
+Bulk registration of mappings, from a manifest or by discovering git
+repositories under a folder, and the normalization every registration path
+(CLI, API, import) applies to a new mapping.
+
+Rows are inserted in batches and deduplicated by the unique
+(source_path, docs_path) index, so re-running an import only adds what is new.
+"""
+
+import json
+import os
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlmodel import Session
+
+from src import config
+from src.database import insert_ignore
+from src.db_models import RepoMapping
+
+# Manifest fields besides source_path and docs_path
+MANIFEST_FIELDS = {"name", "is_active", "ai_provider", "ai_model", "priority", "weight",
+                   "min_interval_seconds", "path_filter"}
+
+
+def load_manifest(path: str) -> List[Dict[str, Any]]:
+    """
+    Reads a JSON list of mapping objects (or {"mappings": [...]}), or JSON lines.
+    """
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        data = [json.loads(line) for line in text.splitlines() if line.strip()]
+    if isinstance(data, dict):
+        data = data.get("mappings", [])
+    if not isinstance(data, list) or not all(isinstance(entry, dict) for entry in data):
+        raise ValueError(f"{path}: expected a list of mapping objects")
+    return data
+
+
+def discover_repos(root: str, max_depth: Optional[int] = None) -> List[str]:
+    """
+    Git work trees (a .git folder or worktree file) under root, without descending
+    into them or into ignored folders.
+    """
+    max_depth = config.DISCOVER_MAX_DEPTH if max_depth is None else max_depth
+    root = os.path.abspath(root)
+    ignore_dirs = getattr(config, 'IGNORE_DIRS', set())
+    repos = []
+    for current, dirs, files in os.walk(root):
+        if ".git" in dirs or ".git" in files:
+            repos.append(current)
+            dirs.clear()
+            continue
+        depth = 0 if current == root else os.path.relpath(current, root).count(os.sep) + 1
+        if depth >= max_depth:
+            dirs.clear()
+            continue
+        dirs[:] = sorted(d for d in dirs if d not in ignore_dirs and not d.startswith("."))
+    return sorted(repos)
+
+
+def discovered_entries(root: str, docs_root: str, max_depth: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    One manifest entry per discovered repository; docs go to the same relative path under docs_root.
+    """
+    root = os.path.abspath(root)
+    entries = []
+    for repo in discover_repos(root, max_depth):
+        rel = os.path.relpath(repo, root)
+        name = os.path.basename(repo) if rel == "." else rel.replace(os.sep, "/")
+        entries.append({"source_path": repo, "docs_path": os.path.join(docs_root, "" if rel == "." else rel),
+                        "name": name})
+    return entries
+
+
+def normalize_mapping(mapping: RepoMapping) -> RepoMapping:
+    """
+    Makes the source and docs paths absolute and checks the scheduling fields:
+    weight must be positive, a negative min interval is raised to 0.
+    Shared by every way of registering a mapping. Raises ValueError.
+    """
+    mapping.source_path = os.path.abspath(os.path.expanduser(mapping.source_path))
+    mapping.docs_path = os.path.abspath(os.path.expanduser(mapping.docs_path))
+    if mapping.weight is not None and mapping.weight <= 0:
+        raise ValueError("weight must be positive")
+    if mapping.min_interval_seconds is not None:
+        mapping.min_interval_seconds = max(0, mapping.min_interval_seconds)
+    return mapping
+
+
+def build_rows(entries: Iterable[Dict[str, Any]], defaults: Optional[Dict[str, Any]] = None) -> List[dict]:
+    """
+    Validates manifest entries into complete RepoMapping rows with absolute paths.
+    Raises ValueError naming the first bad entry.
+    """
+    rows = []
+    for number, entry in enumerate(entries, 1):
+        unknown = set(entry) - MANIFEST_FIELDS - {"source_path", "docs_path"}
+        if unknown:
+            raise ValueError(f"entry {number}: unknown fields {', '.join(sorted(unknown))}")
+        if not entry.get("source_path") or not entry.get("docs_path"):
+            raise ValueError(f"entry {number}: source_path and docs_path are required")
+        values = {**(defaults or {}), **entry}
+        try:
+            mapping = normalize_mapping(RepoMapping.model_validate(values))
+        except ValueError as e:
+            raise ValueError(f"entry {number}: {e}") from None
+        mapping.name = mapping.name or os.path.basename(mapping.source_path)
+        rows.append(mapping.model_dump(exclude={"id"}))
+    return rows
+
+
+def import_mappings(session: Session, rows: List[dict], batch_size: Optional[int] = None) -> Tuple[int, int]:
+    """
+    Inserts the rows in batches, skipping (source_path, docs_path) pairs that are
+    already registered. Returns (inserted, skipped). Commits.
+    """
+    batch_size = batch_size or config.IMPORT_BATCH_SIZE
+    inserted = 0
+    for start in range(0, len(rows), batch_size):
+        inserted += insert_ignore(session, RepoMapping, rows[start:start + batch_size])
+    session.commit()
+    return inserted, len(rows) - inserted
@@ -0,0 +1,368 @@
+"""
+Outline index: the files of each mapping's repository with their classes,
+functions and signatures, so the agent can find code in one lookup instead of
+listing directories level by level and reading whole files.
+
+Outlines are stored per file and keyed by blob SHA. Moving the index to a new
+commit only parses the files `git diff-tree` reports as changed since the
+indexed commit (or, without a usable one, the files whose blob differs).
+"""
+
+import ast
+import fnmatch
+import json
+import re
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import git
+from sqlalchemy import delete
+from sqlmodel import Session, select
+
+from src import config
+from src.core.logger import get_logger
+from src.database import db_writer
+from src.db_models import OutlineFile, OutlineState, RepoMapping
+from src.modules.snapshot import blob_cache
+
+logger = get_logger(__name__)
+
+_NULL_SHA = "0" * 40
+_DOC_MAX_CHARS = 120
+
+# Definitions in languages without a parser here, and markdown headings
+_DEFINITION_RE = re.compile(
+    r"^(\s*)(?:export\s+)?(?:default\s+)?(?:async\s+)?(?:pub(?:\([^)]*\))?\s+)?(?:static\s+)?"
+    r"(def|class|function|func|fn|interface|struct|enum|trait|type|impl)\s+(?:\([^)]*\)\s*)?([A-Za-z_$][\w$]*)"
+)
+_HEADING_RE = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$")
+
+
+def _first_line(text: Optional[str]) -> str:
+    lines = (text or "").strip().splitlines()
+    return lines[0].strip()[:_DOC_MAX_CHARS] if lines else ""
+
+
+def _python_signature(node) -> str:
+    if isinstance(node, ast.ClassDef):
+        bases = [ast.unparse(b) for b in node.bases] + [ast.unparse(k) for k in node.keywords]
+        return f"class {node.name}({', '.join(bases)})" if bases else f"class {node.name}"
+    prefix = "async def" if isinstance(node, ast.AsyncFunctionDef) else "def"
+    returns = f" -> {ast.unparse(node.returns)}" if node.returns is not None else ""
+    return f"{prefix} {node.name}({ast.unparse(node.args)}){returns}"
+
+
+def _python_outline(source: str) -> dict:
+    tree = ast.parse(source)
+    symbols = []
+
+    def visit(body, prefix: str):
+        for node in body:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                if isinstance(node, ast.ClassDef):
+                    kind = "class"
+                else:
+                    kind = "method" if prefix else "function"
+                symbol = {
+                    "kind": kind,
+                    "name": node.name,
+                    "qualname": prefix + node.name,
+                    "line": node.lineno,
+                    "end": node.end_lineno,
+                    "signature": _python_signature(node),
+                }
+                doc = _first_line(ast.get_docstring(node))
+                if doc:
+                    symbol["doc"] = doc
+                symbols.append(symbol)
+                if isinstance(node, ast.ClassDef):
+                    visit(node.body, f"{prefix}{node.name}.")
+
+    visit(tree.body, "")
+    return {"doc": _first_line(ast.get_docstring(tree)), "symbols": symbols}
+
+
+def _text_outline(path: str, source: str) -> dict:
+    symbols = []
+    markdown = path.lower().endswith((".md", ".markdown"))
+    parents: List[tuple] = []  # (indent, qualname) of enclosing definitions
+    for number, line in enumerate(source.splitlines(), 1):
+        if markdown:
+            match = _HEADING_RE.match(line)
+            if match:
+                symbols.append({"kind": "heading", "name": match.group(2), "qualname": match.group(2),
+                                "line": number, "signature": line.strip()})
+            continue
+        match = _DEFINITION_RE.match(line)
+        if not match:
+            continue
+        indent, keyword, name = len(match.group(1).expandtabs()), match.group(2), match.group(3)
+        while parents and parents[-1][0] >= indent:
+            parents.pop()
+        qualname = f"{parents[-1][1]}.{name}" if parents else name
+        symbols.append({"kind": keyword, "name": name, "qualname": qualname, "line": number,
+                        "signature": line.strip().rstrip("{:").strip()[:200]})
+        parents.append((indent, qualname))
+    return {"doc": "", "symbols": symbols}
+
+
+def outline_source(path: str, source: str) -> dict:
+    """
+    Outline of one file: its line count, module docstring and symbols.
+    Python is parsed with ast; other files fall back to a definition regex.
+    """
+    outline = None
+    if path.endswith((".py", ".pyi")):
+        try:
+            outline = _python_outline(source)
+        except (SyntaxError, ValueError):
+            outline = None
+    if outline is None:
+        outline = _text_outline(path, source)
+    outline["lines"] = source.count("\n") + (0 if source.endswith("\n") or not source else 1)
+    return outline
+
+
+def _indexed(path: str) -> bool:
+    parts = path.split("/")
+    if any(part in config.IGNORE_DIRS for part in parts[:-1]):
+        return False
+    # The patterns start with "**/", which also has to match top-level paths
+    return not any(fnmatch.fnmatch("/" + path, pattern) for pattern in config.VENDORED_PATHS)
+
+
+class RepoOutline:
+    """
+    The outline of one repository at one commit.
+    """
+
+    def __init__(self, commit_hash: Optional[str], files: Dict[str, dict], parsed: int = 0):
+        self.commit_hash = commit_hash
+        self.files = files
+        # Files parsed to bring the index to this commit
+        self.parsed = parsed
+
+    def search(self, query: str, max_results: Optional[int] = None, max_bytes: Optional[int] = None) -> str:
+        """
+        A file path returns that file's outline, a directory the outlines of the
+        files under it, anything else the symbols (and file paths) matching it.
+        An empty query lists the top-level directories.
+        """
+        max_results = max_results or config.OUTLINE_LOOKUP_MAX_RESULTS
+        max_bytes = max_bytes or config.OUTLINE_LOOKUP_MAX_BYTES
+        query = query.strip().replace("\\", "/")
+        while query.startswith("./"):
+            query = query[2:]
+        path = query.strip("/")
+
+        if not path or path == ".":
+            return self._overview()
+        if path in self.files:
+            return "\n".join(self._render_file(path, self.files[path]))
+        under = sorted(p for p in self.files if p.startswith(path + "/"))
+        if under:
+            return self._render_many(under, max_results, max_bytes)
+        return self._find_symbols(path, max_results, max_bytes)
+
+    def _overview(self) -> str:
+        counts: Dict[str, int] = {}
+        for path in self.files:
+            top = path.split("/", 1)[0] + ("/" if "/" in path else "")
+            counts[top] = counts.get(top, 0) + 1
+        lines = [f"{len(self.files)} files at {self.commit_hash[:7] if self.commit_hash else 'unknown commit'}:"]
+        lines += [f"{name} ({count} files)" if name.endswith("/") else name for name, count in sorted(counts.items())]
+        return "\n".join(lines)
+
+    @staticmethod
+    def _render_symbol(symbol: dict, indent: str = "  ") -> str:
+        depth = symbol["qualname"].count(".") if symbol["kind"] in ("method", "class", "function") else 0
+        doc = f"  # {symbol['doc']}" if symbol.get("doc") else ""
+        return f"{indent}{'  ' * depth}L{symbol['line']} {symbol['signature']}{doc}"
+
+    def _render_file(self, path: str, outline: dict) -> List[str]:
+        details = [f"{outline['lines']} lines"] if outline.get("lines") is not None else []
+        if outline.get("skipped"):
+            details.append(outline["skipped"])
+        header = f"{path} ({', '.join(details)})" if details else path
+        if outline.get("doc"):
+            header += f"  # {outline['doc']}"
+        return [header] + [self._render_symbol(symbol) for symbol in outline.get("symbols", [])]
+
+    def _render_many(self, paths: List[str], max_results: int, max_bytes: int) -> str:
+        lines: List[str] = []
+        size = 0
+        for shown, path in enumerate(paths):
+            block = self._render_file(path, self.files[path])
+            block_size = sum(len(line) + 1 for line in block)
+            if lines and (len(lines) + len(block) > max_results * 2 or size + block_size > max_bytes):
+                # Too much detail: list the remaining files only
+                rest = paths[shown:]
+                names = rest[:max_results]
+                lines.append(f"... {len(rest)} more files (query one of them for its outline):")
+                lines += [f"{name} ({len(self.files[name].get('symbols', []))} symbols)" for name in names]
+                if len(rest) > len(names):
+                    lines.append(f"... and {len(rest) - len(names)} more, narrow the directory")
+                break
+            lines += block
+            size += block_size
+        return "\n".join(lines)
+
+    def _find_symbols(self, query: str, max_results: int, max_bytes: int) -> str:
+        term = query.lower()
+        matches = []
+        for path, outline in self.files.items():
+            if term in path.lower():
+                matches.append((3, path, 0, f"{path} ({len(outline.get('symbols', []))} symbols)"))
+            for symbol in outline.get("symbols", []):
+                name, qualname = symbol["name"].lower(), symbol["qualname"].lower()
+                if term in (name, qualname):
+                    rank = 0
+                elif name.startswith(term) or qualname.endswith("." + term):
+                    rank = 1
+                elif term in qualname:
+                    rank = 2
+                else:
+                    continue
+                matches.append((rank, path, symbol["line"], f"{path}:{self._render_symbol(symbol, indent='')}"))
+        if not matches:
+            return f"No files or symbols match '{query}'. Try part of a name, or a directory such as 'src/'."
+        matches.sort()
+        lines: List[str] = []
+        size = 0
+        for _, _, _, line in matches[:max_results]:
+            if size + len(line) > max_bytes:
+                break
+            lines.append(line)
+            size += len(line) + 1
+        if len(lines) < len(matches):
+            lines.append(f"... {len(matches) - len(lines)} more matches, use a more specific query")
+        return "\n".join(lines)
+
+
+class OutlineIndex:
+    """
+    Keeps each mapping's outline in the database (OutlineFile rows plus the
+    indexed commit in OutlineState) and the most recently used ones in memory.
+    """
+
+    def __init__(self, max_repos: Optional[int] = None):
+        self.max_repos = max_repos or config.OUTLINE_CACHE_REPOS
+        self._cache: "OrderedDict[int, RepoOutline]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def update(self, session: Session, mapping: RepoMapping, commit_hash: str) -> RepoOutline:
+        """
+        Brings the mapping's outline to commit_hash and returns it.
+        """
+        state = session.get(OutlineState, mapping.id)
+        indexed = state.commit_hash if state is not None else None
+        outline = self._cached(mapping.id, indexed)
+        if outline is None:
+            outline = self._load(session, mapping.id, indexed)
+        if outline.commit_hash == commit_hash:
+            return outline
+
+        repo = git.Repo(mapping.source_path)
+        try:
+            changes = self._changes(repo, outline, commit_hash)
+            files = dict(outline.files)
+            parsed = {}
+            for path, blob_sha in changes.items():
+                if blob_sha is None:
+                    files.pop(path, None)
+                else:
+                    parsed[path] = files[path] = self._parse(repo, path, blob_sha)
+        finally:
+            repo.close()
+
+        def apply(write_session: Session):
+            paths = sorted(changes)
+            for start in range(0, len(paths), 500):
+                write_session.execute(
+                    delete(OutlineFile)
+                    .where(OutlineFile.mapping_id == mapping.id, OutlineFile.path.in_(paths[start:start + 500]))
+                )
+            for path, file_outline in parsed.items():
+                stored = {k: v for k, v in file_outline.items() if k != "sha"}
+                write_session.add(OutlineFile(mapping_id=mapping.id, path=path, blob_sha=file_outline["sha"],
+                                              outline=json.dumps(stored)))
+            row = write_session.get(OutlineState, mapping.id) or OutlineState(mapping_id=mapping.id, commit_hash="")
+            row.commit_hash = commit_hash
+            row.updated_at = datetime.utcnow()
+            write_session.add(row)
+
+        db_writer.run(apply)
+        result = RepoOutline(commit_hash, files, parsed=len(parsed))
+        with self._lock:
+            self._cache[mapping.id] = result
+            self._cache.move_to_end(mapping.id)
+            while len(self._cache) > self.max_repos:
+                self._cache.popitem(last=False)
+        return result
+
+    def _cached(self, mapping_id: int, commit_hash: Optional[str]) -> Optional[RepoOutline]:
+        with self._lock:
+            outline = self._cache.get(mapping_id)
+            # Another worker may have moved the stored index since
+            if outline is None or outline.commit_hash != commit_hash:
+                return None
+            self._cache.move_to_end(mapping_id)
+            return outline
+
+    @staticmethod
+    def _load(session: Session, mapping_id: int, commit_hash: Optional[str]) -> RepoOutline:
+        if commit_hash is None:
+            return RepoOutline(None, {})
+        rows = session.exec(
+            select(OutlineFile.path, OutlineFile.blob_sha, OutlineFile.outline).where(OutlineFile.mapping_id == mapping_id)
+        ).all()
+        return RepoOutline(commit_hash, {path: {"sha": sha, **json.loads(data)} for path, sha, data in rows})
+
+    @staticmethod
+    def _changes(repo: git.Repo, outline: RepoOutline, commit_hash: str) -> Dict[str, Optional[str]]:
+        """
+        {path: new blob SHA, or None if the file is gone} between the indexed commit and commit_hash.
+        """
+        if outline.commit_hash:
+            try:
+                output = repo.git.diff_tree("-r", "-z", "--no-renames", outline.commit_hash, commit_hash)
+            except git.exc.GitCommandError as e:
+                # The indexed commit was rewritten away: compare blobs instead
+                logger.info("Outline base %s unavailable, re-checking all files: %s", outline.commit_hash[:7], e)
+            else:
+                changes = {}
+                fields = output.split("\0")
+                for meta, path in zip(fields[0::2], fields[1::2]):
+                    if not meta.startswith(":") or not _indexed(path):
+                        continue
+                    _, new_mode, _, new_sha, _ = meta[1:].split(" ", 4)
+                    # Deleted files and submodules have no blob to outline
+                    changes[path] = None if new_sha == _NULL_SHA or new_mode == "160000" else new_sha
+                return changes
+
+        current = {}
+        for entry in repo.git.ls_tree("-r", "-z", commit_hash).split("\0"):
+            if not entry:
+                continue
+            meta, path = entry.split("\t", 1)
+            _, kind, blob_sha = meta.split(" ")
+            if kind == "blob" and _indexed(path):
+                current[path] = blob_sha
+        changes = {path: sha for path, sha in current.items() if outline.files.get(path, {}).get("sha") != sha}
+        changes.update({path: None for path in outline.files if path not in current})
+        return changes
+
+    @staticmethod
+    def _parse(repo: git.Repo, path: str, blob_sha: str) -> dict:
+        content = blob_cache.get(blob_sha)
+        if content is None:
+            stream = repo.odb.stream(bytes.fromhex(blob_sha))
+            if stream.size > config.OUTLINE_MAX_FILE_BYTES:
+                return {"sha": blob_sha, "lines": None, "doc": "", "symbols": [], "skipped": "too large"}
+            data = stream.read()
+            if b"\0" in data[:8000]:
+                return {"sha": blob_sha, "lines": None, "doc": "", "symbols": [], "skipped": "binary"}
+            content = data.decode("utf-8", errors="replace")
+        return {"sha": blob_sha, **outline_source(path, content)}
@@ -0,0 +1,139 @@
+import hashlib
+import json
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+from sqlmodel import Session, select
+
+from src import config
+from src.database import insert_ignore
+from src.db_models import PatchBlob, ProcessingLog, ProcessingLogPatch
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class PatchStore:
+    """
+    Content-addressed store for generated doc contents.
+
+    Each distinct content is stored once, zlib-compressed, under its sha256; a
+    processing log references its files through ProcessingLogPatch rows, so a doc
+    that did not change between commits costs one link row instead of a copy.
+    """
+
+    def __init__(self, level: Optional[int] = None):
+        self.level = level if level is not None else config.PATCH_COMPRESSION_LEVEL
+
+    def save(self, session: Session, log_id: int, patches: Dict[str, str]):
+        """
+        Stores the patches of a processing log. The caller commits.
+        """
+        if not patches:
+            return
+        hashes = {path: content_hash(content) for path, content in patches.items()}
+        existing = set(session.exec(select(PatchBlob.hash).where(PatchBlob.hash.in_(set(hashes.values())))).all())
+
+        blobs = {}
+        for path, content in patches.items():
+            digest = hashes[path]
+            if digest in existing or digest in blobs:
+                continue
+            data = content.encode("utf-8")
+            compressed = zlib.compress(data, self.level)
+            blobs[digest] = {"hash": digest, "size": len(data), "stored_size": len(compressed), "data": compressed}
+        if blobs:
+            insert_ignore(session, PatchBlob, list(blobs.values()))
+
+        for path in sorted(patches):
+            session.add(ProcessingLogPatch(log_id=log_id, path=path, blob_hash=hashes[path]))
+
+    def load(self, session: Session, log: ProcessingLog) -> Dict[str, str]:
+        """
+        Returns {doc path: content} for the log, including legacy JSON rows.
+        """
+        rows = session.exec(
+            select(ProcessingLogPatch.path, PatchBlob.data)
+            .join(PatchBlob, PatchBlob.hash == ProcessingLogPatch.blob_hash)
+            .where(ProcessingLogPatch.log_id == log.id)
+            .order_by(ProcessingLogPatch.path)
+        ).all()
+        if rows:
+            return {path: zlib.decompress(data).decode("utf-8") for path, data in rows}
+        if log.patches:
+            return json.loads(log.patches)
+        return {}
+
+    def migrate_legacy(self, session: Session, batch_size: int = 100) -> int:
+        """
+        Moves legacy JSON patches into the blob store, one committed batch at a time.
+        Returns the number of logs migrated.
+        """
+        migrated = 0
+        while True:
+            logs = session.exec(
+                select(ProcessingLog).where(ProcessingLog.patches.is_not(None)).limit(batch_size)
+            ).all()
+            if not logs:
+                return migrated
+            for log in logs:
+                try:
+                    patches = json.loads(log.patches)
+                except ValueError:
+                    patches = {}
+                self.save(session, log.id, patches)
+                log.patches = None
+                session.add(log)
+            session.commit()
+            migrated += len(logs)
+
+
+def log_summaries(session: Session, mapping_id: int, limit: Optional[int] = None,
+                  cursor: Optional[int] = None) -> Tuple[List[dict], Optional[int]]:
+    """
+    One page of a mapping's processing logs, newest first, without patch contents.
+    Pass the returned cursor back to get the next page; it is None on the last page.
+    """
+    limit = min(max(1, limit or config.LOG_PAGE_SIZE), config.LOG_PAGE_MAX_SIZE)
+    query = (
+        select(ProcessingLog.id, ProcessingLog.commit_hash, ProcessingLog.timestamp,
+               ProcessingLog.status, ProcessingLog.summary, ProcessingLog.patches.is_not(None),
+               ProcessingLog.cache_hits, ProcessingLog.cache_misses)
+        .where(ProcessingLog.mapping_id == mapping_id)
+        .order_by(ProcessingLog.id.desc())
+        .limit(limit + 1)
+    )
+    if cursor is not None:
+        query = query.where(ProcessingLog.id < cursor)
+    rows = session.exec(query).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    files: Dict[int, List[dict]] = {}
+    if rows:
+        links = session.exec(
+            select(ProcessingLogPatch.log_id, ProcessingLogPatch.path, ProcessingLogPatch.blob_hash, PatchBlob.size)
+            .join(PatchBlob, PatchBlob.hash == ProcessingLogPatch.blob_hash)
+            .where(ProcessingLogPatch.log_id.in_([row[0] for row in rows]))
+            .order_by(ProcessingLogPatch.path)
+        ).all()
+        for log_id, path, blob_hash, size in links:
+            files.setdefault(log_id, []).append({"path": path, "hash": blob_hash, "size": size})
+
+    items = [
+        {
+            "id": log_id,
+            "mapping_id": mapping_id,
+            "commit_hash": commit_hash,
+            "timestamp": timestamp,
+            "status": status,
+            "summary": summary,
+            "files": files.get(log_id, []),
+            "legacy_patches": bool(legacy),
+            "cache_hits": cache_hits,
+            "cache_misses": cache_misses,
+        }
+        for log_id, commit_hash, timestamp, status, summary, legacy, cache_hits, cache_misses in rows
+    ]
+    return items, (rows[-1][0] if has_more else None)
@@ -1,73 +1,264 @@
+from sqlalchemy import or_
 from sqlmodel import Session
 
 from src import config
-from src.db_models import RepoMapping, ProcessingLog
+from src.core.event_bus import event_bus
+from src.core.events import DocumentationGeneratedEvent, JobProgressEvent
+from src.database import db_writer
+from src.core.metrics import Trace, span, trace
+from src.core.progress import generation_registry
+from src.db_models import RepoMapping, ProcessingLog, PipelineJob, TraceSpan
 from src.modules.watcher import RepositoryWatcher
 from src.modules.processor import DiffProcessor
-from src.modules.generator import DocumentationGenerator
+from src.modules.generator import DocumentationGenerator, GenerationCancelled
+from src.modules.doc_index import DocIndex, changed_symbols
+from src.modules.jobs import JobQueue
+from src.modules.outline import OutlineIndex, RepoOutline
+from src.modules.leases import lease_owner
+from src.modules.patch_store import PatchStore
 from src.modules.writer import FileWriter
 from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
 import json
 
 
+# Shared by all orchestrators so outlines stay in memory between runs
+outline_index = OutlineIndex()
+
+
 class PipelineOrchestrator:
-    def __init__(self, session: Session):
+    def __init__(self, session: Session, llm_limiter=None, lease_owner: Optional[str] = None):
         self.session = session
+        # Set when running under a LeaseManager: state is only written while the lease is still ours.
+        self.lease_owner = lease_owner
+        # Optional ProviderLimiter: slot() caps concurrent generations, throttle() paces each model request.
+        self.llm_limiter = llm_limiter
         self.watcher = RepositoryWatcher()
         self.processor = DiffProcessor()
-        self.generator = DocumentationGenerator(provider=config.PROVIDER, model=config.MODEL)
+        # Provider and model come from each mapping; LLM clients are shared process-wide.
+        self.generator = DocumentationGenerator()
         self.writer = FileWriter()
+        self.doc_index = DocIndex()
+        self.outline_index = outline_index
+        self.jobs = JobQueue(session)
+        self.patch_store = PatchStore()
+        self.generator.limiter = llm_limiter
 
     def run(self):
         """
-        Main loop iteration. checks all active mappings.
+        Main loop iteration. checks the active mappings that are due.
         """
-        mappings = self.session.query(RepoMapping).filter(RepoMapping.is_active == True).all()
+        now = datetime.utcnow()
+        mappings = self.session.query(RepoMapping).filter(
+            RepoMapping.is_active == True,
+            or_(RepoMapping.next_due_at == None, RepoMapping.next_due_at <= now),
+        ).all()
         for mapping in mappings:
             self.process_mapping(mapping)
 
-    def process_mapping(self, mapping: RepoMapping):
+    def process_mapping(self, mapping: RepoMapping) -> Optional[str]:
+        """
+        Queues any new commits of the mapping, then runs diff/generate/write for
+        its next due job.
+        Returns the resulting log status, or None if there was nothing to do.
+        Each stage is timed as a span; the spans of a job are stored as its trace.
+        """
+        mapping_id = mapping.id
+        with trace() as job_trace:
+            job_id, attempt, status = self._process(mapping)
+        if job_id is not None:
+            self._save_trace(job_id, mapping_id, attempt, job_trace)
+        return status
+
+    def _process(self, mapping: RepoMapping) -> Tuple[Optional[int], int, Optional[str]]:
         # 1. Check for changes
-        new_commit = self.watcher.check_for_updates(mapping)
-        if not new_commit:
-            return
+        with span("check_for_updates") as stage:
+            new_commit = self.watcher.check_for_updates(mapping)
+            stage.set(changed=int(bool(new_commit)))
+        if new_commit:
+            self.jobs.enqueue(mapping, new_commit)
 
-        print(f"Detected updates for {mapping.name} ({mapping.source_path})...")
+        job = self.jobs.next_due(mapping.id)
+        if job is None:
+            return None, 0, None
+
+        print(f"Detected updates for {mapping.name} ({mapping.source_path}): "
+              f"{job.base_commit[:7] or 'empty tree'}..{job.head_commit[:7]}")
+        self.jobs.start(job)
+        job_id, attempt = job.id, job.attempts
+        self._emit(mapping, job, "detected", base_commit=job.base_commit, attempt=attempt)
+        # Generation cache counts of this run, recorded on its log row
+        cache = {}
 
         try:
             # 2. Get Diff
-            diffs = self.processor.get_diffs(mapping, new_commit)
+            self._emit(mapping, job, "diffing")
+            with span("get_diffs") as stage:
+                diffs = self.processor.get_diffs(mapping, job.head_commit, base=job.base_commit)
+                stage.set(files=sum(1 for d in diffs if d.path), diff_bytes=sum(d.size for d in diffs),
+                          truncated_files=sum(1 for d in diffs if d.truncated),
+                          omitted_files=sum(d.omitted_files for d in diffs))
             if len(diffs) == 0:
                 print("Diff is empty, skipping.")
-                self._update_state(mapping, new_commit, "SKIPPED", "Empty diff")
-                return
+                self._update_state(mapping, job, "SKIPPED", "Empty diff")
+                return job_id, attempt, "SKIPPED"
 
             # 3. Generate Docs
             # The output here is an Event
-            doc_event = self.generator.generate(diffs, mapping, new_commit)
+            # Docs previously generated from the changed files are routed to the agent directly
+            doc_targets = self.doc_index.lookup(self.session, mapping.id,
+                                                {d.path: changed_symbols(d) for d in diffs if d.path})
+            # Docs deleted from the docs folder are not handed to the agent and leave the index after the run
+            missing_docs = self.doc_index.missing_docs(
+                mapping.docs_path, {doc for docs in doc_targets.values() for doc in docs})
+            if missing_docs:
+                doc_targets = {source: [doc for doc in docs if doc not in missing_docs]
+                               for source, docs in doc_targets.items()}
+                doc_targets = {source: docs for source, docs in doc_targets.items() if docs}
+            outline = self._update_outline(mapping, job.head_commit)
+            self._emit(mapping, job, "generating", files=sum(1 for d in diffs if d.path),
+                       diff_bytes=sum(d.size for d in diffs))
+            with span("generate", labels={"provider": mapping.ai_provider, "model": mapping.ai_model}) as stage:
+                try:
+                    doc_event = self.generator.generate(diffs, mapping, job.head_commit, doc_targets, outline)
+                    stage.set(docs=len(doc_event.patches))
+                finally:
+                    progress = generation_registry.get(mapping.id)
+                    if progress is not None and progress.commit_hash == job.head_commit:
+                        stage.set(tokens=progress.tokens, tool_calls=progress.tool_calls,
+                                  llm_calls=progress.llm_calls, llm_seconds=progress.llm_seconds,
+                                  tool_seconds=progress.tool_seconds, prefetched_files=progress.prefetched_files,
+                                  prefetch_hits=progress.prefetch_hits, prefetch_misses=progress.prefetch_misses,
+                                  cache_hits=progress.cache_hits, cache_misses=progress.cache_misses)
+                        cache = {"cache_hits": progress.cache_hits, "cache_misses": progress.cache_misses}
 
             # 4. Write
-            self.writer.write(mapping, doc_event)
+            generated = len(set(doc_event.patches) | set(doc_event.operations))
+            self._emit(mapping, job, "writing", docs=generated)
+            with span("write") as stage:
+                written = self.writer.write(mapping, doc_event)
+                stage.set(files_written=len(written.written), files_unchanged=len(written.unchanged),
+                          bytes_written=written.bytes_written, bytes_skipped=written.bytes_skipped,
+                          section_edits=written.operations_applied, conflicts=len(written.conflicts))
+            # Logs, the blob store and the doc index record the docs as written, edits resolved
+            doc_event.patches = written.contents
+            doc_event.operations = {}
 
             # 5. Update State
-            self._update_state(mapping, new_commit, "SUCCESS", f"Generated {len(doc_event.patches)} files",
-                               json.dumps(doc_event.patches))
+            self._update_state(mapping, job, "SUCCESS",
+                               f"Generated {generated} files: {written.summary()}",
+                               doc_event,
+                               removed_sources={d.path for d in diffs if d.deleted},
+                               missing_docs=self.doc_index.missing_docs(mapping.docs_path, missing_docs),
+                               cache=cache)
+            return job_id, attempt, "SUCCESS"
+
+        except GenerationCancelled as e:
+            # Mapping deleted or server shutting down: the attempt does not count against the job.
+            print(f"Pipeline cancelled for {mapping.name}: {e}")
+            self.session.rollback()
+            self._update_state(mapping, job, "CANCELLED", str(e), cache=cache)
+            return job_id, attempt, "CANCELLED"
 
         except Exception as e:
             print(f"Pipeline failed for {mapping.name}: {e}")
-            self._update_state(mapping, new_commit, "FAILED", str(e))
-
-    def _update_state(self, mapping: RepoMapping, commit: str, status: str, summary: str, patches: str = None):
-        mapping.last_processed_commit = commit
-        mapping.updated_at = datetime.utcnow()
-
-        log = ProcessingLog(
-            mapping_id=mapping.id,
-            commit_hash=commit,
-            status=status,
-            summary=summary,
-            patches=patches
-        )
-        self.session.add(log)
-        self.session.add(mapping)
+            self.session.rollback()
+            self._update_state(mapping, job, "FAILED", str(e), cache=cache)
+            return job_id, attempt, "FAILED"
+
+    def _update_outline(self, mapping: RepoMapping, commit_hash: str) -> Optional[RepoOutline]:
+        """
+        Moves the mapping's outline index to the commit. The agent can still
+        browse the repository without it, so failures only cost efficiency.
+        """
+        with span("outline") as stage:
+            try:
+                outline = self.outline_index.update(self.session, mapping, commit_hash)
+            except Exception as e:
+                print(f"Outline index update failed for {mapping.name}: {e}")
+                stage.set(failed=1)
+                return None
+            stage.set(files=len(outline.files), files_parsed=outline.parsed)
+            return outline
+
+    @staticmethod
+    def _save_trace(job_id: int, mapping_id: int, attempt: int, job_trace: Trace):
+        rows = [
+            TraceSpan(job_id=job_id, mapping_id=mapping_id, attempt=attempt, name=item["name"],
+                      started_at=item["started_at"], duration_ms=item["duration_ms"],
+                      attributes=json.dumps(item["attributes"]))
+            for item in job_trace.spans
+        ]
+
+        def apply(session: Session):
+            # The mapping, and with it the job, may have been deleted meanwhile
+            if session.get(PipelineJob, job_id) is not None:
+                session.add_all(rows)
+
+        # Traces are diagnostics: written in the background, never holding up the job.
+        db_writer.submit(apply)
+
+    def _emit(self, mapping: RepoMapping, job: PipelineJob, stage: str, status: Optional[str] = None, **detail):
+        event_bus.publish(JobProgressEvent(repo_id=mapping.id, commit_hash=job.head_commit, job_id=job.id,
+                                           stage=stage, status=status, detail=detail))
+
+    def _update_state(self, mapping: RepoMapping, job: PipelineJob, status: str, summary: str,
+                      doc_event: Optional[DocumentationGeneratedEvent] = None,
+                      removed_sources: Iterable[str] = (), missing_docs: Iterable[str] = (),
+                      cache: Optional[Dict[str, int]] = None):
+        """
+        Records the job's outcome, the mapping's progress and the log row in one
+        transaction, committed by the shared batched writer.
+        Doc index entries of removed sources and missing docs are dropped with it.
+        """
+        mapping_id, job_id = mapping.id, job.id
+
+        def apply(session: Session) -> str:
+            mapping_row = session.get(RepoMapping, mapping_id)
+            job_row = session.get(PipelineJob, job_id)
+            if mapping_row is None or job_row is None:
+                # Deleted while the job ran; its rows are gone with it
+                return summary
+            if self.lease_owner is not None and lease_owner(session, mapping_id) != self.lease_owner:
+                # Another worker took the mapping over and may already be re-running this job.
+                session.add(ProcessingLog(mapping_id=mapping_id, commit_hash=job_row.head_commit,
+                                          status="LEASE_LOST", summary=f"{status}: {summary}"))
+                return summary
+            jobs = JobQueue(session)
+            text = summary
+            if status == "CANCELLED":
+                jobs.release(job_row)
+            elif status == "FAILED":
+                # The range stays queued (or is folded into the next job), so the mapping does not advance.
+                retry_in = jobs.fail(job_row, summary)
+                if retry_in is not None:
+                    text = f"{summary} (attempt {job_row.attempts}, retrying in {retry_in:.0f}s)"
+                else:
+                    text = f"{summary} (attempt {job_row.attempts}, giving up)"
+            else:
+                jobs.finish(job_row, status)
+                mapping_row.last_processed_commit = job_row.head_commit
+                mapping_row.updated_at = datetime.utcnow()
+                session.add(mapping_row)
+                if doc_event is not None:
+                    self.doc_index.update(session, mapping_id, doc_event, removed_sources, missing_docs)
+
+            log = ProcessingLog(
+                mapping_id=mapping_id,
+                commit_hash=job_row.head_commit,
+                status=status,
+                summary=text,
+                **(cache or {}),
+            )
+            session.add(log)
+            if doc_event is not None and doc_event.patches:
+                # Contents go to the blob store; the log row only references them
+                session.flush()
+                self.patch_store.save(session, log.id, doc_event.patches)
+            return text
+
+        with span("update_state", labels={"status": status}):
+            text = db_writer.run(apply)
+        self._emit(mapping, job, "done", status=status, summary=text)
+        # End this session's read transaction so it sees the writer's commit.
         self.session.commit()
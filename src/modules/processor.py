@@ -1,33 +1,364 @@
+import fnmatch
+import itertools
+import os
+import re
+import threading
 import git
+from concurrent.futures import Future
+from dataclasses import dataclass, replace
+from typing import Callable, Dict, Hashable, Iterator, List, Optional
 
+from src import config
 from src.db_models import RepoMapping
+from src.modules.refs import resolve_git_dirs
+from src.modules.snapshot import LRUCache
 _EMPTY_TREE_SHA = "4b825dc642cb6eb9a060e54bf8d69288fbee4904"
+_TRUNCATED_RE = re.compile(r"^\[\.\.\. truncated (\d+) bytes")
+# Part of the total budget kept for the summary line of the files that do not fit
+_OMITTED_RESERVE = 96
+
+
+@dataclass
+class FileDiff:
+    path: str
+    patch: str
+    added: int = 0
+    removed: int = 0
+    # Patch text was cut at the per-file budget
+    truncated: bool = False
+    # Total budget was exhausted; patch only holds a one-line summary
+    omitted: bool = False
+    # The file no longer exists at the new commit
+    deleted: bool = False
+    # Set on the single summary entry (empty path) that stands for the files left
+    # out once the total budget ran out
+    omitted_files: int = 0
+
+    @property
+    def size(self) -> int:
+        return len(self.patch.encode("utf-8"))
+
+    def __str__(self) -> str:
+        return self.patch
+
+
+def _excluded_pathspecs() -> List[str]:
+    specs = [f":(exclude,glob)**/{d}/**" for d in sorted(getattr(config, 'IGNORE_DIRS', set()))]
+    specs += [f":(exclude,glob){pattern}" for pattern in config.VENDORED_PATHS]
+    return specs
+
+
+def parse_path_filter(value: Optional[str]) -> List[str]:
+    """
+    Splits a mapping's path filter ("src/api, docs/*.md, !**/tests/**") into patterns.
+    """
+    return [part.strip() for part in (value or "").replace("\n", ",").split(",") if part.strip()]
+
+
+def _matches(path: str, pattern: str) -> bool:
+    pattern = pattern.strip("/")
+    if not any(c in pattern for c in "*?["):
+        # Plain paths select a file or everything below a directory
+        return path == pattern or path.startswith(pattern + "/")
+    return fnmatch.fnmatchcase(path, pattern)
+
+
+def path_selected(path: str, patterns: List[str]) -> bool:
+    """
+    True if the path matches one of the include patterns (or there are none) and
+    no "!" exclude pattern. Globs are fnmatch-style: * also matches "/".
+    """
+    includes = [p for p in patterns if not p.startswith("!")]
+    if includes and not any(_matches(path, p) for p in includes):
+        return False
+    return not any(_matches(path, p[1:]) for p in patterns if p.startswith("!"))
+
+
+def _omitted(path: str, added: int, removed: int) -> FileDiff:
+    summary = f"diff --git a/{path} b/{path}\n[omitted: +{added}/-{removed} lines, diff budget exhausted]\n"
+    return FileDiff(path, summary, added, removed, omitted=True)
+
+
+class _Omissions:
+    """
+    Files left out because the total budget is used up, reported as one entry
+    instead of a placeholder per file.
+    """
+
+    def __init__(self):
+        self.files = 0
+        self.added = 0
+        self.removed = 0
+
+    def add(self, diff: FileDiff):
+        self.files += diff.omitted_files or 1
+        self.added += diff.added
+        self.removed += diff.removed
+
+    def entry(self, budget: int) -> Optional[FileDiff]:
+        if not self.files:
+            return None
+        for text in (f"[{self.files} more files omitted: +{self.added}/-{self.removed} lines, diff budget exhausted]\n",
+                     f"[{self.files} more files omitted]\n"):
+            if len(text) <= budget:
+                return FileDiff("", text, self.added, self.removed, omitted=True, omitted_files=self.files)
+        return None
+
+
+def _truncated(path: str, lines: List[str], dropped: int, added: int, removed: int, budget: int) -> FileDiff:
+    """
+    Keeps the leading lines (the first one is the header) that fit in budget
+    bytes together with the truncation marker.
+    """
+    kept = list(lines)
+    used = sum(len(line.encode("utf-8")) for line in kept)
+    while True:
+        marker = f"[... truncated {dropped} bytes, +{added}/-{removed} lines in total]\n"
+        if used + len(marker) <= budget or len(kept) <= 1:
+            break
+        size = len(kept.pop().encode("utf-8"))
+        used -= size
+        dropped += size
+    if used + len(marker) > budget:
+        return _omitted(path, added, removed)
+    return FileDiff(path, "".join(kept) + marker, added, removed, truncated=True)
+
+
+def _fit(diff: FileDiff, budget: int) -> FileDiff:
+    """
+    Cuts an already split file diff down to budget bytes, keeping whole lines.
+    """
+    if diff.size <= budget:
+        return diff
+    header = f"diff --git a/{diff.path} b/{diff.path}\n"
+    if diff.omitted or budget <= len(header):
+        return replace(_omitted(diff.path, diff.added, diff.removed), deleted=diff.deleted)
+    lines = diff.patch.splitlines(keepends=True)
+    dropped = 0
+    if diff.truncated:
+        # Replace the previous truncation marker, carrying over its byte count
+        match = _TRUNCATED_RE.match(lines.pop())
+        dropped = int(match.group(1)) if match else 0
+    return replace(_truncated(diff.path, lines, dropped, diff.added, diff.removed, budget), deleted=diff.deleted)
+
+
+class SharedDiffs:
+    """
+    Diffs memoized per (repository, base, head) and shared by every mapping of
+    that repository, worktrees included. Concurrent requests for the same diff
+    wait for the one computation in flight instead of starting their own.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.cache = LRUCache(max_bytes)
+        self.shared = 0
+        self._lock = threading.Lock()
+        self._inflight: Dict[Hashable, Future] = {}
+
+    def get(self, key: Hashable, compute: Callable[[], List[FileDiff]]) -> List[FileDiff]:
+        diffs = self.cache.get(key)
+        if diffs is not None:
+            return diffs
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+            else:
+                self.shared += 1
+        if not owner:
+            return future.result()
+        try:
+            diffs = compute()
+            self.cache.put(key, diffs, sum(d.size for d in diffs))
+            future.set_result(diffs)
+            return diffs
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def stats(self) -> dict:
+        return {**self.cache.stats(), "shared": self.shared, "in_flight": len(self._inflight)}
+
+
+shared_diffs = SharedDiffs(config.DIFF_MEMO_MAX_BYTES)
+
+
+def _repo_key(source_path: str) -> str:
+    # Worktrees of one repository share its object store and so its diffs
+    dirs = resolve_git_dirs(source_path)
+    return os.path.realpath(dirs[1] if dirs is not None else source_path)
+
+
+def _header_path(header: str) -> str:
+    # "diff --git a/<old> b/<new>"
+    path = header.rstrip("\n").rsplit(" b/", 1)[-1]
+    if path.endswith('"'):
+        path = path[:-1]
+    return path
+
 
 class DiffProcessor:
-    def get_diffs(self, mapping: RepoMapping, new_commit: str) -> list:
+    def __init__(self, max_file_bytes: Optional[int] = None, max_total_bytes: Optional[int] = None,
+                 shared: Optional[SharedDiffs] = None):
+        self.max_file_bytes = max_file_bytes or config.DIFF_MAX_FILE_BYTES
+        self.max_total_bytes = max_total_bytes or config.DIFF_MAX_TOTAL_BYTES
+        self.shared = shared or shared_diffs
+
+    def get_diffs(self, mapping: RepoMapping, new_commit: str, base: Optional[str] = None) -> List[FileDiff]:
         """
-        Retrieves the git diff between the last processed commit and the new commit.
-        If last_processed_commit is empty, diffs against empty tree (shows full codebase).
+        Retrieves the git diff between base (default: the last processed commit) and the new commit.
+        If the base is empty, diffs against empty tree (shows full codebase).
+        The repository diff is computed once and shared with the other mappings of the
+        repository; this mapping's path filter and total budget are applied to it afterwards.
+        If the shared copy ran out of room before the end, a mapping with a path filter
+        streams its own diff instead, dropping other paths before their patch text is
+        kept, so a subtree that sorts late is not lost.
+        Errors are re-raised so the job is retried rather than recorded as an empty diff.
         """
+        if base is None:
+            base = mapping.last_processed_commit
+        base = base or _EMPTY_TREE_SHA
+        patterns = parse_path_filter(mapping.path_filter)
+        repo_key = _repo_key(mapping.source_path)
         try:
-            repo = git.Repo(mapping.source_path)
-
-            if not mapping.last_processed_commit:
-                # First run: diff against empty tree
-                base = git.NULL_TREE
-            else:
-                base = mapping.last_processed_commit
+            diffs = self.shared.get((repo_key, base, new_commit, self.max_file_bytes), lambda: list(self._stream(
+                mapping.source_path, new_commit, base, config.DIFF_SHARED_MAX_TOTAL_BYTES)))
+            if patterns and diffs and diffs[-1].omitted_files:
+                key = (repo_key, base, new_commit, self.max_file_bytes, self.max_total_bytes, tuple(patterns))
+                return self.shared.get(key, lambda: list(self._stream(
+                    mapping.source_path, new_commit, base, self.max_total_bytes,
+                    lambda path: path_selected(path, patterns))))
+        except Exception as e:
+            print(f"Error getting diff for {mapping.source_path}: {e}")
+            raise
+        if patterns:
+            diffs = [d for d in diffs if path_selected(d.path, patterns)]
+        return self._budget(diffs)
 
+    def _stream(self, source_path: str, new_commit: str, base: str, max_total_bytes: int,
+                include: Optional[Callable[[str], bool]] = None) -> Iterator[FileDiff]:
+        repo = git.Repo(source_path)
+        if base != _EMPTY_TREE_SHA:
             try:
-                diffs = repo.commit(new_commit).diff(base, create_patch=True, R=True)
-                return list(map(str, diffs))
-            except git.exc.GitCommandError as e:
+                repo.commit(base)
+            except (ValueError, git.exc.BadName, git.exc.GitCommandError) as e:
                 # Handle rebase, force push, or missing commit
                 print(f"Warning: Could not diff {base}..{new_commit}: {e}")
                 print("Falling back to empty tree diff")
-                diffs = repo.commit(new_commit).diff(git.NULL_TREE, create_patch=True, R=True)
-                return list(map(str, diffs))
+                base = _EMPTY_TREE_SHA
 
-        except Exception as e:
-            print(f"Error getting diff for {mapping.source_path}: {e}")
-            return []
+        proc = repo.git.diff(base, new_commit, "--no-color", "--no-ext-diff", "--", ".",
+                             *_excluded_pathspecs(), as_process=True)
+        finished = False
+        try:
+            yield from self._split(proc.stdout, max_total_bytes, include)
+            finished = True
+        finally:
+            if finished:
+                proc.wait()
+            else:
+                proc.proc.kill()
+                proc.proc.wait()
+            repo.close()
+
+    def _budget(self, diffs: List[FileDiff]) -> List[FileDiff]:
+        # Same cuts as _split, applied to diffs that were split with a larger total budget
+        remaining = self.max_total_bytes
+        omissions = _Omissions()
+        result = []
+        for diff in diffs:
+            if not diff.omitted:
+                diff = _fit(diff, min(self.max_file_bytes, max(remaining - _OMITTED_RESERVE, 0)))
+            if diff.omitted:
+                omissions.add(diff)
+                continue
+            remaining -= diff.size
+            result.append(diff)
+        summary = omissions.entry(remaining)
+        return result + [summary] if summary is not None else result
+
+    def _split(self, lines, max_total_bytes: int, include: Optional[Callable[[str], bool]] = None) -> Iterator[FileDiff]:
+        """
+        One FileDiff per file, each cut at max_file_bytes. Files that no longer fit
+        in the total budget are counted into a single summary entry at the end, for
+        which room is kept, so the total never exceeds max_total_bytes.
+        Paths rejected by include are skipped before any of their patch text is kept.
+        """
+        remaining = max_total_bytes
+        omissions = _Omissions()
+        current = None
+
+        for raw in itertools.chain(lines, [None]):
+            line = None if raw is None else raw.decode("utf-8", errors="replace")
+            if line is None or line.startswith("diff --git "):
+                file_diff = current.finish() if current is not None else None
+                if file_diff is not None and file_diff.omitted:
+                    omissions.add(file_diff)
+                elif file_diff is not None:
+                    remaining -= file_diff.size
+                    yield file_diff
+                if line is None:
+                    break
+                path = _header_path(line)
+                if include is not None and not include(path):
+                    current = None
+                    continue
+                current = _FileDiffBuilder(path, min(self.max_file_bytes, max(remaining - _OMITTED_RESERVE, 0)))
+            elif current is not None:
+                current.feed(line)
+
+        summary = omissions.entry(remaining)
+        if summary is not None:
+            yield summary
+
+
+class _FileDiffBuilder:
+    def __init__(self, path: str, budget: int):
+        self.path = path
+        self.budget = budget
+        self.header = f"diff --git a/{path} b/{path}\n"
+        self.parts = [self.header]
+        self.used = len(self.header)
+        self.dropped = 0
+        self.added = 0
+        self.removed = 0
+        self.binary = False
+        self.deleted = False
+        self.in_hunk = False
+
+    def feed(self, line: str):
+        if not self.in_hunk:
+            if line.startswith(("Binary files ", "GIT binary patch")):
+                self.binary = True
+            elif line.startswith("deleted file mode"):
+                self.deleted = True
+            elif line.startswith("@@"):
+                self.in_hunk = True
+        else:
+            if line.startswith("+"):
+                self.added += 1
+            elif line.startswith("-"):
+                self.removed += 1
+
+        size = len(line.encode("utf-8"))
+        if self.dropped or self.used + size > self.budget:
+            self.dropped += size
+        else:
+            self.parts.append(line)
+            self.used += size
+
+    def finish(self) -> Optional[FileDiff]:
+        if self.binary:
+            return None
+        if self.budget <= len(self.header):
+            diff = _omitted(self.path, self.added, self.removed)
+        elif self.dropped:
+            diff = _truncated(self.path, self.parts, self.dropped, self.added, self.removed, self.budget)
+        else:
+            diff = FileDiff(self.path, "".join(self.parts), self.added, self.removed)
+        diff.deleted = self.deleted
+        return diff
@@ -0,0 +1,200 @@
+"""
+Cheap HEAD resolution for watched repositories.
+
+Reads HEAD, loose refs and packed-refs straight from the git directory and caches
+file contents keyed by (mtime, inode, size), so an unchanged repository costs a few
+stat() calls per check. Layouts the fast path does not understand (bare repos,
+nested symbolic refs, unborn branches) fall back to a pooled `git.Repo` handle.
+"""
+
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+from src import config
+from src.core.logger import get_logger
+
+if TYPE_CHECKING:
+    import git
+
+logger = get_logger(__name__)
+
+_SHA_RE = re.compile(r"^(?:[0-9a-f]{40}|[0-9a-f]{64})$")
+
+
+def resolve_git_dirs(source_path: str) -> Optional[Tuple[str, str]]:
+    """
+    Returns (git_dir, common_dir) for a work tree.
+    Worktrees and submodules use a `.git` file pointing at their git dir, whose refs
+    live in the shared common dir. Returns None if the path is not a work tree.
+    """
+    dot_git = os.path.join(source_path, ".git")
+    if os.path.isdir(dot_git):
+        git_dir = dot_git
+    elif os.path.isfile(dot_git):
+        with open(dot_git, encoding="utf-8") as f:
+            line = f.readline().strip()
+        if not line.startswith("gitdir:"):
+            return None
+        git_dir = line[len("gitdir:"):].strip()
+        if not os.path.isabs(git_dir):
+            git_dir = os.path.join(source_path, git_dir)
+    else:
+        return None
+
+    git_dir = os.path.normpath(git_dir)
+    common_dir = git_dir
+    commondir_file = os.path.join(git_dir, "commondir")
+    if os.path.isfile(commondir_file):
+        with open(commondir_file, encoding="utf-8") as f:
+            common_dir = f.read().strip()
+        if not os.path.isabs(common_dir):
+            common_dir = os.path.join(git_dir, common_dir)
+        common_dir = os.path.normpath(common_dir)
+    return git_dir, common_dir
+
+
+def _stat_key(path: str) -> Optional[tuple]:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_ino, st.st_size
+
+
+class RepoPool:
+    """
+    Process-wide pool of `git.Repo` handles with LRU eviction.
+    Evicted handles are closed so their persistent `git cat-file` processes exit.
+    """
+
+    def __init__(self, max_size: Optional[int] = None):
+        self.max_size = max_size or config.REPO_POOL_SIZE
+        self._repos: "OrderedDict[str, git.Repo]" = OrderedDict()
+        self.lock = threading.RLock()
+
+    def get(self, path: str) -> "git.Repo":
+        key = os.path.abspath(path)
+        with self.lock:
+            repo = self._repos.get(key)
+            if repo is not None:
+                self._repos.move_to_end(key)
+                return repo
+            # GitPython is only loaded once a lookup needs it
+            import git
+            repo = git.Repo(key)
+            self._repos[key] = repo
+            while len(self._repos) > self.max_size:
+                _, evicted = self._repos.popitem(last=False)
+                evicted.close()
+            return repo
+
+    def evict(self, path: str):
+        with self.lock:
+            repo = self._repos.pop(os.path.abspath(path), None)
+            if repo is not None:
+                repo.close()
+
+    def clear(self):
+        with self.lock:
+            for repo in self._repos.values():
+                repo.close()
+            self._repos.clear()
+
+
+class HeadResolver:
+    def __init__(self, pool: Optional[RepoPool] = None):
+        self.pool = pool or repo_pool
+        self._dirs: Dict[str, Optional[Tuple[str, str]]] = {}
+        # path -> (stat key, file content)
+        self._files: Dict[str, Tuple[tuple, str]] = {}
+        # packed-refs path -> (stat key, {ref name: sha})
+        self._packed: Dict[str, Tuple[tuple, Dict[str, str]]] = {}
+
+    def resolve(self, source_path: str) -> Optional[str]:
+        """
+        Returns the commit hash HEAD points at, or None for bare or empty repositories.
+        """
+        dirs = self._dirs.get(source_path)
+        if dirs is None:
+            dirs = resolve_git_dirs(source_path)
+            if dirs is not None:
+                self._dirs[source_path] = dirs
+
+        if dirs is not None:
+            try:
+                sha = self._resolve_from_files(*dirs)
+            except OSError as e:
+                logger.debug("Fast HEAD resolution failed for %s: %s", source_path, e)
+                self._dirs.pop(source_path, None)
+                sha = None
+            if sha is not None:
+                return sha
+
+        return self._resolve_with_git(source_path)
+
+    def _resolve_from_files(self, git_dir: str, common_dir: str) -> Optional[str]:
+        head = self._read(os.path.join(git_dir, "HEAD"))
+        if head is None:
+            return None
+        if _SHA_RE.match(head):
+            return head
+        if not head.startswith("ref: "):
+            return None
+
+        ref = head[len("ref: "):].strip()
+        loose = self._read(os.path.join(common_dir, ref))
+        if loose is not None:
+            # A loose ref that is itself symbolic is left to git.
+            return loose if _SHA_RE.match(loose) else None
+        return self._packed_refs(os.path.join(common_dir, "packed-refs")).get(ref)
+
+    def _read(self, path: str) -> Optional[str]:
+        key = _stat_key(path)
+        if key is None:
+            self._files.pop(path, None)
+            return None
+        cached = self._files.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        with open(path, encoding="utf-8") as f:
+            content = f.read().strip()
+        self._files[path] = (key, content)
+        return content
+
+    def _packed_refs(self, path: str) -> Dict[str, str]:
+        key = _stat_key(path)
+        if key is None:
+            self._packed.pop(path, None)
+            return {}
+        cached = self._packed.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        refs = {}
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.startswith(("#", "^")):
+                    continue
+                parts = line.split()
+                if len(parts) == 2:
+                    refs[parts[1]] = parts[0]
+        self._packed[path] = (key, refs)
+        return refs
+
+    def _resolve_with_git(self, source_path: str) -> Optional[str]:
+        with self.pool.lock:
+            repo = self.pool.get(source_path)
+            if repo.bare:
+                return None
+            try:
+                return repo.head.commit.hexsha
+            except ValueError:
+                # Unborn branch: nothing committed yet
+                return None
+
+
+repo_pool = RepoPool()
+head_resolver = HeadResolver()
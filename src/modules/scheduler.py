@@ -0,0 +1,425 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, asdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import or_
+from sqlmodel import Session, select
+
+from src import config
+from src.core.logger import get_logger
+from src.database import db_writer, engine
+from src.db_models import RepoMapping
+from src.modules.jobs import JobQueue
+from src.modules.leases import LeaseManager
+
+logger = get_logger(__name__)
+
+
+@dataclass
+class MappingStats:
+    mapping_id: int
+    queued: int = 0
+    running: bool = False
+    runs: int = 0
+    failures: int = 0
+    last_status: Optional[str] = None
+    last_wait_seconds: float = 0.0
+    last_run_seconds: float = 0.0
+    total_run_seconds: float = 0.0
+    last_started_at: Optional[float] = None
+    last_finished_at: Optional[float] = None
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        data["avg_run_seconds"] = self.total_run_seconds / self.runs if self.runs else 0.0
+        return data
+
+
+@dataclass
+class SchedulePolicy:
+    priority: int = config.DEFAULT_MAPPING_PRIORITY
+    weight: float = config.DEFAULT_MAPPING_WEIGHT
+    min_interval_seconds: float = config.DEFAULT_MAPPING_MIN_INTERVAL_SECONDS
+
+    @classmethod
+    def of(cls, mapping: RepoMapping) -> "SchedulePolicy":
+        return cls(mapping.priority, max(mapping.weight, 0.001), max(mapping.min_interval_seconds, 0))
+
+
+@dataclass
+class QueueEntry:
+    mapping_id: int
+    priority: int
+    # Virtual start time: the mapping's share of worker time already used, see PipelineScheduler
+    virtual_start: float
+    enqueued_at: float
+    # False while the mapping's min interval has not passed
+    ready: bool = True
+
+
+class TokenBucket:
+    """
+    Holds up to burst tokens, refilled at rate tokens per second.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.waits = 0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> float:
+        """
+        Takes a token. Returns 0, or the seconds until one is available.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            self.waits += 1
+            return (1 - self.tokens) / self.rate
+
+
+class ProviderLimiter:
+    """
+    Caps the number of concurrent generations and, where LLM_RATE_LIMITS sets one,
+    the rate of model requests with a token bucket. Limits are looked up as
+    "provider:model", then "provider"; a provider-level limit is one semaphore or
+    bucket shared by all of that provider's models.
+    """
+
+    def __init__(self, limits: Optional[Dict[str, int]] = None, default: Optional[int] = None,
+                 rates: Optional[Dict[str, Tuple[float, float]]] = None):
+        self.limits = limits if limits is not None else config.LLM_CONCURRENCY
+        self.default = default if default is not None else config.DEFAULT_LLM_CONCURRENCY
+        self.rates = rates if rates is not None else config.LLM_RATE_LIMITS
+        self._lock = threading.Lock()
+        self._semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    @staticmethod
+    def _match(table: dict, provider: str, model: str) -> Optional[str]:
+        for key in (f"{provider}:{model}", provider):
+            if key in table:
+                return key
+        return None
+
+    def limit_for(self, provider: str, model: str) -> int:
+        key = self._match(self.limits, provider, model)
+        return max(1, int(self.limits[key] if key is not None else self.default))
+
+    def rate_for(self, provider: str, model: str) -> Optional[Tuple[float, float]]:
+        key = self._match(self.rates, provider, model)
+        if key is None:
+            return None
+        per_minute, burst = self.rates[key]
+        return per_minute / 60, burst
+
+    def _bucket(self, provider: str, model: str) -> Optional[TokenBucket]:
+        key = self._match(self.rates, provider, model)
+        if key is None:
+            return None
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(*self.rate_for(provider, model))
+            return bucket
+
+    def _semaphore(self, provider: str, model: str) -> threading.BoundedSemaphore:
+        # Pairs without a configured limit each get the default
+        key = self._match(self.limits, provider, model) or f"{provider}:{model}"
+        with self._lock:
+            sem = self._semaphores.get(key)
+            if sem is None:
+                sem = self._semaphores[key] = threading.BoundedSemaphore(self.limit_for(provider, model))
+            return sem
+
+    @asynccontextmanager
+    async def slot(self, provider: str, model: str):
+        """
+        Holds one of the concurrent generation slots for the block.
+        """
+        sem = self._semaphore(provider, model)
+        # Poll instead of blocking so the generation's event loop keeps serving
+        # other chunks and can still be cancelled while waiting for a slot.
+        while not sem.acquire(blocking=False):
+            await asyncio.sleep(0.05)
+        try:
+            yield
+        finally:
+            sem.release()
+
+    async def throttle(self, provider: str, model: str):
+        """
+        Waits for a rate-limit token; called before every model request.
+        """
+        bucket = self._bucket(provider, model)
+        while bucket is not None:
+            wait = bucket.try_acquire()
+            if not wait:
+                return
+            await asyncio.sleep(min(wait, 1.0))
+
+    def stats(self) -> List[dict]:
+        with self._lock:
+            buckets = dict(self._buckets)
+        return [
+            {"key": key, "rate_per_minute": bucket.rate * 60, "burst": bucket.burst,
+             "tokens": round(bucket.tokens, 2), "waits": bucket.waits}
+            for key, bucket in sorted(buckets.items())
+        ]
+
+
+class PipelineScheduler:
+    """
+    Runs the pipeline for each mapping on a bounded worker pool.
+
+    A mapping is never processed by two workers at once, and is queued at most
+    once while it is waiting, so repeated submissions coalesce. With a
+    LeaseManager, runs also take the mapping's lease first, which extends that
+    guarantee to other processes and nodes sharing the database.
+
+    Free workers take the queued mapping with the highest priority and, within a
+    priority, the lowest virtual start time (start-time fair queuing): each run
+    advances its mapping's virtual time by run seconds / weight, so a mapping
+    that keeps getting new commits falls behind the others instead of starving
+    them, and weight 2 gets about twice the worker time of weight 1. A mapping
+    is not started again before its min interval has passed.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, limiter: Optional[ProviderLimiter] = None,
+                 leases: Optional[LeaseManager] = None):
+        self.max_workers = max_workers or config.WORKER_POOL_SIZE
+        self.limiter = limiter or ProviderLimiter()
+        self.leases = leases
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="autodoc-worker")
+        self._lock = threading.Lock()
+        self._mapping_locks: Dict[int, threading.Lock] = {}
+        self._stats: Dict[int, MappingStats] = {}
+        self._policies: Dict[int, SchedulePolicy] = {}
+        self._queue: Dict[int, QueueEntry] = {}
+        self._timers: Dict[int, threading.Timer] = {}
+        self._virtual_finish: Dict[int, float] = {}
+        self._virtual_time = 0.0
+        self._closed = False
+
+    def submit(self, mapping_id: int) -> bool:
+        """
+        Queues a pipeline run for the mapping.
+        Returns False if a run for it is already waiting or the scheduler is closed.
+        """
+        policy = self._policy(mapping_id)
+        with self._lock:
+            if self._closed:
+                return False
+            stats = self._stats.setdefault(mapping_id, MappingStats(mapping_id))
+            if stats.queued:
+                return False
+            stats.queued += 1
+            entry = QueueEntry(mapping_id, policy.priority,
+                               max(self._virtual_time, self._virtual_finish.get(mapping_id, 0.0)), time.monotonic())
+            self._queue[mapping_id] = entry
+            delay = 0.0
+            if policy.min_interval_seconds and stats.last_started_at is not None:
+                delay = stats.last_started_at + policy.min_interval_seconds - time.time()
+            if delay > 0:
+                entry.ready = False
+                timer = threading.Timer(delay, self._release, (mapping_id,))
+                timer.daemon = True
+                self._timers[mapping_id] = timer
+                timer.start()
+                return True
+        self._executor.submit(self._run_next)
+        return True
+
+    def _release(self, mapping_id: int):
+        with self._lock:
+            self._timers.pop(mapping_id, None)
+            entry = self._queue.get(mapping_id)
+            if self._closed or entry is None:
+                return
+            entry.ready = True
+        self._executor.submit(self._run_next)
+
+    def _policy(self, mapping_id: int) -> SchedulePolicy:
+        with self._lock:
+            policy = self._policies.get(mapping_id)
+        if policy is None:
+            with Session(engine) as session:
+                mapping = session.get(RepoMapping, mapping_id)
+            policy = SchedulePolicy.of(mapping) if mapping is not None else SchedulePolicy()
+            with self._lock:
+                self._policies[mapping_id] = policy
+        return policy
+
+    def update_policy(self, mapping: RepoMapping):
+        """
+        Picks up changed priority/weight/min interval; runs refresh it from the database too.
+        """
+        with self._lock:
+            self._policies[mapping.id] = SchedulePolicy.of(mapping)
+
+    def submit_active(self, due_only: bool = False) -> int:
+        """
+        Queues every active mapping, or with due_only those whose next_due_at has
+        passed (both served by indexes). Returns the number of newly queued runs.
+        """
+        query = select(RepoMapping).where(RepoMapping.is_active == True)
+        if due_only:
+            query = query.where(or_(RepoMapping.next_due_at == None, RepoMapping.next_due_at <= datetime.utcnow()))
+        with Session(engine) as session:
+            mappings = session.exec(query).all()
+        for mapping in mappings:
+            self.update_policy(mapping)
+        return sum(1 for mapping in mappings if self.submit(mapping.id))
+
+    def submit_due(self) -> int:
+        """
+        Queues mappings whose jobs are due (coalescing window or retry backoff passed).
+        """
+        with Session(engine) as session:
+            mapping_ids = JobQueue(session).due_mapping_ids()
+        return sum(1 for mapping_id in mapping_ids if self.submit(mapping_id))
+
+    def _mapping_lock(self, mapping_id: int) -> threading.Lock:
+        with self._lock:
+            return self._mapping_locks.setdefault(mapping_id, threading.Lock())
+
+    def _run_next(self):
+        with self._lock:
+            ready = [entry for entry in self._queue.values() if entry.ready]
+            if not ready:
+                return
+            # A mapping that is still running would block this worker on its lock, so prefer others
+            entry = min(ready, key=lambda e: (self._stats[e.mapping_id].running, -e.priority,
+                                              e.virtual_start, e.enqueued_at))
+            del self._queue[entry.mapping_id]
+            self._virtual_time = max(self._virtual_time, entry.virtual_start)
+        self._run(entry.mapping_id, entry.enqueued_at, entry.virtual_start)
+
+    def _run(self, mapping_id: int, enqueued_at: float, virtual_start: float = 0.0):
+        with self._mapping_lock(mapping_id):
+            started = time.monotonic()
+            with self._lock:
+                stats = self._stats[mapping_id]
+                stats.queued -= 1
+                stats.running = True
+                stats.last_wait_seconds = started - enqueued_at
+                stats.last_started_at = time.time()
+
+            status = None
+            leased = False
+            try:
+                leased = self.leases is None or self.leases.acquire(mapping_id)
+                if leased:
+                    with Session(engine) as session:
+                        mapping = session.get(RepoMapping, mapping_id)
+                        if mapping is not None:
+                            self.update_policy(mapping)
+                        if mapping is not None and mapping.is_active:
+                            owner = None
+                            if self.leases is not None:
+                                # We hold the lease, so a RUNNING job of this mapping belongs to a dead worker.
+                                JobQueue(session).requeue_running(mapping_id)
+                                owner = self.leases.owner
+                            # Imported here: it pulls in the LLM stack, which API-only processes never need
+                            from src.modules.pipeline import PipelineOrchestrator
+                            orchestrator = PipelineOrchestrator(session, llm_limiter=self.limiter, lease_owner=owner)
+                            status = orchestrator.process_mapping(mapping)
+                            self._reschedule(mapping_id, enqueued_at)
+                else:
+                    logger.debug("Mapping %s is leased by another worker, skipping", mapping_id)
+            except Exception as e:
+                status = "FAILED"
+                logger.exception("Scheduled run failed for mapping %s: %s", mapping_id, e)
+            finally:
+                if leased and self.leases is not None:
+                    try:
+                        self.leases.release(mapping_id)
+                    except Exception as e:
+                        logger.warning("Releasing lease on mapping %s failed: %s", mapping_id, e)
+                elapsed = time.monotonic() - started
+                with self._lock:
+                    stats.running = False
+                    stats.last_finished_at = time.time()
+                    weight = self._policies.get(mapping_id, SchedulePolicy()).weight
+                    self._virtual_finish[mapping_id] = virtual_start + elapsed / weight
+                    if status is not None:
+                        stats.runs += 1
+                        stats.last_status = status
+                        stats.last_run_seconds = elapsed
+                        stats.total_run_seconds += elapsed
+                        if status == "FAILED":
+                            stats.failures += 1
+            if status in ("SUCCESS", "SKIPPED"):
+                # Commits queued while this job ran may already be due.
+                self.submit(mapping_id)
+
+    def _reschedule(self, mapping_id: int, enqueued_at: float):
+        """
+        Sets when the tick should next queue the mapping on its own: one poll interval
+        after it was queued this time (so a poll tick finds it due again), or
+        MAPPING_RECHECK_SECONDS when ref events trigger runs; never before its min interval.
+        """
+        interval = config.POLL_INTERVAL_SECONDS if config.WATCH_MODE == "poll" else config.MAPPING_RECHECK_SECONDS
+        now = datetime.utcnow()
+        queued_at = now - timedelta(seconds=time.monotonic() - enqueued_at)
+        min_interval = self._policies.get(mapping_id, SchedulePolicy()).min_interval_seconds
+        due = max(queued_at + timedelta(seconds=interval), now + timedelta(seconds=min_interval))
+
+        def apply(session: Session):
+            mapping = session.get(RepoMapping, mapping_id)
+            if mapping is not None:
+                mapping.next_due_at = due
+                session.add(mapping)
+
+        db_writer.submit(apply)
+
+    def stats(self) -> List[dict]:
+        with self._lock:
+            return [s.to_dict() for s in sorted(self._stats.values(), key=lambda s: s.mapping_id)]
+
+    def queue_depth(self) -> int:
+        with self._lock:
+            return sum(s.queued for s in self._stats.values())
+
+    def queue(self) -> List[dict]:
+        """
+        Waiting mappings in the order free workers would take them.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entries = sorted(self._queue.values(),
+                             key=lambda e: (not e.ready, -e.priority, e.virtual_start, e.enqueued_at))
+            return [
+                {
+                    "position": position,
+                    "mapping_id": entry.mapping_id,
+                    "priority": entry.priority,
+                    "weight": self._policies.get(entry.mapping_id, SchedulePolicy()).weight,
+                    "virtual_start": round(entry.virtual_start - self._virtual_time, 3),
+                    "waiting_seconds": round(now - entry.enqueued_at, 3),
+                    "ready": entry.ready,
+                    "running": self._stats[entry.mapping_id].running,
+                }
+                for position, entry in enumerate(entries, 1)
+            ]
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            self._closed = True
+            timers = list(self._timers.values())
+            self._timers.clear()
+        for timer in timers:
+            timer.cancel()
+        self._executor.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,290 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+import git
+
+from src import config
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache bounded by the total size of its values.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._items: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key: Hashable, value, size: int):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._items.pop(key, None)
+            if previous is not None:
+                self.size -= previous[1]
+            self._items[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted_size) = self._items.popitem(last=False)
+                self.size -= evicted_size
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._items), "bytes": self.size, "hits": self.hits, "misses": self.misses}
+
+
+# Shared across runs: blobs and trees are immutable, so anything unchanged between
+# consecutive commits is served from memory.
+blob_cache = LRUCache(config.SNAPSHOT_BLOB_CACHE_BYTES)
+tree_cache = LRUCache(config.SNAPSHOT_TREE_CACHE_BYTES)
+
+
+class PrefetchStats:
+    """
+    Process-wide totals of speculative prefetch: what was loaded, and how many
+    tool reads it served.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.files = 0
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def add(self, files: int, size: int, hits: int, misses: int):
+        with self._lock:
+            self.runs += 1
+            self.files += files
+            self.bytes += size
+            self.hits += hits
+            self.misses += misses
+
+    def stats(self) -> dict:
+        with self._lock:
+            reads = self.hits + self.misses
+            return {"runs": self.runs, "files": self.files, "bytes": self.bytes, "hits": self.hits,
+                    "misses": self.misses, "hit_rate": self.hits / reads if reads else 0.0}
+
+
+prefetch_stats = PrefetchStats()
+_prefetch_pool: Optional[ThreadPoolExecutor] = None
+_prefetch_pool_lock = threading.Lock()
+
+
+def prefetch_pool() -> ThreadPoolExecutor:
+    global _prefetch_pool
+    with _prefetch_pool_lock:
+        if _prefetch_pool is None:
+            _prefetch_pool = ThreadPoolExecutor(config.PREFETCH_WORKERS, thread_name_prefix="autodoc-prefetch")
+        return _prefetch_pool
+
+
+def _listing(tree) -> List[str]:
+    ignore_dirs = getattr(config, 'IGNORE_DIRS', set())
+    result = []
+    for item in tree:
+        # Skip dot-marked and ignored folders
+        if item.name.startswith('.') and item.name not in {'.gitignore', '.env'}:
+            continue
+        if item.name in ignore_dirs:
+            continue
+        result.append(f"{item.name}/" if item.type == "tree" else item.name)
+    result.sort()
+    return result
+
+
+def _subtree(root, folder: str):
+    if not folder:
+        return root
+    try:
+        obj = root / folder
+    except KeyError:
+        return None
+    return obj if obj.type == "tree" else None
+
+
+class CommitSnapshot:
+    """
+    Read-only view of a repository at one commit, used by the agent's repo tools.
+    File contents are memoized by blob SHA and directory listings by tree SHA.
+    prefetch() can load likely reads ahead of the tools; reads of prefetched
+    paths are then served without touching git.
+    """
+
+    def __init__(self, source_path: str, commit_sha: str):
+        self.source_path = os.path.abspath(source_path)
+        self.repo = git.Repo(source_path)
+        self.commit = self.repo.commit(commit_sha)
+        # GitPython's object database reads through a single cat-file process.
+        self._lock = threading.Lock()
+        # Relative path -> (object type, SHA) of paths resolved so far
+        self._entries: Dict[str, Tuple[str, str]] = {}
+        self.prefetched: Set[str] = set()
+        self.prefetched_bytes = 0
+        self.prefetch_hits = 0
+        self.prefetch_misses = 0
+        self._stats_lock = threading.Lock()
+        self._closed = False
+
+    def close(self):
+        self._closed = True
+        self.repo.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def relative(self, path: str) -> str:
+        """
+        Normalizes a tool path to a repository-relative POSIX path.
+        Raises ValueError for paths outside the repository.
+        """
+        if os.path.isabs(path):
+            path = os.path.relpath(os.path.abspath(path), self.source_path)
+        rel = os.path.normpath(path).replace(os.sep, "/")
+        if rel == ".":
+            return ""
+        if rel == ".." or rel.startswith("../"):
+            raise ValueError(f"{path} is outside the repository")
+        return rel
+
+    def _lookup(self, rel: str):
+        tree = self.commit.tree
+        if not rel:
+            return tree
+        try:
+            return tree / rel
+        except KeyError:
+            raise FileNotFoundError(f"{rel} does not exist at commit {self.commit.hexsha[:7]}")
+
+    def _memoized(self, rel: str, kind: str, cache: LRUCache):
+        entry = self._entries.get(rel)
+        value = cache.get(entry[1]) if entry is not None and entry[0] == kind else None
+        with self._stats_lock:
+            if rel in self.prefetched and value is not None:
+                self.prefetch_hits += 1
+            elif rel in self.prefetched or entry is None:
+                # Read before it was loaded, evicted since, or not predicted
+                self.prefetch_misses += 1
+        return value
+
+    def list_dir(self, path: str) -> List[str]:
+        rel = self.relative(path)
+        cached = self._memoized(rel, "tree", tree_cache)
+        if cached is not None:
+            return list(cached)
+        with self._lock:
+            obj = self._lookup(rel)
+            if obj.type != "tree":
+                raise NotADirectoryError(f"{path} is not a directory")
+            self._entries[rel] = ("tree", obj.hexsha)
+            cached = tree_cache.get(obj.hexsha)
+            if cached is not None:
+                return list(cached)
+
+            result = _listing(obj)
+            tree_cache.put(obj.hexsha, result, sum(len(name) for name in result) + 64)
+            return list(result)
+
+    def read_file(self, path: str) -> str:
+        rel = self.relative(path)
+        cached = self._memoized(rel, "blob", blob_cache)
+        if cached is not None:
+            return cached
+        with self._lock:
+            obj = self._lookup(rel)
+            if obj.type != "blob":
+                raise IsADirectoryError(f"{path} is not a file")
+            self._entries[rel] = ("blob", obj.hexsha)
+            cached = blob_cache.get(obj.hexsha)
+            if cached is not None:
+                return cached
+            data = obj.data_stream.read()
+            content = data.decode("utf-8", errors="replace")
+            blob_cache.put(obj.hexsha, content, len(data))
+            return content
+
+    def prefetch(self, paths: Iterable[str], max_files: Optional[int] = None, max_bytes: Optional[int] = None) -> int:
+        """
+        Loads the given files, the files next to them and the listings of their
+        folders (root included) into the caches. Reads go through a separate git
+        process, so tool calls are not held up meanwhile. Returns the number of
+        files loaded.
+        """
+        max_files = max_files or config.PREFETCH_MAX_FILES
+        max_bytes = max_bytes or config.PREFETCH_MAX_BYTES
+        paths = [self.relative(p) for p in paths]
+        folders: List[str] = []
+        for path in paths:
+            folder = os.path.dirname(path)
+            while True:
+                if folder not in folders:
+                    folders.append(folder)
+                if not folder:
+                    break
+                folder = os.path.dirname(folder)
+
+        repo = git.Repo(self.source_path)
+        try:
+            root = repo.commit(self.commit.hexsha).tree
+            blobs: Dict[str, object] = {}
+            for rel in paths:
+                try:
+                    obj = root / rel
+                except KeyError:
+                    # Deleted by the commit
+                    continue
+                if obj.type == "blob":
+                    blobs.setdefault(rel, obj)
+            for folder in folders:
+                tree = _subtree(root, folder)
+                if tree is None:
+                    continue
+                self._entries.setdefault(folder, ("tree", tree.hexsha))
+                self.prefetched.add(folder)
+                if tree_cache.get(tree.hexsha) is None:
+                    listing = _listing(tree)
+                    tree_cache.put(tree.hexsha, listing, sum(len(name) for name in listing) + 64)
+            # Siblings of the changed files, not of every ancestor folder
+            for folder in dict.fromkeys(os.path.dirname(rel) for rel in paths):
+                tree = _subtree(root, folder)
+                for item in tree.blobs if tree is not None else []:
+                    if item.name.startswith(".") or item.size > config.PREFETCH_MAX_FILE_BYTES:
+                        continue
+                    blobs.setdefault(f"{folder}/{item.name}" if folder else item.name, item)
+
+            loaded = 0
+            for rel, obj in blobs.items():
+                if self._closed or loaded >= max_files or self.prefetched_bytes >= max_bytes:
+                    break
+                self._entries.setdefault(rel, ("blob", obj.hexsha))
+                if blob_cache.get(obj.hexsha) is None:
+                    data = obj.data_stream.read()
+                    blob_cache.put(obj.hexsha, data.decode("utf-8", errors="replace"), len(data))
+                    self.prefetched_bytes += len(data)
+                self.prefetched.add(rel)
+                loaded += 1
+            return loaded
+        finally:
+            repo.close()
@@ -1,23 +1,272 @@
-import git
+import os
+import threading
+import time
+from src import config
+from src.core.logger import get_logger
 from src.db_models import RepoMapping
-from typing import Optional
+from src.modules.refs import HeadResolver, head_resolver, resolve_git_dirs
+from typing import Callable, Dict, Iterable, Optional, Set, Tuple
+
+logger = get_logger(__name__)
+
+# Filesystem events that can move a ref. Open/close-without-write events are ignored
+# so that reading HEAD (including our own reads) never looks like a change.
+_REF_EVENT_TYPES = {"created", "modified", "moved", "deleted"}
+
 
 class RepositoryWatcher:
+    def __init__(self, resolver: Optional[HeadResolver] = None):
+        # The shared resolver keeps its ref caches and repo handles across pipeline runs.
+        self.resolver = resolver or head_resolver
+
     def check_for_updates(self, mapping: RepoMapping) -> Optional[str]:
         """
         Checks if valid new commits exist in the source repo.
         Returns the HEAD commit hash if it differs from the last processed commit.
         """
         try:
-            repo = git.Repo(mapping.source_path)
-            if repo.bare:
+            head_commit = self.resolver.resolve(mapping.source_path)
+            if head_commit is None:
                 return None
-            
-            head_commit = repo.head.commit.hexsha
-            
+
             if head_commit != mapping.last_processed_commit:
                 return head_commit
             return None
         except Exception as e:
             print(f"Error watching repo {mapping.source_path}: {e}")
             return None
+
+
+def ref_signature(git_dir: str, common_dir: str) -> tuple:
+    """
+    Cheap fingerprint of HEAD, packed-refs and loose refs built from stat() calls only.
+    """
+    entries = []
+    for path in (os.path.join(git_dir, "HEAD"), os.path.join(common_dir, "packed-refs")):
+        try:
+            st = os.stat(path)
+            entries.append((path, st.st_mtime_ns, st.st_size, st.st_ino))
+        except FileNotFoundError:
+            entries.append((path, None))
+    for root, _, files in os.walk(os.path.join(common_dir, "refs")):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((path, st.st_mtime_ns, st.st_size, st.st_ino))
+    entries.sort(key=lambda e: e[0])
+    return tuple(entries)
+
+
+class _RepoWatch:
+    def __init__(self, git_dir: str, common_dir: str):
+        self.git_dir = git_dir
+        self.common_dir = common_dir
+        self.mapping_ids: Set[int] = set()
+        self.watches = []
+        self.polled = False
+        self.signature: Optional[tuple] = None
+
+    def is_ref_path(self, path: str) -> bool:
+        path = os.path.normpath(path)
+        if path.endswith(".lock"):
+            return False
+        if path in (os.path.join(self.git_dir, "HEAD"), os.path.join(self.common_dir, "packed-refs")):
+            return True
+        refs_dir = os.path.join(self.common_dir, "refs")
+        return path.startswith(refs_dir + os.sep)
+
+
+class RefChangeMonitor:
+    """
+    Event-driven change detection for mappings.
+
+    Subscribes to HEAD, refs/ and packed-refs of each mapped repository through
+    watchdog and calls `on_change(mapping_id)` once a burst of ref updates has been
+    quiet for the debounce period. Repositories that cannot be watched natively
+    (no inotify/FSEvents, watch limits exhausted) fall back to a stat() poll of the
+    ref files only.
+    """
+
+    def __init__(self, on_change: Callable[[int], None], debounce_seconds: Optional[float] = None,
+                 max_delay_seconds: Optional[float] = None, poll_interval_seconds: Optional[float] = None):
+        self.on_change = on_change
+        self.debounce_seconds = config.WATCH_DEBOUNCE_SECONDS if debounce_seconds is None else debounce_seconds
+        self.max_delay_seconds = config.WATCH_MAX_DELAY_SECONDS if max_delay_seconds is None else max_delay_seconds
+        self.poll_interval_seconds = config.WATCH_POLL_INTERVAL_SECONDS if poll_interval_seconds is None else poll_interval_seconds
+        self._lock = threading.Lock()
+        self._repos: Dict[str, _RepoWatch] = {}
+        self._mapping_repo: Dict[int, str] = {}
+        # repo key -> (first event time, last event time)
+        self._pending: Dict[str, Tuple[float, float]] = {}
+        self._observer = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_poll = 0.0
+
+    @property
+    def native(self) -> bool:
+        return self._observer is not None
+
+    def start(self):
+        try:
+            from watchdog.observers import Observer
+            from watchdog.observers.polling import PollingObserver
+
+            observer = Observer()
+            # watchdog silently degrades to a full directory-snapshot poller on platforms
+            # without a native backend; our ref-file poll is far cheaper than that.
+            if isinstance(observer, PollingObserver):
+                logger.warning("No native filesystem events available, falling back to ref polling")
+            else:
+                observer.start()
+                self._observer = observer
+        except Exception as e:
+            logger.warning("Filesystem event watching unavailable (%s), falling back to ref polling", e)
+            self._observer = None
+
+        self._thread = threading.Thread(target=self._loop, name="autodoc-ref-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join(timeout=5)
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def sync(self, mappings: Iterable[Tuple[int, str]]):
+        """
+        Makes the watched set match the given (mapping_id, source_path) pairs.
+        """
+        wanted = dict(mappings)
+        for mapping_id in set(self._mapping_repo) - set(wanted):
+            self.unwatch(mapping_id)
+        for mapping_id, source_path in wanted.items():
+            self.watch(mapping_id, source_path)
+
+    def watch(self, mapping_id: int, source_path: str) -> bool:
+        try:
+            dirs = resolve_git_dirs(source_path)
+        except OSError as e:
+            logger.warning("Cannot watch %s: %s", source_path, e)
+            return False
+        if dirs is None:
+            logger.warning("Cannot watch %s: not a git work tree", source_path)
+            return False
+
+        git_dir, common_dir = dirs
+        with self._lock:
+            previous = self._mapping_repo.get(mapping_id)
+            if previous == git_dir:
+                return True
+            if previous is not None:
+                self._detach(mapping_id)
+
+            repo = self._repos.get(git_dir)
+            if repo is None:
+                repo = _RepoWatch(git_dir, common_dir)
+                self._subscribe(repo)
+                self._repos[git_dir] = repo
+            repo.mapping_ids.add(mapping_id)
+            self._mapping_repo[mapping_id] = git_dir
+        return True
+
+    def unwatch(self, mapping_id: int):
+        with self._lock:
+            self._detach(mapping_id)
+
+    def _detach(self, mapping_id: int):
+        git_dir = self._mapping_repo.pop(mapping_id, None)
+        if git_dir is None:
+            return
+        repo = self._repos[git_dir]
+        repo.mapping_ids.discard(mapping_id)
+        if not repo.mapping_ids:
+            for watch in repo.watches:
+                try:
+                    self._observer.unschedule(watch)
+                except Exception:
+                    pass
+            del self._repos[git_dir]
+            self._pending.pop(git_dir, None)
+
+    def _subscribe(self, repo: _RepoWatch):
+        if self._observer is not None:
+            from watchdog.events import FileSystemEventHandler
+
+            monitor = self
+
+            class _Handler(FileSystemEventHandler):
+                def on_any_event(self, event):
+                    if event.event_type not in _REF_EVENT_TYPES:
+                        return
+                    paths = [event.src_path, getattr(event, "dest_path", "")]
+                    if any(p and repo.is_ref_path(os.fsdecode(p)) for p in paths):
+                        monitor._notify(repo.git_dir)
+
+            handler = _Handler()
+            targets = [(repo.git_dir, False), (os.path.join(repo.common_dir, "refs"), True)]
+            if repo.common_dir != repo.git_dir:
+                targets.append((repo.common_dir, False))
+            try:
+                for path, recursive in targets:
+                    repo.watches.append(self._observer.schedule(handler, path, recursive=recursive))
+                return
+            except Exception as e:
+                logger.warning("Cannot subscribe to %s (%s), polling its refs instead", repo.git_dir, e)
+                for watch in repo.watches:
+                    try:
+                        self._observer.unschedule(watch)
+                    except Exception:
+                        pass
+                repo.watches = []
+
+        repo.polled = True
+        repo.signature = ref_signature(repo.git_dir, repo.common_dir)
+
+    def _notify(self, key: str):
+        now = time.monotonic()
+        with self._lock:
+            first, _ = self._pending.get(key, (now, now))
+            self._pending[key] = (first, now)
+
+    def _loop(self):
+        tick = min(0.25, self.debounce_seconds or 0.25)
+        while not self._stop.wait(tick):
+            now = time.monotonic()
+            if now - self._last_poll >= self.poll_interval_seconds:
+                self._last_poll = now
+                self._poll_refs()
+            self._flush(now)
+
+    def _poll_refs(self):
+        with self._lock:
+            polled = [repo for repo in self._repos.values() if repo.polled]
+        for repo in polled:
+            try:
+                signature = ref_signature(repo.git_dir, repo.common_dir)
+            except OSError as e:
+                logger.warning("Ref poll failed for %s: %s", repo.git_dir, e)
+                continue
+            if signature != repo.signature:
+                repo.signature = signature
+                self._notify(repo.git_dir)
+
+    def _flush(self, now: float):
+        due = []
+        with self._lock:
+            for key, (first, last) in list(self._pending.items()):
+                if now - last >= self.debounce_seconds or now - first >= self.max_delay_seconds:
+                    del self._pending[key]
+                    repo = self._repos.get(key)
+                    if repo is not None:
+                        due.extend(repo.mapping_ids)
+        for mapping_id in due:
+            try:
+                self.on_change(mapping_id)
+            except Exception as e:
+                logger.error("Change callback failed for mapping %s: %s", mapping_id, e)
@@ -0,0 +1,147 @@
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Optional, Set
+
+from sqlalchemy import func
+from sqlmodel import Session, select
+
+from src import config
+from src.core.logger import get_logger
+from src.core.progress import generation_registry
+from src.database import engine, db_writer
+from src.db_models import RepoMapping
+from src.modules.leases import LeaseManager
+from src.modules.scheduler import PipelineScheduler
+from src.modules.watcher import RefChangeMonitor
+
+logger = get_logger(__name__)
+
+
+def node_role() -> str:
+    """
+    "all" runs the API and the pipeline in one process, "api" only serves the API
+    (and enqueues jobs), "worker" only runs the pipeline. AUTODOC_ROLE overrides config.
+    """
+    role = os.getenv("AUTODOC_ROLE", config.NODE_ROLE)
+    if role not in ("all", "api", "worker"):
+        raise ValueError(f"Unknown node role: {role}")
+    return role
+
+
+def active_mappings():
+    with Session(engine) as session:
+        return session.exec(
+            select(RepoMapping.id, RepoMapping.source_path).where(RepoMapping.is_active == True)
+        ).all()
+
+
+class WorkerNode:
+    """
+    The pipeline side of a node: the scheduler's worker pool, change detection
+    and the lease heartbeat. Several nodes (or processes) can run against one
+    database; mapping leases keep them from processing the same mapping at once.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self.leases = LeaseManager(on_lost=generation_registry.cancel)
+        self.scheduler = PipelineScheduler(max_workers=max_workers, leases=self.leases)
+        self.monitor = None
+        if config.WATCH_MODE == "events":
+            self.monitor = RefChangeMonitor(on_change=self.scheduler.submit)
+        self._stop = threading.Event()
+        # Active mapping ids the monitor was last synced with, and when
+        self._synced_ids: Set[int] = set()
+        self._synced_at: Optional[datetime] = None
+
+    @property
+    def interval(self) -> float:
+        return config.WATCH_RESYNC_SECONDS if self.monitor is not None else config.POLL_INTERVAL_SECONDS
+
+    def start(self):
+        self.leases.start()
+        if self.monitor is not None:
+            self.monitor.start()
+            # Catch commits made while no worker was running
+            self.scheduler.submit_active()
+
+    def tick(self):
+        """
+        Queues due jobs (retries) and the mappings whose next_due_at has passed: new
+        ones, and each mapping a poll interval after its last run in "poll" mode or
+        MAPPING_RECHECK_SECONDS after it in "events" mode, where the monitor queues
+        ref changes and the tick also keeps the watched set in sync.
+        Generations of mappings that were deleted or deactivated (possibly through
+        another node's API) are cancelled.
+        Only due, changed or running mappings are read, not the whole table.
+        """
+        self._cancel_removed()
+        if self.monitor is not None:
+            self._sync_monitor()
+        # Retries, coalesced jobs and jobs enqueued by API nodes become due without any ref change
+        self.scheduler.submit_due()
+        self.scheduler.submit_active(due_only=True)
+
+    def _cancel_removed(self):
+        running = {p.mapping_id for p in generation_registry.all() if p.state == "running"}
+        if not running:
+            return
+        with Session(engine) as session:
+            active = set(session.exec(
+                select(RepoMapping.id).where(RepoMapping.id.in_(running), RepoMapping.is_active == True)
+            ).all())
+        for mapping_id in running - active:
+            generation_registry.cancel(mapping_id)
+
+    def _sync_monitor(self):
+        """
+        Watches mappings added or updated since the last sync (with one tick of slack
+        for clock skew between nodes). The full active list is only reloaded when the
+        active count no longer matches, i.e. a mapping was deleted or deactivated.
+        """
+        now = datetime.utcnow()
+        query = select(RepoMapping.id, RepoMapping.source_path, RepoMapping.is_active)
+        if self._synced_at is None:
+            query = query.where(RepoMapping.is_active == True)
+        else:
+            query = query.where(RepoMapping.updated_at >= self._synced_at - timedelta(seconds=self.interval))
+        with Session(engine) as session:
+            changed = session.exec(query).all()
+            active_count = session.exec(
+                select(func.count()).select_from(RepoMapping).where(RepoMapping.is_active == True)
+            ).one()
+        for mapping_id, source_path, is_active in changed:
+            if is_active:
+                self.monitor.watch(mapping_id, source_path)
+                self._synced_ids.add(mapping_id)
+            else:
+                self.monitor.unwatch(mapping_id)
+                self._synced_ids.discard(mapping_id)
+        if len(self._synced_ids) != active_count:
+            mappings = active_mappings()
+            self.monitor.sync(mappings)
+            self._synced_ids = {mapping_id for mapping_id, _ in mappings}
+        self._synced_at = now
+
+    def run_forever(self):
+        """
+        Blocking loop for standalone workers; returns after stop().
+        """
+        self.start()
+        print(f"Worker {self.leases.owner} started ({self.scheduler.max_workers} workers)")
+        while True:
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"Error in worker loop: {e}")
+            if self._stop.wait(self.interval):
+                return
+
+    def stop(self):
+        self._stop.set()
+        if self.monitor is not None:
+            self.monitor.stop()
+        generation_registry.cancel_all()
+        self.scheduler.shutdown(wait=False)
+        self.leases.stop()
+        db_writer.stop()
@@ -1,31 +1,194 @@
 import os
+import tempfile
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+from src import config
 from src.core.events import DocumentationGeneratedEvent
 from src.db_models import RepoMapping
+from src.modules.doc_patch import PatchConflict, apply_operations
+
+
+class WriteError(Exception):
+    pass
+
+
+@dataclass
+class WriteResult:
+    written: List[str] = field(default_factory=list)
+    unchanged: List[str] = field(default_factory=list)
+    rejected: List[str] = field(default_factory=list)
+    # Docs whose edits no longer apply, with the reason; also listed in rejected
+    conflicts: Dict[str, str] = field(default_factory=dict)
+    # Resulting content of every written or unchanged doc, edits applied
+    contents: Dict[str, str] = field(default_factory=dict)
+    operations_applied: int = 0
+    bytes_written: int = 0
+    bytes_skipped: int = 0
+
+    def summary(self) -> str:
+        text = (f"{len(self.written)} written ({self.bytes_written} bytes), "
+                f"{len(self.unchanged)} unchanged ({self.bytes_skipped} bytes)")
+        if self.operations_applied:
+            text += f", {self.operations_applied} section edits"
+        if self.rejected:
+            text += f", {len(self.rejected)} rejected"
+        if self.conflicts:
+            text += f" (conflicting edits: {', '.join(sorted(self.conflicts))})"
+        return text
+
 
 class FileWriter:
-    def write(self, mapping: RepoMapping, event: DocumentationGeneratedEvent):
+    """
+    Writes a patch set to the docs folder in one batch.
+
+    Edit lists are applied to each doc's current content (or to the full content
+    generated for it in the same event) before anything is written; a doc whose
+    edits no longer apply is rejected and left as it is. Files whose content is
+    already identical are left untouched. Everything else is staged as temp
+    files next to its target first; targets are only replaced
+    (each with an atomic rename) once the whole batch is staged, so a failure
+    while staging leaves the docs tree as it was.
+    """
+
+    def __init__(self, fsync: bool = None):
+        self.fsync = config.WRITER_FSYNC if fsync is None else fsync
+
+    def write(self, mapping: RepoMapping, event: DocumentationGeneratedEvent) -> WriteResult:
         """
         Writes the generated patches to the destination docs folder.
+        Raises WriteError if the batch could not be staged or committed.
         """
-        if not event.patches:
+        result = WriteResult()
+        if not event.patches and not event.operations:
             print("No patches to write.")
-            return
-
-        base_path = mapping.docs_path
-        if not os.path.exists(base_path):
-            os.makedirs(base_path)
-
-        for rel_path, content in event.patches.items():
-            full_path = os.path.join(base_path, rel_path)
-            
-            # Ensure subdirectories exist
-            dir_name = os.path.dirname(full_path)
-            if dir_name and not os.path.exists(dir_name):
-                os.makedirs(dir_name)
-            
+            return result
+
+        base_path = os.path.realpath(mapping.docs_path)
+        changes = []
+        for rel_path in sorted(set(event.patches) | set(event.operations)):
+            full_path = self._resolve(base_path, rel_path)
+            if full_path is None:
+                print(f"Refusing to write {rel_path}: outside {base_path}")
+                result.rejected.append(rel_path)
+                continue
+            if os.path.isdir(full_path):
+                raise WriteError(f"Cannot write {rel_path}: a directory with that name exists")
+            content = event.patches.get(rel_path)
+            operations = event.operations.get(rel_path)
+            if operations:
+                try:
+                    content = apply_operations(content if content is not None else self._read(full_path), operations)
+                except PatchConflict as e:
+                    print(f"Edits to {rel_path} no longer apply, leaving it unchanged: {e}")
+                    result.conflicts[rel_path] = str(e)
+                    result.rejected.append(rel_path)
+                    continue
+                result.operations_applied += len(operations)
+            result.contents[rel_path] = content
+            data = content.encode("utf-8")
+            if self._is_unchanged(full_path, data):
+                result.unchanged.append(rel_path)
+                result.bytes_skipped += len(data)
+                continue
+            changes.append((rel_path, full_path, data))
+
+        if changes:
             try:
-                with open(full_path, "w", encoding="utf-8") as f:
-                    f.write(content)
-                print(f"Written {full_path}")
-            except Exception as e:
-                print(f"Failed to write {full_path}: {e}")
+                for dir_name in sorted({os.path.dirname(full_path) for _, full_path, _ in changes}):
+                    os.makedirs(dir_name, exist_ok=True)
+            except OSError as e:
+                raise WriteError(f"Failed to create docs folders: {e}") from e
+            staged = self._stage(changes)
+            self._commit(staged)
+            for rel_path, _, data in changes:
+                result.written.append(rel_path)
+                result.bytes_written += len(data)
+
+        print(f"Docs for {mapping.name or mapping.id}: {result.summary()}")
+        return result
+
+    @staticmethod
+    def _resolve(base_path: str, rel_path: str):
+        """
+        Absolute target path, or None if rel_path escapes the docs folder.
+        """
+        if not rel_path or os.path.isabs(rel_path):
+            return None
+        full_path = os.path.realpath(os.path.join(base_path, rel_path))
+        if os.path.commonpath([base_path, full_path]) != base_path or full_path == base_path:
+            return None
+        return full_path
+
+    @staticmethod
+    def _read(full_path: str) -> str:
+        try:
+            with open(full_path, encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            # Edits to a doc that does not exist yet: inserts still apply
+            return ""
+        except (OSError, UnicodeDecodeError) as e:
+            raise WriteError(f"Failed to read {full_path}: {e}") from e
+
+    @staticmethod
+    def _is_unchanged(full_path: str, data: bytes) -> bool:
+        try:
+            # Size differs in the common case, so most changed files are never read.
+            if os.stat(full_path).st_size != len(data):
+                return False
+            with open(full_path, "rb") as f:
+                return f.read() == data
+        except OSError:
+            return False
+
+    def _stage(self, changes) -> list:
+        staged = []
+        try:
+            for _, full_path, data in changes:
+                fd, tmp_path = tempfile.mkstemp(
+                    dir=os.path.dirname(full_path), prefix=f".{os.path.basename(full_path)}.", suffix=".tmp"
+                )
+                staged.append((tmp_path, full_path))
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                    if self.fsync:
+                        f.flush()
+                        os.fsync(f.fileno())
+                os.chmod(tmp_path, self._mode(full_path))
+        except OSError as e:
+            for tmp_path, _ in staged:
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+            raise WriteError(f"Failed to stage docs: {e}") from e
+        return staged
+
+    def _commit(self, staged: list):
+        for i, (tmp_path, full_path) in enumerate(staged):
+            try:
+                os.replace(tmp_path, full_path)
+            except OSError as e:
+                for leftover, _ in staged[i:]:
+                    try:
+                        os.unlink(leftover)
+                    except OSError:
+                        pass
+                raise WriteError(f"Failed to write {full_path}: {e}") from e
+        if self.fsync:
+            # Persist the renames themselves
+            for dir_name in sorted({os.path.dirname(full_path) for _, full_path in staged}):
+                fd = os.open(dir_name, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+
+    @staticmethod
+    def _mode(full_path: str) -> int:
+        # mkstemp creates 0600 files; keep the existing file's mode, or the usual 0644.
+        try:
+            return os.stat(full_path).st_mode & 0o777
+        except OSError:
+            return 0o644
@@ -0,0 +1,36 @@
+import pytest
+
+from src.core.events import DocOperation
+from src.modules.doc_patch import PatchConflict, apply_operations
+
+DOC = "".join(f"line {n}\n" for n in range(1, 11))
+
+
+def diff(text: str) -> DocOperation:
+    return DocOperation(op="diff", diff=text)
+
+
+@pytest.mark.parametrize("content, hunks, expected", [
+    # A hunk without old lines inserts after its anchor line
+    (DOC, "@@ -7,0 +8,1 @@\n+inserted\n", DOC.replace("line 7\n", "line 7\ninserted\n")),
+    (DOC, "@@ -0,0 +1,1 @@\n+first\n", "first\n" + DOC),
+    ("a\nb", "@@ -2,0 +3,1 @@\n+c\n", "a\nb\nc\n"),
+    (DOC, "@@ -2,1 +2,2 @@\n-line 2\n+line 2a\n+line 2b\n@@ -7,0 +9,1 @@\n+inserted\n",
+     DOC.replace("line 2\n", "line 2a\nline 2b\n").replace("line 7\n", "line 7\ninserted\n")),
+], ids=["after-anchor", "top-of-file", "no-trailing-newline", "after-growing-hunk"])
+def test_pure_insertion(content, hunks, expected):
+    assert apply_operations(content, [diff(hunks)]) == expected
+
+
+def test_pure_deletion():
+    assert apply_operations(DOC, [diff("@@ -4,1 +3,0 @@\n-line 4\n")]) == DOC.replace("line 4\n", "")
+
+
+def test_replacement_with_context():
+    hunks = "@@ -4,3 +4,3 @@\n line 4\n-line 5\n+line five\n line 6\n"
+    assert apply_operations(DOC, [diff(hunks)]) == DOC.replace("line 5\n", "line five\n")
+
+
+def test_mismatched_hunk_conflicts():
+    with pytest.raises(PatchConflict):
+        apply_operations(DOC, [diff("@@ -4,1 +4,1 @@\n-not there\n+x\n")])